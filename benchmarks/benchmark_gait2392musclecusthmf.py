@@ -0,0 +1,339 @@
+"""
+Offline benchmark of gait2392musclecusthmf using synthetic target bones made
+by warping the bundled reference bone surfaces.
+
+Times reference data loading, host mesh fitting (_hmf_seg), mapping to the
+segment ACS (_map_local_coords) and, if a gait2392 .osim file is given, the
+full cust_segment_muscle_points path for each segment. Reports throughput,
+peak traced memory (measured in a separate, untimed run) and fitting and
+muscle point errors against the known warp. Runs headless: the MAP Client
+step and its Qt dependencies are only imported when the MAP Client loads
+the plugin.
+
+Usage:
+    python benchmarks/benchmark_gait2392musclecusthmf.py [--segments pelvis femur_l]
+        [--repeats 3] [--seed 0] [--profile fast] [--osim gait2392_simbody.osim]
+        [--json out.json]
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import numpy as np
+
+REPO_DIR = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+)
+SEGMENTS = ('pelvis', 'femur_l', 'femur_r', 'tibia_l', 'tibia_r')
+
+
+def load_module():
+    """
+    Import gait2392musclecusthmf from this checkout. The plugin package only
+    imports the MAP Client step, and Qt, when the MAP Client loads it.
+    """
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    return importlib.import_module(
+        'mapclientplugins.fieldworkgait2392musclehmfstep.gait2392musclecusthmf'
+    )
+
+
+def random_warp(points, rng, affine_mag=0.1, warp_mag=0.02):
+    """
+    Make a random warp of the space around points: an affine transform
+    (rotation, anisotropic scaling, translation) followed by a smooth
+    sinusoidal displacement field.
+
+    Inputs
+    ------
+    points : nx3 array
+        Points the warp is scaled to
+    rng : numpy.random.Generator
+    affine_mag : float [optional]
+        Magnitude of the random rotation (radians) and scaling
+    warp_mag : float [optional]
+        Amplitude of the nonlinear displacement as a fraction of the size
+        of points
+
+    Returns
+    -------
+    warp : function
+        Maps an mx3 array to the warped mx3 array
+    """
+    centre = points.mean(0)
+    size = np.ptp(points, axis=0).max()
+    angles = rng.uniform(-affine_mag, affine_mag, 3)
+    cx, cy, cz = np.cos(angles)
+    sx, sy, sz = np.sin(angles)
+    rot = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]]) @ \
+        np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]]) @ \
+        np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+    affine = rot * (1.0 + rng.uniform(-affine_mag, affine_mag, 3))
+    shift = rng.normal(0.0, 0.1 * size, 3)
+    freq = rng.uniform(0.5, 1.5, (3, 3)) * 2.0 * np.pi / size
+    phase = rng.uniform(0.0, 2.0 * np.pi, (3, 3))
+    amp = warp_mag * size / 3.0
+
+    def warp(x):
+        x = x - centre
+        disp = amp * np.sin(
+            x[:, np.newaxis, :] * freq[np.newaxis] + phase[np.newaxis]
+        ).sum(-1)
+        return (x + disp) @ affine.T + centre + shift
+
+    return warp
+
+
+def synthetic_landmarks(segment_name, points):
+    """
+    Landmarks for making the femur and tibia ACS from the extremes of a bone
+    along its principal axes. Only for timing, they are not anatomical.
+    """
+    centre = points.mean(0)
+    _, _, axes = np.linalg.svd(points - centre, full_matrices=False)
+    proj = (points - centre) @ axes[:2].T
+    # the 5% of points at each end of the first principal axis, never empty
+    is_top = proj[:, 0] >= np.percentile(proj[:, 0], 95)
+    is_bottom = proj[:, 0] <= np.percentile(proj[:, 0], 5)
+    top, top_proj = points[is_top], proj[is_top, 1]
+    bottom, bottom_proj = points[is_bottom], proj[is_bottom, 1]
+    # extremes along the second principal axis at each end
+    side_a = bottom[np.argmax(bottom_proj)]
+    side_b = bottom[np.argmin(bottom_proj)]
+    if 'femur' in segment_name:
+        landmarks = {
+            'femur-HC': top.mean(0),
+            'femur-MEC': side_a,
+            'femur-LEC': side_b,
+        }
+    else:
+        landmarks = {
+            'tibiafibula-MC': top[np.argmax(top_proj)],
+            'tibiafibula-LC': top[np.argmin(top_proj)],
+            'tibiafibula-MM': side_a,
+            'tibiafibula-LM': side_b,
+        }
+    assert np.isfinite(np.array(list(landmarks.values()))).all()
+    return landmarks
+
+
+class _IdentityACS(object):
+
+    def map_local(self, x):
+        return np.array(x, dtype=float)
+
+
+def synthetic_bone_model(segment_name, points):
+    """
+    Stand-in for a GIAS3 bone model with the attributes used by
+    cust_segment_muscle_points
+    """
+    side = 'right' if segment_name.endswith('_r') else 'left'
+    return SimpleNamespace(
+        gf=SimpleNamespace(get_all_point_positions=lambda: points),
+        landmarks=synthetic_landmarks(segment_name, points),
+        side=side,
+        acs=_IdentityACS(),
+    )
+
+
+def measure(record, func, setup=None, quiet=True):
+    """
+    Add the wall time of func() to record and return its output. The peak
+    traced memory of func is measured in a separate run the first time a
+    record is measured, as tracing slows it down. setup() is called before
+    each run.
+    """
+    out = io.StringIO() if quiet else sys.stdout
+    with contextlib.redirect_stdout(out):
+        if 'peak_mb' not in record:
+            if setup is not None:
+                setup()
+            tracemalloc.start()
+            try:
+                func()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            record['peak_mb'] = peak / 2.0 ** 20
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        res = func()
+        record.setdefault('time', []).append(time.perf_counter() - t0)
+    return res
+
+
+def benchmark_segment(mod, segment_name, rng, repeats, params, omodel=None,
+                      path_point_index=None, quiet=True):
+    """
+    Benchmark one segment over repeats random warps
+
+    Returns
+    -------
+    results : dict
+        Timing, memory and error records of each benchmarked function
+    """
+    results = {}
+    host_elems = mod._hmf_params(params)['host_elems']
+
+    def load_data():
+        mod._osim_segment_data(segment_name, 'mm', host_elems)
+        mod._osim_segment_basis(segment_name, 'mm', host_elems)
+
+    rec = results.setdefault('_osim_segment_data (cold)', {})
+    for _ in range(repeats):
+        measure(rec, load_data, mod.clear_reference_cache, quiet)
+    rec = results.setdefault('_osim_segment_data (cached)', {})
+    for _ in range(repeats):
+        measure(rec, load_data, quiet=quiet)
+
+    (surf_pts, muscle_pts, surf_xi, muscle_xi, labels,
+     host_mesh_0) = mod._osim_segment_data(segment_name, 'mm', host_elems)
+    surf_basis, muscle_basis = mod._osim_segment_basis(
+        segment_name, 'mm', host_elems
+    )
+
+    for _ in range(repeats):
+        warp = random_warp(surf_pts, rng)
+        targ_pts = warp(surf_pts)
+        true_muscle_pts = warp(muscle_pts)
+        model = synthetic_bone_model(segment_name, targ_pts)
+
+        rec = results.setdefault('_hmf_seg', {})
+        cust_muscle_pts, rmse, _, _ = measure(
+            rec, lambda: mod._hmf_seg(
+                targ_pts, surf_pts, muscle_pts, surf_xi, muscle_xi,
+                mod._copy_host_mesh(host_mesh_0), params=params,
+                osim_surf_basis=surf_basis, osim_muscle_basis=muscle_basis,
+            ), quiet=quiet
+        )
+        rec.setdefault('rmse', []).append(float(rmse))
+        rec.setdefault('muscle_error', []).append(float(np.sqrt(
+            ((cust_muscle_pts - true_muscle_pts) ** 2).sum(1).mean()
+        )))
+
+        rec = results.setdefault('_map_local_coords', {})
+        measure(
+            rec, lambda: mod._map_local_coords(
+                segment_name, model, cust_muscle_pts
+            ), quiet=quiet
+        )
+
+        if omodel is not None:
+            rec = results.setdefault('cust_segment_muscle_points', {})
+            measure(
+                rec, lambda: mod.cust_segment_muscle_points(
+                    segment_name, model, omodel, in_unit='mm', out_unit='m',
+                    update_knee_splines=False,
+                    path_point_index=path_point_index, params=params,
+                ), quiet=quiet
+            )
+
+    return results
+
+
+def summarise(results):
+    """
+    Mean, min and throughput of each record's times and mean errors
+    """
+    summary = {}
+    for name, rec in results.items():
+        times = np.array(rec['time'])
+        s = {
+            'n': len(times),
+            'mean_s': float(times.mean()),
+            'min_s': float(times.min()),
+            'per_s': float(1.0 / times.mean()) if times.mean() > 0 else None,
+            'peak_mb': rec['peak_mb'],
+        }
+        for key in ('rmse', 'muscle_error'):
+            if key in rec:
+                s[key] = float(np.mean(rec[key]))
+        summary[name] = s
+    return summary
+
+
+def print_summary(summaries):
+    header = '{:10s} {:30s} {:>4s} {:>10s} {:>10s} {:>9s} {:>9s} {:>8s} {:>8s}'
+    row = '{:10s} {:30s} {:4d} {:10.4f} {:10.4f} {:9.2f} {:9.2f} {:>8s} {:>8s}'
+    print(header.format(
+        'segment', 'function', 'n', 'mean (s)', 'min (s)', 'per s',
+        'peak MB', 'rmse', 'muscle'
+    ))
+    for seg, summary in summaries.items():
+        for name, s in summary.items():
+            print(row.format(
+                seg, name, s['n'], s['mean_s'], s['min_s'], s['per_s'] or 0.0,
+                s['peak_mb'],
+                '{:.4f}'.format(s['rmse']) if 'rmse' in s else '-',
+                '{:.4f}'.format(s['muscle_error']) if 'muscle_error' in s else '-',
+            ))
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print('max RSS: {:.1f} MB'.format(maxrss / 1024.0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--segments', nargs='+', default=list(SEGMENTS),
+                        choices=SEGMENTS)
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='number of random warps per segment')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--profile', default=None,
+                        help='fitting profile preset (fast, default or '
+                             'accurate)')
+    parser.add_argument('--hmf-params', type=json.loads, default=None,
+                        help='JSON dict of fitting profile overrides')
+    parser.add_argument('--osim', default=None,
+                        help='gait2392 .osim file to benchmark '
+                             'cust_segment_muscle_points with')
+    parser.add_argument('--json', default=None,
+                        help='file to write the results to')
+    parser.add_argument('--verbose', action='store_true',
+                        help='show fitting output')
+    args = parser.parse_args(argv)
+
+    mod = load_module()
+    omodel = None
+    path_point_index = None
+    if args.osim is not None:
+        omodel = mod.osim.Model(filename=args.osim)
+        path_point_index = mod._muscle_path_point_index(omodel)
+
+    fittingprofile = importlib.import_module(
+        'mapclientplugins.fieldworkgait2392musclehmfstep.fittingprofile'
+    )
+    params = fittingprofile.fitting_profile(args.profile).updated(
+        args.hmf_params or {}
+    )
+    rng = np.random.default_rng(args.seed)
+    summaries = {}
+    for seg in args.segments:
+        results = benchmark_segment(
+            mod, seg, rng, args.repeats, params, omodel,
+            path_point_index, quiet=not args.verbose
+        )
+        summaries[seg] = summarise(results)
+
+    print_summary(summaries)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'args': vars(args),
+                'hmf_params': params.to_dict(),
+                'results': summaries,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,44 @@
 '''
 MAP Client Plugin
 '''
+import importlib.util
+import sys
 
-__version__ = '0.2.0'
-__author__ = 'Ju Zhang'
-__stepname__ = 'Fieldwork Gait2392 Muscle HMF'
-__location__ = 'https://github.com/mapclient-plugins/fieldworkgait2392musclehmfstep/archive/v0.1.0.zip'
+# plugin information read by the MAP Client when it loads the plugin
+_PLUGIN_INFO = {
+    '__version__': '0.2.0',
+    '__author__': 'Ju Zhang',
+    '__stepname__': 'Fieldwork Gait2392 Muscle HMF',
+    '__location__': 'https://github.com/mapclient-plugins/fieldworkgait2392musclehmfstep/archive/v0.1.0.zip',
+}
 
-# import class that derives itself from the step mountpoint.
-from mapclientplugins.fieldworkgait2392musclehmfstep import step
 
-# Import the resource file when the module is loaded,
-# this enables the framework to use the step icon.
-from . import resources_rc
+def _register_step():
+    # import class that derives itself from the step mountpoint.
+    from mapclientplugins.fieldworkgait2392musclehmfstep import step
+
+    # Import the resource file when the module is loaded,
+    # this enables the framework to use the step icon.
+    from . import resources_rc
+
+    globals().update(_PLUGIN_INFO)
+
+
+def __getattr__(name):
+    # The step is registered when the MAP Client reads the plugin
+    # information, which it does after importing each plugin, so that it
+    # is registered even if this package was imported before the MAP Client.
+    if name in _PLUGIN_INFO:
+        if importlib.util.find_spec('mapclient') is not None:
+            _register_step()
+        return _PLUGIN_INFO[name]
+    raise AttributeError(
+        'module {!r} has no attribute {!r}'.format(__name__, name)
+    )
+
+
+# Register the step straight away inside the MAP Client. Otherwise the
+# step, Qt and the resource file are not imported so that the command line
+# interface, the fitting module and their worker processes run without them.
+if 'mapclient' in sys.modules:
+    _register_step()
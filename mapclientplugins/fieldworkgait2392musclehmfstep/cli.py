@@ -0,0 +1,142 @@
+"""
+Headless command line interface for customising gait2392 muscle points of
+one or more subjects without the MAP Client or Qt.
+
+Subjects are given as a pickled LowerLimbAtlas and the .osim file to
+customise, either on the command line or in a JSON manifest:
+
+    gait2392-muscle-hmf -c step_config.json -o output_dir \\
+        --subject subject01 subject01_ll.pkl subject01.osim
+
+    gait2392-muscle-hmf -c step_config.json -o output_dir -m manifest.json
+
+where manifest.json is a list of {"id": ..., "ll": ..., "osim": ...}
+objects. Relative paths in a manifest are relative to the manifest file.
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from mapclientplugins.fieldworkgait2392musclehmfstep.constants import DEFAULT_CONFIG
+
+
+def _read_manifest(filename):
+    """
+    Read the (subject_id, ll path, osim path) of each subject in a JSON
+    manifest
+    """
+    with open(filename, 'r') as f:
+        entries = json.load(f)
+    root = os.path.dirname(os.path.abspath(filename))
+    return [
+        (str(e['id']), os.path.join(root, e['ll']), os.path.join(root, e['osim']))
+        for e in entries
+    ]
+
+
+def _json_default(o):
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    raise TypeError('{} is not JSON serialisable'.format(type(o)))
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog='gait2392-muscle-hmf',
+        description='Customise gait2392 muscle points by host mesh fitting '
+                    'the bone geometry of LowerLimbAtlas models.',
+    )
+    parser.add_argument(
+        '-c', '--config',
+        help='JSON config of the MAP Client step. Missing options take their '
+             'default values.'
+    )
+    parser.add_argument(
+        '-o', '--output-dir', required=True,
+        help='directory to write the customised {subject id}.osim files to'
+    )
+    parser.add_argument(
+        '-s', '--subject', nargs=3, action='append', default=[],
+        metavar=('ID', 'LL_PICKLE', 'OSIM'),
+        help='subject id, pickled LowerLimbAtlas and .osim file to customise. '
+             'Can be repeated.'
+    )
+    parser.add_argument(
+        '-m', '--manifest', action='append', default=[],
+        help='JSON list of {"id", "ll", "osim"} subjects. Can be repeated.'
+    )
+    parser.add_argument(
+        '-w', '--workers', type=int, default=None,
+        help='number of worker processes. 0 to run in this process. Defaults '
+             'to the number of CPUs.'
+    )
+    parser.add_argument(
+        '-r', '--records',
+        help='JSON file to write the per-subject records to. Defaults to '
+             'records.json in the output directory.'
+    )
+    return parser
+
+
+def main(argv=None):
+    """
+    Run the command line interface. Returns the exit status: 0 if all
+    subjects were customised, 1 if any failed.
+    """
+    parser = make_parser()
+    args = parser.parse_args(argv)
+
+    config = dict(DEFAULT_CONFIG)
+    if args.config:
+        with open(args.config, 'r') as f:
+            config.update(json.load(f))
+
+    subjects = [tuple(s) for s in args.subject]
+    for manifest in args.manifest:
+        subjects.extend(_read_manifest(manifest))
+    if not subjects:
+        parser.error('no subjects given, use --subject or --manifest')
+
+    # imported here so that --help and argument errors do not wait for
+    # gias3 and OpenSim
+    from mapclientplugins.fieldworkgait2392musclehmfstep.gait2392musclecusthmf import (
+        check_cohort_output_paths, customise_cohort
+    )
+
+    try:
+        check_cohort_output_paths(
+            [s[0] for s in subjects], config, args.output_dir
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    records = customise_cohort(
+        subjects, config, workers=args.workers, output_dir=args.output_dir
+    )
+
+    records_file = args.records or os.path.join(args.output_dir, 'records.json')
+    with open(records_file, 'w') as f:
+        json.dump(records, f, indent=2, default=_json_default)
+
+    failed = [r for r in records if r['error'] is not None]
+    for r in records:
+        if r['error'] is None:
+            print('{}: {} ({:.1f} s)'.format(
+                r['subject'], r['output'] or r['delta'], r['time']
+            ))
+        else:
+            print('{}: FAILED\n{}'.format(r['subject'], r['error']), file=sys.stderr)
+    print('{} of {} subjects customised, records in {}'.format(
+        len(records) - len(failed), len(records), records_file
+    ))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,13 @@
 import os
 from PySide6 import QtWidgets
 from mapclientplugins.fieldworkgait2392musclehmfstep.ui_configuredialog import Ui_ConfigureDialog
-from mapclientplugins.fieldworkgait2392musclehmfstep.gait2392musclecusthmf import VALID_UNITS
+from mapclientplugins.fieldworkgait2392musclehmfstep.constants import VALID_UNITS, VALID_PARALLEL_MODES
+from mapclientplugins.fieldworkgait2392musclehmfstep.fittingprofile import DEFAULT_PROFILE, PRESETS, fitting_profile
 
 INVALID_STYLE_SHEET = 'background-color: rgba(239, 0, 0, 50)'
 DEFAULT_STYLE_SHEET = ''
+# fitting profile combo box entry for parameters that are not a preset
+CUSTOM_PROFILE = 'custom'
 
 
 class ConfigureDialog(QtWidgets.QDialog):
@@ -28,6 +31,16 @@ class ConfigureDialog(QtWidgets.QDialog):
         # Set a place holder for a callable that will get set from the step.
         # We will use this method to decide whether the identifier is unique.
         self.identifierOccursCount = None
+        # Configuration last set on the dialog. Options without a widget are
+        # passed through getConfig unchanged.
+        self._config = {}
+        # Fitting profile the fitting parameter fields were last set from.
+        # Parameters without a field are taken from it.
+        self._fittingProfile = fitting_profile()
+        # hmf_params of the last set configuration. They override the
+        # fitting profile of every segment, so the fields show their values
+        # and edits of those fields are saved to them.
+        self._hmfParams = {}
 
         self._setupDialog()
         self._makeConnections()
@@ -36,11 +49,40 @@ class ConfigureDialog(QtWidgets.QDialog):
         for s in VALID_UNITS:
             self._ui.comboBox_in_unit.addItem(s)
             self._ui.comboBox_out_unit.addItem(s)
+        for s in VALID_PARALLEL_MODES:
+            self._ui.comboBox_parallel.addItem(s)
+        for s in PRESETS:
+            self._ui.comboBox_fitting_profile.addItem(s)
+        self._ui.comboBox_fitting_profile.addItem(CUSTOM_PROFILE)
+
+    def _fittingWidgets(self):
+        ui = self._ui
+        return (ui.spinBox_maxit, ui.lineEdit_xtol, ui.lineEdit_sobw,
+                ui.spinBox_host_elems_x, ui.spinBox_host_elems_y,
+                ui.spinBox_host_elems_z, ui.spinBox_reg_sample,
+                ui.lineEdit_rmse_target, ui.lineEdit_min_improvement)
+
+    def _floatLineEdits(self):
+        ui = self._ui
+        return {
+            'xtol': ui.lineEdit_xtol,
+            'sobw': ui.lineEdit_sobw,
+            'rmse_target': ui.lineEdit_rmse_target,
+            'min_improvement': ui.lineEdit_min_improvement,
+        }
 
     def _makeConnections(self):
         self._ui.lineEdit0.textChanged.connect(self.validate)
         self._ui.lineEdit_osim_output_dir.textChanged.connect(self._osimOutputDirEdited)
         self._ui.pushButton_osim_output_dir.clicked.connect(self._osimOutputDirClicked)
+        self._ui.comboBox_fitting_profile.currentTextChanged.connect(self._fittingProfileChanged)
+        for w in self._fittingWidgets():
+            if isinstance(w, QtWidgets.QLineEdit):
+                w.textEdited.connect(self._fittingParameterEdited)
+            else:
+                w.valueChanged.connect(self._fittingParameterEdited)
+        for w in self._floatLineEdits().values():
+            w.textChanged.connect(self.validate)
 
     def accept(self):
         '''
@@ -78,7 +120,15 @@ class ConfigureDialog(QtWidgets.QDialog):
         else:
             self._ui.lineEdit_osim_output_dir.setStyleSheet(INVALID_STYLE_SHEET)
 
-        valid = idValid and osimOutputDirValid
+        fittingValid = True
+        for name, w in self._floatLineEdits().items():
+            if self._fittingParameter(name) is None:
+                w.setStyleSheet(INVALID_STYLE_SHEET)
+                fittingValid = False
+            else:
+                w.setStyleSheet(DEFAULT_STYLE_SHEET)
+
+        valid = idValid and osimOutputDirValid and fittingValid
         self._ui.buttonBox.button(QtWidgets.QDialogButtonBox.Ok).setEnabled(valid)
 
         return valid
@@ -90,7 +140,7 @@ class ConfigureDialog(QtWidgets.QDialog):
         identifier over the whole of the workflow.
         '''
         self._previousIdentifier = self._ui.lineEdit0.text()
-        config = {}
+        config = dict(self._config)
         config['identifier'] = self._ui.lineEdit0.text()
         config['osim_output_dir'] = self._ui.lineEdit_osim_output_dir.text()
         config['in_unit'] = self._ui.comboBox_in_unit.currentText()
@@ -107,6 +157,11 @@ class ConfigureDialog(QtWidgets.QDialog):
             config['static_vas'] = True
         else:
             config['static_vas'] = False
+        config['parallel'] = self._ui.comboBox_parallel.currentText()
+        config['parallel_workers'] = self._ui.spinBox_parallel_workers.value()
+        config['fitting_profile'] = self._fittingProfileConfig()
+        if self._hmfParams:
+            config['hmf_params'] = self._hmfParamsConfig()
         return config
 
     def setConfig(self, config):
@@ -115,6 +170,7 @@ class ConfigureDialog(QtWidgets.QDialog):
         set the _previousIdentifier value so that we can check uniqueness of the
         identifier over the whole of the workflow.
         '''
+        self._config = dict(config)
         self._previousIdentifier = config['identifier']
         self._ui.lineEdit0.setText(config['identifier'])
         self._previousOsimOutputDir = config['osim_output_dir']
@@ -147,6 +203,114 @@ class ConfigureDialog(QtWidgets.QDialog):
         else:
             self._ui.checkBox_static_vas.setChecked(bool(False))
 
+        self._ui.comboBox_parallel.setCurrentIndex(
+            VALID_PARALLEL_MODES.index(
+                config.get('parallel', 'serial')
+            )
+        )
+        self._ui.spinBox_parallel_workers.setValue(
+            config.get('parallel_workers') or 0
+        )
+
+        profile = config.get('fitting_profile', DEFAULT_PROFILE)
+        self._hmfParams = dict(config.get('hmf_params') or {})
+        self._setFittingParameters(fitting_profile(profile))
+        self._setFittingProfileName(
+            profile if isinstance(profile, str) else CUSTOM_PROFILE
+        )
+
+    def _setFittingProfileName(self, name):
+        combo = self._ui.comboBox_fitting_profile
+        combo.blockSignals(True)
+        combo.setCurrentText(name)
+        combo.blockSignals(False)
+
+    def _setFittingParameters(self, profile):
+        '''
+        Show the parameters of a FittingProfile, updated with hmf_params,
+        without marking the profile as custom.
+        '''
+        self._fittingProfile = profile
+        profile = profile.updated(self._hmfParams)
+        ui = self._ui
+        for w in self._fittingWidgets():
+            w.blockSignals(True)
+        ui.spinBox_maxit.setValue(profile.maxit)
+        for name, w in self._floatLineEdits().items():
+            w.setText(repr(float(getattr(profile, name))))
+        ui.spinBox_host_elems_x.setValue(profile.host_elems[0])
+        ui.spinBox_host_elems_y.setValue(profile.host_elems[1])
+        ui.spinBox_host_elems_z.setValue(profile.host_elems[2])
+        ui.spinBox_reg_sample.setValue(profile.reg_sample)
+        for w in self._fittingWidgets():
+            w.blockSignals(False)
+        self.validate()
+
+    def _fittingParameter(self, name):
+        '''
+        Value of a floating point fitting parameter field, None if it is
+        not a non-negative number.
+        '''
+        try:
+            value = float(self._floatLineEdits()[name].text())
+        except ValueError:
+            return None
+        return value if value >= 0 else None
+
+    def _fittingParameters(self):
+        '''
+        Fitting parameters of the dialog fields. Invalid fields are left
+        out.
+        '''
+        ui = self._ui
+        params = {
+            'maxit': ui.spinBox_maxit.value(),
+            'host_elems': [ui.spinBox_host_elems_x.value(),
+                           ui.spinBox_host_elems_y.value(),
+                           ui.spinBox_host_elems_z.value()],
+            'reg_sample': ui.spinBox_reg_sample.value(),
+        }
+        for name in self._floatLineEdits():
+            value = self._fittingParameter(name)
+            if value is not None:
+                params[name] = value
+        return params
+
+    def _fittingProfileConfig(self):
+        '''
+        The fitting_profile config value: the preset name, or for a custom
+        profile the last set profile with the dialog's parameters that are
+        not overridden by hmf_params.
+        '''
+        name = self._ui.comboBox_fitting_profile.currentText()
+        if name != CUSTOM_PROFILE:
+            return name
+        params = dict(
+            (k, v) for k, v in self._fittingParameters().items()
+            if k not in self._hmfParams
+        )
+        return self._fittingProfile.updated(params).to_dict()
+
+    def _hmfParamsConfig(self):
+        '''
+        The hmf_params config value: the last set hmf_params with the
+        dialog's parameters of the fields they override.
+        '''
+        params = dict(self._hmfParams)
+        for k, v in self._fittingParameters().items():
+            if k in params:
+                params[k] = v
+        return params
+
+    def _fittingProfileChanged(self, name):
+        if name != CUSTOM_PROFILE:
+            # keep edits of the fields overridden by hmf_params
+            self._hmfParams = self._hmfParamsConfig()
+            self._setFittingParameters(fitting_profile(name))
+
+    def _fittingParameterEdited(self):
+        self._setFittingProfileName(CUSTOM_PROFILE)
+
     def _osimOutputDirClicked(self):
         location = QtWidgets.QFileDialog.getExistingDirectory(self, 'Select Directory', self._previousOsimOutputDir)
         if location:
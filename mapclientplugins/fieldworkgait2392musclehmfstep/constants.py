@@ -0,0 +1,36 @@
+"""
+Options of the gait2392 muscle customisation that are needed without the
+fitting code, e.g. by the MAP Client step and its configuration dialog.
+Importing this module does not import gias3 or OpenSim.
+"""
+
+VALID_UNITS = ('nm', 'um', 'mm', 'cm', 'm', 'km')
+VALID_PARALLEL_MODES = ('serial', 'threads', 'processes')
+# muscle_report config values other than a .csv or .json file path
+MUSCLE_REPORT_OFF = ''
+MUSCLE_REPORT_LOG = 'log'
+# osim_output_format values: the whole customised model, only the changes to
+# its muscle geometry (see muscle_geometry_delta) or both
+VALID_OSIM_OUTPUT_FORMATS = ('model', 'delta', 'both')
+# default gait2392MuscleCustomiser config, also the step's default
+# configuration apart from its identifier
+DEFAULT_CONFIG = {
+    'osim_output_dir': './gait2392_simbody_custom.osim',
+    'osim_output_name': '',
+    'osim_output_format': 'model',
+    'async_write': False,
+    'in_unit': 'mm',
+    'out_unit': 'm',
+    'write_osim_file': True,
+    'update_knee_splines': False,
+    'static_vas': False,
+    'parallel': 'serial',
+    'parallel_workers': 0,
+    'fit_cache_dir': '',
+    'fit_cache_max_mb': 0,
+    'fitting_profile': 'default',
+    'segment_fitting_profiles': {},
+    'muscle_report': MUSCLE_REPORT_OFF,
+    'timings_file': '',
+    'profile_file': '',
+}
@@ -0,0 +1,191 @@
+"""
+Host mesh fitting parameters of the gait2392 muscle customisation and named
+presets of them. Importing this module does not import gias3 or OpenSim so
+that it can be used by the step's configuration dialog.
+"""
+import dataclasses
+from dataclasses import dataclass, field
+
+VALID_HMF_OBJECTIVES = ('correspondence', 'nearest')
+VALID_HMF_SOLVERS = ('auto', 'leastsq', 'sparse')
+DEFAULT_PROFILE = 'default'
+
+
+@dataclass
+class FittingProfile(object):
+    """
+    Parameters of the registration and host mesh fit of a segment.
+
+    maxit is the maximum number of host mesh fit iterations (Jacobian
+    evaluations). Without the analytic Jacobian, objective evaluations are
+    limited to maxit times the number of host mesh parameters as in gias3's
+    hostMeshFitPoints, which is about maxit iterations.
+    sobd and sobw are the number of points per element and weight of the
+    host mesh Sobolev smoothing, xtol the relative parameter tolerance of
+    the fit. levels is a list of point counts of spatially subsampled
+    coarse registration and host mesh fitting stages run before fitting
+    all points, e.g. [250, 1000]. Empty for a single stage.
+
+    objective is one of VALID_HMF_OBJECTIVES: "correspondence" fits each
+    reference surface point to the target point with the same index,
+    "nearest" fits to the closest target point so that the target can have
+    any number of points. symmetric adds target to closest fitted point
+    distances to the "nearest" objective. They are minimised but not
+    included in the reported RMS distance of the fitted points, which
+    rmse_target and plateau_tol apply to. analytic_jacobian uses the exact
+    Jacobian of the objective instead of finite differences.
+
+    host_elems is the number of host mesh elements along x, y and z. The
+    reference host meshes are single elements that are subdivided for more
+    elements. solver is one of VALID_HMF_SOLVERS: "leastsq" is MINPACK's
+    dense Levenberg-Marquardt, "sparse" is a trust region method on the
+    sparse Jacobian with an iterative (LSMR) subproblem solver that scales
+    to many elements, "auto" uses "sparse" for multi-element host meshes.
+    host_mesh_pad is the padding around the reference points of a host
+    mesh made when none is given.
+
+    Corresponding points are registered by a closed-form rigid and scale
+    transform. If reg_refine is True, it is refined by an iterative
+    registration on reg_sample points with tolerance reg_xtol, which are
+    also used by the "nearest" and coarse-to-fine (levels) registrations.
+    Like the host mesh fit, the refinement is a least squares fit of the
+    squared point distances, i.e. it minimises the sum of their fourth
+    powers, which makes a better starting point for some bones.
+
+    The fit stops early once the RMS distance of the fitted points is at
+    most rmse_target, once an iteration reduces the objective by less
+    than the fraction min_improvement, or once the RMS distance decreases
+    by less than the fraction plateau_tol over plateau_window iterations.
+    max_time is the wall-clock budget in seconds of the host mesh fits of
+    a segment. 0 disables any of these criteria.
+    """
+    maxit: int = 50
+    sobd: list = field(default_factory=lambda: [4, 4, 4])
+    sobw: float = 1e-5
+    xtol: float = 1e-6
+    levels: list = field(default_factory=list)
+    objective: str = 'correspondence'
+    symmetric: bool = False
+    analytic_jacobian: bool = True
+    host_elems: list = field(default_factory=lambda: [1, 1, 1])
+    solver: str = 'auto'
+    host_mesh_pad: float = 0.25
+    reg_sample: int = 1000
+    reg_xtol: float = 1e-6
+    reg_refine: bool = True
+    rmse_target: float = 0.0
+    min_improvement: float = 0.0
+    plateau_window: int = 0
+    plateau_tol: float = 1e-4
+    max_time: float = 0.0
+
+    def __post_init__(self):
+        if self.objective not in VALID_HMF_OBJECTIVES:
+            raise ValueError(
+                'Invalid objective {}. Must be one of {}'.format(
+                    self.objective, VALID_HMF_OBJECTIVES
+                )
+            )
+        if self.solver not in VALID_HMF_SOLVERS:
+            raise ValueError(
+                'Invalid solver {}. Must be one of {}'.format(
+                    self.solver, VALID_HMF_SOLVERS
+                )
+            )
+        if len(self.host_elems) != 3 or min(self.host_elems) < 1:
+            raise ValueError(
+                'Invalid host_elems {}. Must be 3 positive integers'.format(
+                    self.host_elems
+                )
+            )
+
+    @classmethod
+    def fields(cls):
+        """
+        Names of the profile parameters
+        """
+        return tuple(f.name for f in dataclasses.fields(cls))
+
+    @classmethod
+    def from_dict(cls, params):
+        """
+        Make a profile from a dict of parameters. Missing parameters take
+        their default values.
+        """
+        unknown = set(params) - set(cls.fields())
+        if unknown:
+            raise ValueError(
+                'Unknown fitting parameters {}'.format(sorted(unknown))
+            )
+        return cls(**params)
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
+
+    def updated(self, params):
+        """
+        A copy of the profile with the given parameters changed
+        """
+        p = self.to_dict()
+        p.update(params)
+        return self.from_dict(p)
+
+
+# named fitting profiles. "fast" trades accuracy for throughput, e.g. for
+# large batches, "accurate" uses a 2x2x2 host mesh and runs more
+# iterations. The Sobolev penalty is summed over the host mesh elements, so
+# "accurate" scales sobw by about 1 / 8: with the default 1e-5 the 2x2x2
+# mesh fits the surfaces closer but moves the tibia muscle points further
+# from the benchmark's known warps than the default profile.
+PRESETS = {
+    'fast': FittingProfile(
+        maxit=15, xtol=1e-4, reg_sample=300, min_improvement=1e-3,
+    ),
+    'default': FittingProfile(),
+    'accurate': FittingProfile(
+        maxit=100, sobw=1e-6, xtol=1e-8, levels=[500],
+        host_elems=[2, 2, 2], reg_sample=3000, reg_xtol=1e-8,
+    ),
+}
+
+
+def fitting_profile(profile=None):
+    """
+    Make a FittingProfile from a preset name, a dict of parameters (applied
+    to the default preset), a FittingProfile or None for the default
+    preset
+    """
+    if profile is None:
+        profile = DEFAULT_PROFILE
+    if isinstance(profile, FittingProfile):
+        return profile
+    if isinstance(profile, str):
+        if profile not in PRESETS:
+            raise ValueError(
+                'Unknown fitting profile {}. Must be one of {}'.format(
+                    profile, sorted(PRESETS)
+                )
+            )
+        return PRESETS[profile].updated({})
+    return PRESETS[DEFAULT_PROFILE].updated(profile)
+
+
+def segment_fitting_profile(config, segment_name):
+    """
+    The fitting profile of a segment set by a gait2392MuscleCustomiser
+    config: config['fitting_profile'], replaced (preset name) or updated
+    (dict) by config['segment_fitting_profiles'][segment_name], then
+    updated with config['hmf_params'].
+    """
+    profile = fitting_profile(config.get('fitting_profile'))
+    segment_profile = (
+        config.get('segment_fitting_profiles') or {}
+    ).get(segment_name)
+    if isinstance(segment_profile, (str, FittingProfile)):
+        profile = fitting_profile(segment_profile)
+    elif segment_profile:
+        profile = profile.updated(segment_profile)
+    hmf_params = config.get('hmf_params')
+    if hmf_params:
+        profile = profile.updated(hmf_params)
+    return profile
@@ -4,13 +4,41 @@ the bone surface
 """
 import os
 import numpy as np
+import contextlib
 import copy
+import cProfile
+import functools
+import hashlib
+import json
+import logging
+import pickle
+import struct
+import time
+import traceback
+from concurrent import futures
+import threading
+import zipfile
+from collections import namedtuple
+from collections.abc import Sequence
+from scipy import sparse
+from scipy.optimize import leastsq, least_squares
+from scipy.spatial import cKDTree
+from gias3.fieldwork.field import ensemble_field_function
 from gias3.fieldwork.field import geometric_field
-from gias3.fieldwork.field.tools import fitting_tools
+from gias3.fieldwork.field import geometric_field_fitter as GFF
 from gias3.common import transform3D
 from gias3.registration import alignment_fitting as af
 from gias3.musculoskeletal.bonemodels import bonemodels
 from gias3.musculoskeletal import osim
+from mapclientplugins.fieldworkgait2392musclehmfstep.constants import (
+    VALID_PARALLEL_MODES, MUSCLE_REPORT_OFF, MUSCLE_REPORT_LOG,
+    VALID_OSIM_OUTPUT_FORMATS,
+)
+from mapclientplugins.fieldworkgait2392musclehmfstep.fittingprofile import (
+    VALID_HMF_SOLVERS, FittingProfile, segment_fitting_profile,
+)
+
+log = logging.getLogger(__name__)
 
 SELF_DIRECTORY = os.path.split(__file__)[0]
 DATA_DIR = os.path.join(SELF_DIRECTORY, 'data/fieldwork_geometry')
@@ -19,7 +47,50 @@ VALID_SEGS = set(['pelvis',
                   'tibia_l', 'tibia_r',
                   ])
 OSIM_FILENAME = 'gait2392_simbody.osim'
-VALID_UNITS = ('nm', 'um', 'mm', 'cm', 'm', 'km')
+# suffix of the muscle geometry delta file written next to a model, see
+# muscle_geometry_delta
+MUSCLE_DELTA_SUFFIX = '_muscle_delta.json'
+MUSCLE_DELTA_VERSION = 1
+# reference data file patterns
+HOST_MESH_FILE_PAT = '{}.hostmesh.{}'
+SURF_PTCLD_FILE_PAT = '{}.nodes'
+SURF_XI_FILE_PAT = '{}.nodes.xi'
+MUSCLE_PTCLD_FILE_PAT = '{}.muscles.txt'
+MUSCLE_XI_FILE_PAT = '{}.muscle.xi'
+# binary archive of a segment's reference data, see build_reference_archive
+ARCHIVE_FILE_PAT = '{}.npz'
+# size of the cube _refine_host_mesh builds its element grid in
+HOST_MESH_XI_SCALE = 1000.0
+# default host mesh fitting parameters, see FittingProfile
+HMF_PARAMS = FittingProfile().to_dict()
+# bump when a change to the fitting would change cached fit results
+FIT_CACHE_VERSION = 6
+# (muscle name pattern, path point number) of the tibia MovingPathPoints
+# whose splines are customised, formatted with the side (l or r)
+TIBIA_SPLINE_PATH_POINTS = (
+    ('vas_med_{}', '5'),
+    ('vas_int_{}', '4'),
+    ('vas_lat_{}', '5'),
+    ('rect_fem_{}', '3'),
+)
+# (gait2392 segment name, LowerLimbAtlas model name) in customisation order
+SEGMENT_MODELS = (
+    ('pelvis', 'pelvis'),
+    ('femur_l', 'femur-l'),
+    ('tibia_l', 'tibiafibula-l'),
+    ('femur_r', 'femur-r'),
+    ('tibia_r', 'tibiafibula-r'),
+)
+# set to a unit (e.g. "mm") to load all reference segment data on import
+PRELOAD_ENV_VAR = 'GAIT2392_MUSCLE_HMF_PRELOAD'
+
+# host mesh material coordinates of a set of points: an (n,) int array of
+# element numbers and an (n, 3) float array of element xi coordinates
+XiPoints = namedtuple('XiPoints', ['elems', 'xi'])
+
+# reference segment data cache {(segment name, unit[, host_elems]): data}
+_REFERENCE_CACHE = {}
+_REFERENCE_CACHE_LOCK = threading.Lock()
 
 
 def dim_unit_scaling(in_unit, out_unit):
@@ -65,32 +136,414 @@ def dim_unit_scaling(in_unit, out_unit):
     return unit_vals[in_unit] / unit_vals[out_unit]
 
 
+def _femur_opensim_acs(femur_model):
+    return bonemodels.model_alignment.createFemurACSOpenSim(
+        femur_model.landmarks['femur-HC'],
+        femur_model.landmarks['femur-MEC'],
+        femur_model.landmarks['femur-LEC'],
+        side=femur_model.side
+    )
+
+
+def _tibiafibula_opensim_acs(tibiafibula_model):
+    return bonemodels.model_alignment.createTibiaFibulaACSOpenSim(
+        tibiafibula_model.landmarks['tibiafibula-MM'],
+        tibiafibula_model.landmarks['tibiafibula-LM'],
+        tibiafibula_model.landmarks['tibiafibula-MC'],
+        tibiafibula_model.landmarks['tibiafibula-LC'],
+        side=tibiafibula_model.side
+    )
+
+
 def _update_femur_opensim_acs(femur_model):
-    femur_model.acs.update(
-        *bonemodels.model_alignment.createFemurACSOpenSim(
-            femur_model.landmarks['femur-HC'],
-            femur_model.landmarks['femur-MEC'],
-            femur_model.landmarks['femur-LEC'],
-            side=femur_model.side
+    femur_model.acs.update(*_femur_opensim_acs(femur_model))
+
+
+def _update_tibiafibula_opensim_acs(tibiafibula_model):
+    tibiafibula_model.acs.update(*_tibiafibula_opensim_acs(tibiafibula_model))
+
+
+def _read_only(arr):
+    """
+    Flag an array as read-only so that cached reference data cannot be
+    modified in place by callers.
+    """
+    arr.setflags(write=False)
+    return arr
+
+
+def _copy_host_mesh(host_mesh):
+    """
+    Make a copy of a reference host mesh that can be transformed and fitted
+    without modifying the original. The ensemble field function (mesh
+    topology and basis) is shared, only the field parameters and geometric
+    points are copied.
+    """
+    hm = copy.copy(host_mesh)
+    hm.field_parameters = host_mesh.field_parameters.copy()
+    hm.points = copy.deepcopy(host_mesh.points)
+    return hm
+
+
+def _as_xi_points(mat_points):
+    """
+    Convert material points to XiPoints. mat_points can be an XiPoints, an
+    (n, 4) array of [elem, xi1, xi2, xi3] rows or a list of [elem, xi]
+    pairs as returned by GeometricField.find_closest_material_points.
+    """
+    if isinstance(mat_points, XiPoints):
+        return mat_points
+    if isinstance(mat_points, np.ndarray) and mat_points.ndim == 2:
+        return XiPoints(
+            mat_points[:, 0].astype(int),
+            np.ascontiguousarray(mat_points[:, 1:4], dtype=float),
         )
+    if len(mat_points) == 0:
+        return XiPoints(np.zeros(0, dtype=int), np.zeros((0, 3)))
+    return XiPoints(
+        np.array([int(e) for e, _ in mat_points]),
+        np.array([xi for _, xi in mat_points], dtype=float),
     )
 
 
-def _update_tibiafibula_opensim_acs(tibiafibula_model):
-    tibiafibula_model.acs.update(
-        *bonemodels.model_alignment.createTibiaFibulaACSOpenSim(
-            tibiafibula_model.landmarks['tibiafibula-MM'],
-            tibiafibula_model.landmarks['tibiafibula-LM'],
-            tibiafibula_model.landmarks['tibiafibula-MC'],
-            tibiafibula_model.landmarks['tibiafibula-LC'],
-            side=tibiafibula_model.side
+def _host_mesh_basis_matrix(host_mesh, mat_points):
+    """
+    Assemble the sparse (n_points x n_nodes) matrix of host mesh basis
+    function values at fixed material points. Basis functions are evaluated
+    for all points in an element at once.
+
+    Inputs
+    ------
+    host_mesh : GeometricField instance
+    mat_points : XiPoints or list of [elem, xi]
+        Material coordinates of the points
+
+    Returns
+    -------
+    A : scipy.sparse.csc_matrix
+    """
+    mat_points = _as_xi_points(mat_points)
+    f = host_mesh.ensemble_field_function
+    if not f.is_flat():
+        f = f.flatten()[0]
+
+    rows = []
+    cols = []
+    vals = []
+    for elem in np.unique(mat_points.elems):
+        inds = np.where(mat_points.elems == elem)[0]
+        element = f.mesh.elements[elem]
+        b = f.basis[element.type].eval(mat_points.xi[inds].T)
+        emap = f.mapper._element_to_ensemble_map[elem]
+        ens_nodes = [emap[k][0][0] for k in list(emap.keys())]
+        rows.append(np.repeat(inds, len(ens_nodes)))
+        cols.append(np.tile(ens_nodes, len(inds)))
+        vals.append(np.asarray(b).reshape((len(ens_nodes), -1)).T.ravel())
+
+    n_nodes = f.get_number_of_ensemble_points()
+    if not rows:
+        return sparse.csc_matrix((len(mat_points.elems), n_nodes))
+    return sparse.csc_matrix(
+        (np.hstack(vals), (np.hstack(rows), np.hstack(cols))),
+        shape=(len(mat_points.elems), n_nodes),
+    )
+
+
+def _make_host_mesh_evaluator(host_mesh, mat_points, A=None):
+    """
+    Make a function that evaluates the coordinates of points at fixed
+    material coordinates in host_mesh given host mesh parameters. Same
+    interface as geometric_field.makeGeometricFieldEvaluatorSparse. A is
+    the basis matrix of mat_points if already calculated.
+    """
+    if A is None:
+        A = _host_mesh_basis_matrix(host_mesh, mat_points)
+    d = host_mesh.dimensions
+
+    def evaluator(P):
+        return (A @ P.reshape((d, -1)).T).T
+
+    return evaluator
+
+
+def _host_elems_key(host_elems):
+    """
+    host_elems as a tuple of 3 ints, or None for a single element
+    """
+    if host_elems is None:
+        return None
+    host_elems = tuple(int(n) for n in host_elems)
+    if len(host_elems) != 3 or min(host_elems) < 1:
+        raise ValueError(
+            'Invalid host_elems {}. Must be 3 positive integers'.format(
+                host_elems
+            )
         )
+    if host_elems == (1, 1, 1):
+        return None
+    return host_elems
+
+
+def _refine_host_mesh(host_mesh, host_elems):
+    """
+    Subdivide a single element quad444 host mesh into a regular grid of
+    host_elems quad444 elements. The nodes of the new mesh are evaluated
+    from host_mesh so both describe the same (tricubic) deformation and
+    embedded points keep their positions, see _refine_xi.
+
+    Inputs
+    ------
+    host_mesh : GeometricField instance
+        Single element quad444 host mesh
+    host_elems : list of 3 ints
+        Number of elements along xi1, xi2 and xi3
+
+    Returns
+    -------
+    refined_host_mesh : GeometricField instance
+    """
+    if len(host_mesh.ensemble_field_function.mesh.elements) != 1:
+        raise ValueError('Only single element host meshes can be refined')
+    # a mesh of a cube of side HOST_MESH_XI_SCALE, so that its scaled node
+    # coordinates are the xi of the new nodes in host_mesh. Nodes are
+    # merged with an absolute tolerance so a unit cube cannot be used.
+    refined = GFF.makeHostMeshMulti(
+        np.array([[0.0, 0.0, 0.0], [1.0, 1.0, 1.0]]).T * HOST_MESH_XI_SCALE,
+        0.0, 'quad444', list(host_elems),
+    )
+    node_xi = refined.field_parameters[:, :, 0].T / HOST_MESH_XI_SCALE
+    A = _host_mesh_basis_matrix(
+        host_mesh, XiPoints(np.zeros(len(node_xi), dtype=int), node_xi)
+    )
+    refined.set_field_parameters(
+        _make_host_mesh_evaluator(host_mesh, None, A)(
+            host_mesh.field_parameters
+        )[:, :, np.newaxis]
+    )
+    return refined
+
+
+def _refine_xi(xi_points, host_elems):
+    """
+    Material coordinates in a mesh made by _refine_host_mesh of points with
+    material coordinates xi_points in the single element mesh. Elements of
+    the refined mesh are numbered with xi3 varying fastest, as in
+    geometric_field_fitter.makeHostMeshMulti.
+    """
+    xi_points = _as_xi_points(xi_points)
+    n = np.array(host_elems)
+    g = xi_points.xi * n
+    # points on or just outside the boundary stay in the boundary elements
+    ijk = np.clip(np.floor(g).astype(int), 0, n - 1)
+    elems = (ijk[:, 0] * n[1] + ijk[:, 1]) * n[2] + ijk[:, 2]
+    return XiPoints(elems, g - ijk)
+
+
+def _segment_text_files(name):
+    """
+    Paths of the text reference data files of a segment
+    """
+    return {
+        'surf_pts': os.path.join(DATA_DIR, SURF_PTCLD_FILE_PAT.format(name)),
+        'surf_xi': os.path.join(DATA_DIR, SURF_XI_FILE_PAT.format(name)),
+        'muscles': os.path.join(DATA_DIR, MUSCLE_PTCLD_FILE_PAT.format(name)),
+        'muscle_xi': os.path.join(DATA_DIR, MUSCLE_XI_FILE_PAT.format(name)),
+        'geof': os.path.join(DATA_DIR, HOST_MESH_FILE_PAT.format(name, 'geof')),
+        'ens': os.path.join(DATA_DIR, HOST_MESH_FILE_PAT.format(name, 'ens')),
+        'mesh': os.path.join(DATA_DIR, HOST_MESH_FILE_PAT.format(name, 'mesh')),
+    }
+
+
+def _segment_archive_file(name):
+    return os.path.join(DATA_DIR, ARCHIVE_FILE_PAT.format(name))
+
+
+def _read_segment_text(name):
+    """
+    Parse the text reference data files of a segment.
+
+    Returns a dict of arrays in the units of the data files (surface points
+    in mm, muscle points in m) and the host mesh.
+    """
+    files = _segment_text_files(name)
+
+    # reference muscle points & labels
+    _muscle_data = np.loadtxt(files['muscles'], dtype=str, ndmin=2)
+
+    data = {
+        'surf_pts': np.loadtxt(files['surf_pts']),
+        'surf_xi': np.loadtxt(files['surf_xi'], ndmin=2),
+        'muscle_labels': _muscle_data[:, 0],
+        'muscle_pts': _muscle_data[:, 1:4].astype(float),
+        'muscle_xi': np.loadtxt(files['muscle_xi'], ndmin=2),
+    }
+
+    # host mesh
+    data['host_mesh'] = geometric_field.load_geometric_field(
+        files['geof'], files['ens'], files['mesh'],
+    )
+    return data
+
+
+def _mmap_npz(filename):
+    """
+    Memory-map every array stored in an uncompressed .npz archive. Returns a
+    dict of read-only arrays keyed by array name.
+    """
+    arrays = {}
+    with zipfile.ZipFile(filename) as zf, open(filename, 'rb') as f:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(
+                    'Cannot memory-map compressed member {} of {}'.format(
+                        info.filename, filename
+                    )
+                )
+            # skip the local file header to reach the .npy data
+            f.seek(info.header_offset)
+            header = f.read(30)
+            name_len, extra_len = struct.unpack('<HH', header[26:30])
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            key = os.path.splitext(info.filename)[0]
+            if dtype.hasobject:
+                raise ValueError(
+                    'Cannot memory-map object array {} of {}'.format(
+                        key, filename
+                    )
+                )
+            if 0 in shape:
+                arrays[key] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[key] = np.memmap(
+                    filename, dtype=dtype, mode='r', offset=f.tell(),
+                    shape=shape, order='F' if fortran_order else 'C',
+                )
+    return arrays
+
+
+def _read_segment_archive(name):
+    """
+    Load the binary reference data archive of a segment. Returns the same
+    dict as _read_segment_text. Point, xi and label arrays are memory-mapped.
+    """
+    files = _segment_text_files(name)
+    data = _mmap_npz(_segment_archive_file(name))
+
+    # host mesh topology from the ensemble and mesh files, parameters from
+    # the archive
+    eff = ensemble_field_function.load_ensemble(files['ens'], files['mesh'])
+    hm = geometric_field.GeometricField(
+        str(data.pop('host_mesh_name')), 3, ensemble_field_function=eff
+    )
+    hm.set_field_parameters(np.array(data.pop('host_mesh_params')))
+    hm.ensemble_point_counter = hm.get_number_of_points()
+    data['host_mesh'] = hm
+    return data
+
+
+def _segment_archive_is_current(name):
+    """
+    True if the binary archive of a segment exists and is not older than any
+    of its text data files.
+    """
+    try:
+        archive_mtime = os.path.getmtime(_segment_archive_file(name))
+    except OSError:
+        return False
+    return all(
+        os.path.getmtime(f) <= archive_mtime
+        for f in _segment_text_files(name).values()
     )
 
 
-def _osim_segment_data(name, out_unit):
+def build_reference_archive(name):
     """
-    Reads bone surface and muscle point data for a segment
+    Convert the text reference data of a segment into a binary archive
+    ({name}.npz in DATA_DIR) that _osim_segment_data will memory-map in
+    preference to the text files.
+
+    Inputs
+    ------
+    name : str
+        Name of the model segment (pelvis, femur_{l|r}, tibia_{l|r})
+
+    Returns
+    -------
+    filename : str
+        Path of the written archive
+    """
+    data = _read_segment_text(name)
+    hm = data.pop('host_mesh')
+    filename = _segment_archive_file(name)
+    # write to a temporary file first so that readers never see a partial
+    # archive
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        np.savez(
+            f,
+            host_mesh_name=np.array(hm.name),
+            host_mesh_params=hm.get_field_parameters(),
+            **data
+        )
+    os.replace(tmp_filename, filename)
+    return filename
+
+
+def build_reference_archives(segments=None):
+    """
+    Build the binary reference data archives of the given segments. Defaults
+    to all segments in VALID_SEGS. Returns a list of the written archive
+    paths.
+    """
+    if segments is None:
+        segments = sorted(VALID_SEGS)
+    return [build_reference_archive(s) for s in segments]
+
+
+def _load_osim_segment_data(name, out_unit):
+    """
+    Load the reference data of a segment, preferring the binary archive and
+    falling back to the text files. See _osim_segment_data for inputs and
+    outputs.
+    """
+
+    SURF_PTS_MULT = dim_unit_scaling('mm', out_unit)
+    MUSCLE_PTS_MULT = dim_unit_scaling('m', out_unit)  # 1e3
+
+    if _segment_archive_is_current(name):
+        data = _read_segment_archive(name)
+    else:
+        data = _read_segment_text(name)
+
+    # reference surface pointcloud & Xi. Unscaled arrays stay memory-mapped.
+    osim_surf_pts = data['surf_pts']
+    if SURF_PTS_MULT != 1.0:
+        osim_surf_pts = osim_surf_pts * SURF_PTS_MULT
+    osim_surf_xi = _as_xi_points(data['surf_xi'])
+
+    # reference muscle points, Xi & labels
+    osim_muscle_labels = tuple(data['muscle_labels'])
+    osim_muscle_pts = data['muscle_pts']
+    if MUSCLE_PTS_MULT != 1.0:
+        osim_muscle_pts = osim_muscle_pts * MUSCLE_PTS_MULT
+    osim_muscle_xi = _as_xi_points(data['muscle_xi'])
+
+    return osim_surf_pts, osim_muscle_pts, osim_surf_xi, osim_muscle_xi, \
+           osim_muscle_labels, data['host_mesh']
+
+
+def _osim_segment_data(name, out_unit, host_elems=None):
+    """
+    Reads bone surface and muscle point data for a segment. Data are parsed
+    once per (segment, unit) and cached for the life of the process. Cached
+    arrays are read-only and a fresh copy of the host mesh is returned on
+    every call.
 
     Inputs
     ------
@@ -98,6 +551,10 @@ def _osim_segment_data(name, out_unit):
         Name of the model segment (pelvis, femur_{l|r}, tibia_{l|r})
     out_unit : str
         Measurement unit to output
+    host_elems : list of 3 ints [optional]
+        Number of host mesh elements along x, y and z. The reference single
+        element host mesh is refined and the Xi coordinates mapped to it if
+        more than one element.
 
     Returns
     -------
@@ -105,74 +562,764 @@ def _osim_segment_data(name, out_unit):
         Surface point coordinates of the opensim bone model
     osim_muscle_pts : m x 3 array
         Coordinates of the opensim muscle points
-    osim_surf_xi : list
+    osim_surf_xi : XiPoints
         Host-mesh Xi coordinates of osim_surf_pts
-    osim_muscle_xi : list
+    osim_muscle_xi : XiPoints
         Host-mesh Xi coordinates of osim_muscle_pts
     osim_muscle_labels : list of strings
         The names of each model point
     hm : GeometricField instance
         The host mesh
     """
+    host_elems = _host_elems_key(host_elems)
+    if host_elems is not None:
+        return _refined_osim_segment_data(name, out_unit, host_elems)
+
+    key = (name, out_unit)
+    with _REFERENCE_CACHE_LOCK:
+        data = _REFERENCE_CACHE.get(key)
+        if data is None:
+            data = _load_osim_segment_data(name, out_unit)
+            _read_only(data[0])
+            _read_only(data[1])
+            for xi_points in data[2:4]:
+                _read_only(xi_points.elems)
+                _read_only(xi_points.xi)
+            _REFERENCE_CACHE[key] = data
+
+    return data[:5] + (_copy_host_mesh(data[5]),)
+
+
+def _refined_osim_segment_data(name, out_unit, host_elems):
+    """
+    _osim_segment_data with the host mesh refined into host_elems elements
+    """
+    key = (name, out_unit, host_elems)
+    with _REFERENCE_CACHE_LOCK:
+        data = _REFERENCE_CACHE.get(key)
+    if data is None:
+        (surf_pts, muscle_pts, surf_xi, muscle_xi, labels,
+         host_mesh) = _osim_segment_data(name, out_unit)
+        data = (
+            surf_pts, muscle_pts,
+            _refine_xi(surf_xi, host_elems), _refine_xi(muscle_xi, host_elems),
+            labels, _refine_host_mesh(host_mesh, host_elems),
+        )
+        for xi_points in data[2:4]:
+            _read_only(xi_points.elems)
+            _read_only(xi_points.xi)
+        with _REFERENCE_CACHE_LOCK:
+            data = _REFERENCE_CACHE.setdefault(key, data)
 
-    SURF_PTS_MULT = dim_unit_scaling('mm', out_unit)
-    MUSCLE_PTS_MULT = dim_unit_scaling('m', out_unit)  # 1e3
+    return data[:5] + (_copy_host_mesh(data[5]),)
 
-    # ==================================================#
-    # Precalculated for each segment: host-meshes, surface xi, muscle point xi
-    gait2392_segments = (
-        'pelvis',
-        'femur_l', 'femur_r',
-        'tibia_l', 'tibia_r',
-    )
-    host_mesh_file_pat = '{}.hostmesh.{}'
-    surf_ptcld_file_pat = '{}.nodes'
-    surf_xi_file_pat = '{}.nodes.xi'
-    muscle_ptcld_file_pat = '{}.muscles.txt'
-    muscle_xi_file_pat = '{}.muscle.xi'
-    # =================================================#
-
-    # reference surface pointcloud & Xi
-    osim_surf_pts = np.loadtxt(
-        os.path.join(DATA_DIR, surf_ptcld_file_pat.format(name))
-    )
-    osim_surf_pts *= SURF_PTS_MULT
 
-    _surf_xi = np.loadtxt(
-        os.path.join(DATA_DIR, surf_xi_file_pat.format(name))
-    )
-    osim_surf_xi = [[l[0], np.array([l[1], l[2], l[3]])] for l in _surf_xi]
+def _osim_segment_basis(name, out_unit, host_elems=None):
+    """
+    Host mesh basis matrices of the reference surface and muscle points of
+    a segment. The material coordinates of the reference points are fixed
+    so the matrices are calculated once per process and cached with the
+    reference data. Points embedded in the host mesh are then evaluated
+    for any host mesh parameters P by the product A.dot(P.reshape(3, -1).T).
 
-    # reference muscle points, Xi & labels
-    osim_muscle_labels = tuple(
-        np.loadtxt(
-            os.path.join(DATA_DIR, muscle_ptcld_file_pat.format(name)),
-            usecols=(0,), dtype=str,
+    Inputs
+    ------
+    name : str
+        Name of the model segment (pelvis, femur_{l|r}, tibia_{l|r})
+    out_unit : str
+        Measurement unit of the reference data to calculate the matrices
+        from. The matrices do not depend on it.
+    host_elems : list of 3 ints [optional]
+        Number of host mesh elements, see _osim_segment_data
+
+    Returns
+    -------
+    surf_basis : scipy.sparse.csc_matrix
+        n x n_nodes basis matrix of osim_surf_xi
+    muscle_basis : scipy.sparse.csc_matrix
+        m x n_nodes basis matrix of osim_muscle_xi
+    """
+    host_elems = _host_elems_key(host_elems)
+    key = (name, 'basis') if host_elems is None else (name, 'basis', host_elems)
+    with _REFERENCE_CACHE_LOCK:
+        basis = _REFERENCE_CACHE.get(key)
+    if basis is None:
+        (_, _, surf_xi, muscle_xi, _,
+         host_mesh) = _osim_segment_data(name, out_unit, host_elems)
+        basis = (
+            _host_mesh_basis_matrix(host_mesh, surf_xi),
+            _host_mesh_basis_matrix(host_mesh, muscle_xi),
         )
+        with _REFERENCE_CACHE_LOCK:
+            basis = _REFERENCE_CACHE.setdefault(key, basis)
+
+    return basis
+
+
+def clear_reference_cache():
+    """
+    Discard all cached reference segment data
+    """
+    with _REFERENCE_CACHE_LOCK:
+        _REFERENCE_CACHE.clear()
+
+
+def preload_reference_data(segments=None, out_unit='mm', host_elems=None):
+    """
+    Load and cache the reference data of the given segments.
+
+    Inputs
+    ------
+    segments : list of str [optional]
+        Segments to load. Defaults to all segments in VALID_SEGS.
+    out_unit : str [optional]
+        Measurement unit of the cached data.
+    host_elems : list of 3 ints [optional]
+        Number of host mesh elements, see _osim_segment_data
+
+    Returns
+    -------
+    None
+    """
+    if segments is None:
+        segments = sorted(VALID_SEGS)
+    for name in segments:
+        if name not in VALID_SEGS:
+            raise ValueError(
+                'Invalid segment name {}. Must be one of {}.'.format(
+                    name, VALID_SEGS
+                )
+            )
+        _osim_segment_data(name, out_unit, host_elems)
+        _osim_segment_basis(name, out_unit, host_elems)
+
+
+def _preload_config_reference_data(config):
+    """
+    Preload the reference data of each segment with the host mesh of its
+    fitting profile in a gait2392MuscleCustomiser config
+    """
+    for name in sorted(VALID_SEGS):
+        preload_reference_data(
+            [name], config['in_unit'],
+            segment_fitting_profile(config, name).host_elems
+        )
+
+
+class StageTimings(object):
+
+    def __init__(self):
+        """
+        Wall and CPU times of the stages of a customisation in the order
+        they were run. CPU time is that of the calling thread.
+        """
+        self.stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name, **info):
+        """
+        Time a stage. Yields the stage's record dict so that extra
+        information, e.g. iteration counts, can be added to it.
+        """
+        record = dict(info, stage=name)
+        wall_0 = time.perf_counter()
+        cpu_0 = time.thread_time()
+        try:
+            yield record
+        finally:
+            record['wall'] = time.perf_counter() - wall_0
+            record['cpu'] = time.thread_time() - cpu_0
+            self.stages.append(record)
+
+    def total(self, key='wall'):
+        return sum(r[key] for r in self.stages)
+
+    def to_list(self):
+        return [dict(r) for r in self.stages]
+
+
+def _hmf_params(params=None):
+    """
+    HMF_PARAMS updated with the given parameters, a dict or FittingProfile
+    """
+    if isinstance(params, FittingProfile):
+        return params.to_dict()
+    p = dict(HMF_PARAMS)
+    if params:
+        p.update(params)
+    return p
+
+
+def _spatial_subsample(points, n_points, n_iter=10):
+    """
+    Indices of about n_points of points spread evenly through space. Points
+    are binned into a regular voxel grid and the first point in each
+    occupied voxel is kept. The voxel size is adjusted iteratively to get
+    close to n_points.
+    """
+    n = len(points)
+    if n_points >= n:
+        return np.arange(n)
+
+    lo = points.min(0)
+    extent = np.maximum(points.max(0) - lo, 1e-12)
+    size = (np.prod(extent) / n_points) ** (1.0 / 3.0)
+    idx = np.arange(n)
+    for _ in range(n_iter):
+        keys = np.floor((points - lo) / size).astype(np.int64)
+        _, idx = np.unique(keys, axis=0, return_index=True)
+        ratio = len(idx) / float(n_points)
+        if 0.9 < ratio < 1.1:
+            break
+        # points lie on a surface so the count scales with size squared
+        size *= np.sqrt(ratio)
+    return np.sort(idx)
+
+
+def _even_sample(n, n_points):
+    """
+    Indices of n_points evenly spaced through range(n), as used by the
+    sample argument of the alignment_fitting functions
+    """
+    if n_points > n:
+        return np.arange(n)
+    return np.linspace(0, n - 1, n_points).astype(int)
+
+
+def _recentre_rigid_scale(t, p_from, p_to):
+    """
+    Convert rigid + scale parameters t applied about point p_from into
+    parameters of the same transform applied about point p_to
+    """
+    t = np.array(t, dtype=float)
+    t[:3] = transform3D.transformRigidScale3DAboutP(
+        p_to[np.newaxis, :], t, p_from
+    )[0] - p_to
+    return t
+
+
+def _rotation_angles(R):
+    """
+    Rotation angles (rx, ry, rz) of rotation matrix R = Rx.Ry.Rz, as used
+    by transform3D.transformRigid3D
+    """
+    rx = np.arctan2(-R[1, 2], R[2, 2])
+    ry = np.arctan2(R[0, 2], np.hypot(R[0, 0], R[0, 1]))
+    # rz from the remaining rotation so that the angles reproduce R near
+    # gimbal lock (ry = +-pi/2), where rx and rz are poorly determined
+    cx, sx = np.cos(rx), np.sin(rx)
+    cy, sy = np.cos(ry), np.sin(ry)
+    Rxy = np.array([[cy, 0.0, sy],
+                    [sx * sy, cx, -sx * cy],
+                    [-cx * sy, sx, cx * cy]])
+    Rz = Rxy.T @ R
+    rz = np.arctan2(Rz[1, 0], Rz[0, 0])
+    return np.array([rx, ry, rz])
+
+
+def _similarity_rigid_scale(source, target):
+    """
+    Closed-form least squares rigid + isotropic scale registration of
+    corresponding source and target points (Umeyama, 1991).
+
+    Returns
+    -------
+    t : array
+        Rigid + scale transform parameters about the mean of source
+    """
+    s_centre = source.mean(0)
+    t_centre = target.mean(0)
+    s_pts = source - s_centre
+    t_pts = target - t_centre
+    U, S, Vt = np.linalg.svd(t_pts.T @ s_pts / len(source))
+    # no reflections
+    d = np.ones(3)
+    if np.linalg.det(U) * np.linalg.det(Vt) < 0:
+        d[2] = -1.0
+    R = (U * d) @ Vt
+    scale = (S * d).sum() / (s_pts ** 2).sum(1).mean()
+    return np.hstack([t_centre - s_centre, _rotation_angles(R), scale])
+
+
+def _closed_form_rigid_scale(source, target, refine=False, xtol=1e-6,
+                             sample=1000):
+    """
+    Rigid + isotropic scale registration of corresponding source and
+    target points by _similarity_rigid_scale, optionally refined by
+    alignment_fitting.fitRigidScale on an evenly spaced sample of the
+    points.
+
+    Returns
+    -------
+    t : array
+        Rigid + scale transform parameters about the mean of source
+    """
+    t = _similarity_rigid_scale(source, target)
+    if not refine:
+        return t
+    idx = _even_sample(len(source), sample)
+    s_centre = source[idx].mean(0)
+    t = _recentre_rigid_scale(t, source.mean(0), s_centre)
+    t = af.fitRigidScale(source[idx], target[idx], xtol=xtol, t0=t)[0]
+    return _recentre_rigid_scale(t, s_centre, source.mean(0))
+
+
+def _coarse_to_fine_rigid_scale(source, target, levels, xtol=1e-6,
+                                sample=1000):
+    """
+    Rigid + isotropic scale registration of corresponding source and
+    target points, first on spatially subsampled subsets of the points at
+    each level, then on an evenly spaced sample of all points.
+
+    Returns
+    -------
+    t : array
+        Rigid + scale transform parameters about the mean of source
+    """
+    t = None
+    centre = None
+    for n_points in levels:
+        idx = _spatial_subsample(source, n_points)
+        s_pts = source[idx]
+        t_pts = target[idx]
+        s_centre = s_pts.mean(0)
+        if t is None:
+            t = _similarity_rigid_scale(s_pts, t_pts)
+        else:
+            t = _recentre_rigid_scale(t, centre, s_centre)
+        t = af.fitRigidScale(s_pts, t_pts, xtol=xtol, t0=t)[0]
+        centre = s_centre
+
+    idx = _even_sample(len(source), sample)
+    s_centre = source[idx].mean(0)
+    if t is None:
+        t = _similarity_rigid_scale(source[idx], target[idx])
+    else:
+        t = _recentre_rigid_scale(t, centre, s_centre)
+    t = af.fitRigidScale(source[idx], target[idx], xtol=xtol, t0=t)[0]
+    return _recentre_rigid_scale(t, s_centre, source.mean(0))
+
+
+def _nearest_rigid_scale(source, target, levels, xtol=1e-6, sample=1000):
+    """
+    Rigid + isotropic scale registration of source points to target points
+    without correspondence by minimising the distance from each source point
+    to its closest target point. Starts from aligned centroids and is run on
+    spatially subsampled source and target points at each level then at
+    sample points.
+
+    Returns
+    -------
+    t : array
+        Rigid + scale transform parameters about the mean of source
+    """
+    centre = source.mean(0)
+    t = np.hstack([target.mean(0) - centre, [0.0, 0.0, 0.0], 1.0])
+    for n_points in list(levels) + [sample]:
+        s_pts = source[_spatial_subsample(source, n_points)]
+        t_pts = target[_spatial_subsample(target, n_points)]
+        s_centre = s_pts.mean(0)
+        t = _recentre_rigid_scale(t, centre, s_centre)
+        t = af.fitDataRigidScaleEPDP(s_pts, t_pts, xtol=xtol, t0=t)[0]
+        centre = s_centre
+    return _recentre_rigid_scale(t, centre, source.mean(0))
+
+
+def _sobolev_derivative_matrix(host_mesh, sob_d):
+    """
+    Assemble the sparse matrix of host mesh basis function derivatives at a
+    regular grid of sob_d points in each element. Rows are ordered by
+    derivative then evaluation point, as in
+    geometric_field.makeGeometricFieldDerivativesEvaluatorSparse.
+    """
+    f = host_mesh.ensemble_field_function
+    if not f.is_flat():
+        f = f.flatten()[0]
+    n_derivs = int(f.dimensions ** 2 + 1)
+
+    rows = [[] for _ in range(n_derivs)]
+    cols = [[] for _ in range(n_derivs)]
+    vals = [[] for _ in range(n_derivs)]
+    basis_values = {}
+    row = 0
+    for elem in np.sort(list(f.mesh.elements.keys())):
+        element = f.mesh.elements[elem]
+        b = basis_values.get(element.type)
+        if b is None:
+            eval_grid = element.generate_eval_grid(sob_d)
+            b = f.basis[element.type].eval_derivatives(eval_grid.T, None)
+            basis_values[element.type] = b
+        emap = f.mapper._element_to_ensemble_map[elem]
+        ens_nodes = [emap[n][0][0] for n in range(b.shape[1])]
+        n_ep = b.shape[2]
+        for d in range(n_derivs):
+            rows[d].append(np.tile(row + np.arange(n_ep), len(ens_nodes)))
+            cols[d].append(np.repeat(ens_nodes, n_ep))
+            vals[d].append(b[d].ravel())
+        row += n_ep
+
+    n_nodes = f.get_number_of_ensemble_points()
+    return sparse.vstack([
+        sparse.csr_matrix(
+            (np.hstack(vals[d]), (np.hstack(rows[d]), np.hstack(cols[d]))),
+            shape=(row, n_nodes),
+        )
+        for d in range(n_derivs)
+    ]).tocsr()
+
+
+def _make_sobolev_penalty(host_mesh, sob_d, w):
+    """
+    Make the host mesh sobolev smoothing penalty of
+    geometric_field_fitter.makeSobelovPenalty3D and a function returning its
+    sparse Jacobian with respect to the flattened host mesh parameters.
+    """
+    B = _sobolev_derivative_matrix(host_mesh, sob_d)
+    w = np.asarray(w, dtype=float)
+    n_derivs = len(w)
+    n_ep = B.shape[0] // n_derivs
+    dim = host_mesh.dimensions
+    w_rows = np.tile(np.arange(n_ep), n_derivs)
+    w_cols = np.arange(n_derivs * n_ep)
+
+    def _derivs(P):
+        return (B @ P.reshape((dim, -1)).T).reshape((n_derivs, n_ep, dim))
+
+    def penalty(P):
+        D = _derivs(P)
+        return np.einsum('k,kjd->j', w, D * D)
+
+    def jacobian(P):
+        D = _derivs(P)
+        wD = 2.0 * w[:, np.newaxis, np.newaxis] * D
+        return sparse.hstack([
+            sparse.csr_matrix(
+                (wD[:, :, d].ravel(), (w_rows, w_cols)),
+                shape=(n_ep, n_derivs * n_ep)
+            ) @ B
+            for d in range(dim)
+        ])
+
+    return penalty, jacobian
+
+
+class _FitTerminated(Exception):
+    """
+    Raised from the host mesh fit objective to stop the fit early
+    """
+
+
+def _host_mesh_fit_points(host_mesh, slave_points, slave_func, slave_xi=None,
+                          max_it=0, xtol=1e-6, sob_d=[4, 4, 4], sob_w=1e-5,
+                          verbose=True, analytic_jacobian=True,
+                          slave_basis=None, stats=None, solver='leastsq',
+                          rmse_target=0.0, min_improvement=0.0,
+                          plateau_window=0, plateau_tol=0.0, max_time=0.0,
+                          callback=None):
+    """
+    Host mesh fit slave_points. Minimises slave_func by deforming host_mesh
+    in which slave_points are embedded. Equivalent to
+    fitting_tools.hostMeshFitPoints but slave points are evaluated through
+    a basis matrix assembled from XiPoints.
+
+    Inputs
+    ------
+    host_mesh : GeometricField instance
+        Host mesh that fully encloses slave_points
+    slave_points : nx3 array
+        Point coordinates to fit
+    slave_func : function
+        Takes slave point coordinates and returns an error vector of squared
+        distances. If it has a jac attribute, jac(x) should return the
+        slave point index and the (m, 3) difference vector of each squared
+        distance, from which the Jacobian is calculated. The slave rmse is
+        that of the first error of each slave point, further errors (e.g.
+        of a symmetric objective) are minimised but not included.
+    slave_xi : XiPoints or list [optional]
+        Material coordinates of slave_points in host_mesh if known
+    max_it : int [optional]
+        Maximum number of fitting iterations, see below. 0 for the solver
+        default.
+    xtol : float [optional]
+        Relative error desired in the approximate solution
+    sob_d : list [optional]
+        Number of gauss points for host mesh sobolev smoothing
+    sob_w : float [optional]
+        Weighting for host mesh sobolev smoothing
+    verbose : bool [optional]
+        Log fitting progress at debug level
+    analytic_jacobian : bool [optional]
+        Use the analytic Jacobian of the objective if slave_func has a jac
+        attribute, else the Jacobian is estimated by finite differences.
+    slave_basis : scipy.sparse matrix [optional]
+        Basis matrix of slave_xi in host_mesh if already calculated
+    stats : dict [optional]
+        Updated with the number of objective evaluations (nfev), Jacobian
+        evaluations (njev), the final slave rmse, the reason the fit
+        was terminated before converging (terminated, "maxit" if max_it
+        was reached), None if it converged, and the convergence trace: a list of the iteration, nfev, slave rmse,
+        step_norm and elapsed time of each iteration
+    solver : str [optional]
+        "leastsq" for scipy.optimize.leastsq (dense Jacobian) or "sparse"
+        for scipy.optimize.least_squares with the sparse Jacobian and the
+        LSMR trust region solver. The sparse solver only avoids dense
+        Jacobians if the analytic Jacobian is used.
+    rmse_target : float [optional]
+        Stop once the slave rmse is at most rmse_target. 0 to disable.
+    min_improvement : float [optional]
+        Stop once the objective decreases by less than this fraction
+        between iterations. 0 to disable.
+    plateau_window : int [optional]
+        Stop once the slave rmse decreases by less than the fraction
+        plateau_tol over plateau_window iterations. 0 to disable.
+    plateau_tol : float [optional]
+        See plateau_window
+    max_time : float [optional]
+        Stop once the fit has run for max_time seconds. 0 for no limit.
+    callback : function [optional]
+        Called each iteration as callback(iteration, rmse, step_norm) with
+        the iteration number (0 for the initial parameters), the slave
+        rmse and the norm of the parameter change since the previous
+        iteration. The fit stops if it returns True.
+
+    Iterations are the Jacobian evaluations of the solver, once per
+    accepted step. As in fitting_tools.hostMeshFitPoints, objective
+    evaluations are limited to max_it times the number of host mesh
+    parameters, which is about max_it iterations with a finite difference
+    Jacobian. With the analytic Jacobian, the fit also stops after max_it
+    iterations. Without the analytic Jacobian only rmse_target and
+    max_time apply and the trace is empty.
+
+    Returns
+    -------
+    host_x_opt : 3 x n x 1 array
+        Fitted host mesh parameters
+    slave_points_opt : nx3 array
+        Fitted slave point coordinates
+    slave_xi : XiPoints
+        Material coordinates of slave points in host mesh
+    slave_rmse_opt : float
+        RMS of fitted slave_func error vector
+    """
+    verbose = verbose and log.isEnabledFor(logging.DEBUG)
+    if slave_xi is None:
+        slave_xi = host_mesh.find_closest_material_points(
+            slave_points,
+            init_gd=[100, 100, 100],
+            verbose=verbose,
+        )[0]
+    slave_xi = _as_xi_points(slave_xi)
+    if slave_basis is None:
+        A = _host_mesh_basis_matrix(host_mesh, slave_xi)
+    else:
+        A = slave_basis
+    dim = host_mesh.dimensions
+    # number of slave point errors in the slave rmse
+    n_slave = A.shape[0]
+
+    def eval_slave(P):
+        return (A @ P.reshape((dim, -1)).T).T
+
+    # initialise smoothing for host mesh
+    sobolev_weights = np.array([1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0,
+                                2.0, 2.0,
+                                3.0
+                                ])
+    host_x_0 = host_mesh.field_parameters.copy()
+    host_smoother, host_smoother_jac = _make_sobolev_penalty(
+        host_mesh, sob_d, sobolev_weights * sob_w
     )
-    osim_muscle_pts = np.loadtxt(
-        os.path.join(DATA_DIR, muscle_ptcld_file_pat.format(name)),
-        usecols=(1, 2, 3), dtype=float,
-    )
-    osim_muscle_pts *= MUSCLE_PTS_MULT
-    _muscle_xi = np.loadtxt(
-        os.path.join(DATA_DIR, muscle_xi_file_pat.format(name))
-    )
-    osim_muscle_xi = [[l[0], np.array([l[1], l[2], l[3]])] for l in _muscle_xi]
 
-    # host mesh
-    hm = geometric_field.load_geometric_field(
-        os.path.join(DATA_DIR, host_mesh_file_pat.format(name, 'geof')),
-        os.path.join(DATA_DIR, host_mesh_file_pat.format(name, 'ens')),
-        os.path.join(DATA_DIR, host_mesh_file_pat.format(name, 'mesh')),
+    it = [0]
+    t0 = time.perf_counter()
+    # best evaluation so far, for early termination
+    best = {'x': host_x_0.ravel(), 'cost': np.inf, 'rmse': np.inf}
+    trace = []
+    last = {'x': None, 'cost': np.inf}
+
+    def host_func(host_x):
+        slave_err = slave_func(eval_slave(host_x).T)
+        smooth_err = host_smoother(host_x)
+        err = np.hstack([slave_err, smooth_err])
+        cost = err.dot(err)
+        slave_rmse = np.sqrt(slave_err[:n_slave].mean())
+        if cost < best['cost']:
+            best.update(x=np.array(host_x), cost=cost, rmse=slave_rmse)
+        if verbose:
+            log.debug(
+                'it: %d, slaveRMS: %8.6f, combinedRMS: %8.6f',
+                it[0], slave_rmse, np.sqrt(err.mean())
+            )
+        it[0] += 1
+        if rmse_target > 0 and best['rmse'] <= rmse_target:
+            raise _FitTerminated('rmse_target')
+        if max_time > 0 and time.perf_counter() - t0 >= max_time:
+            raise _FitTerminated('max_time')
+        return err
+
+    def iteration(host_x):
+        # the solvers only evaluate the Jacobian at accepted points, which
+        # are the best so far. leastsq evaluates it at the initial point
+        # twice.
+        if np.array_equal(host_x, last['x']):
+            return
+        step_norm = 0.0 if last['x'] is None else float(
+            np.linalg.norm(host_x - last['x'])
+        )
+        trace.append({
+            'iteration': len(trace),
+            'nfev': it[0],
+            'rmse': float(best['rmse']),
+            'step_norm': step_norm,
+            'time': time.perf_counter() - t0,
+        })
+        last_cost = last['cost']
+        last.update(x=np.array(host_x), cost=best['cost'])
+        if (min_improvement > 0 and np.isfinite(last_cost) and
+                last_cost - best['cost'] <= min_improvement * last_cost):
+            raise _FitTerminated('min_improvement')
+        if 0 < plateau_window < len(trace):
+            rmse_0 = trace[-plateau_window - 1]['rmse']
+            if rmse_0 - best['rmse'] <= plateau_tol * rmse_0:
+                raise _FitTerminated('plateau')
+        if callback is not None and callback(
+                len(trace) - 1, float(best['rmse']), step_norm):
+            raise _FitTerminated('callback')
+        if 0 < max_it < len(trace):
+            raise _FitTerminated('maxit')
+
+    def host_jac(host_x):
+        iteration(host_x)
+        # d|e_i|^2/dx = 2 e_i A_i for each coordinate
+        rows, e = slave_func.jac(eval_slave(host_x).T)
+        A_rows = A[rows]
+        slave_jac = sparse.hstack([
+            sparse.diags(2.0 * e[:, d]) @ A_rows for d in range(dim)
+        ])
+        return sparse.vstack(
+            [slave_jac, host_smoother_jac(host_x)]
+        ).tocsr()
+
+    use_jac = analytic_jacobian and hasattr(slave_func, 'jac')
+    if solver not in VALID_HMF_SOLVERS[1:]:
+        raise ValueError(
+            'Invalid solver {}. Must be one of {}'.format(
+                solver, VALID_HMF_SOLVERS[1:]
+            )
+        )
+    terminated = None
+    njev = [0]
+    # objective evaluation budget of fitting_tools.hostMeshFitPoints
+    maxf = max_it * host_x_0.size
+
+    def counted_jac(host_x):
+        njev[0] += 1
+        return host_jac(host_x)
+
+    try:
+        if solver == 'sparse':
+            # least_squares does not count finite difference evaluations
+            res = least_squares(
+                host_func, host_x_0.ravel(),
+                jac=counted_jac if use_jac else '2-point',
+                method='trf', tr_solver='lsmr', xtol=xtol,
+                max_nfev=(maxf if use_jac else max_it) or None,
+            )
+            host_x_opt = res.x
+            info = {'nfev': res.nfev, 'njev': res.njev or 0}
+            if res.status == 0:
+                terminated = 'maxit'
+        else:
+            host_x_opt, _, info, _, ier = leastsq(
+                host_func, host_x_0.ravel(),
+                Dfun=(lambda x: counted_jac(x).toarray()) if use_jac else None,
+                xtol=xtol, maxfev=maxf, full_output=1
+            )
+            if ier == 5:
+                terminated = 'maxit'
+    except _FitTerminated as e:
+        terminated = str(e)
+        host_x_opt = best['x']
+        info = {'nfev': it[0], 'njev': njev[0]}
+    host_x_opt = host_x_opt.reshape((3, -1, 1))
+    host_mesh.set_field_parameters(host_x_opt)
+    slave_points_opt = eval_slave(host_x_opt).T
+    slave_rmse_opt = np.sqrt(slave_func(slave_points_opt)[:n_slave].mean())
+    if verbose:
+        log.debug('final slave rms: %6.4f', slave_rmse_opt)
+    if stats is not None:
+        stats['nfev'] = int(info['nfev'])
+        stats['njev'] = int(info.get('njev', 0))
+        stats['rmse'] = float(slave_rmse_opt)
+        stats['terminated'] = terminated
+        stats['trace'] = trace
+
+    return host_x_opt, slave_points_opt, slave_xi, slave_rmse_opt
+
+
+def _fit_trace_entry(stats):
+    """
+    The number of points, objective and Jacobian evaluations, final slave
+    rmse, termination reason and convergence trace of a host mesh fit from
+    its host_mesh_fit stage record
+    """
+    return dict(
+        (k, stats[k])
+        for k in ('points', 'nfev', 'njev', 'rmse', 'terminated', 'trace')
     )
 
-    return osim_surf_pts, osim_muscle_pts, osim_surf_xi, osim_muscle_xi, \
-           osim_muscle_labels, hm
+
+def _make_sq_dist_func(target_points):
+    """
+    Make a host mesh fit slave objective returning the squared distance
+    between each fitted point and its corresponding target point
+    """
+    def slave_func(x):
+        return ((x - target_points) ** 2.0).sum(1)
+
+    def jac(x):
+        return np.arange(len(x)), x - target_points
+
+    slave_func.jac = jac
+    return slave_func
+
+
+def _make_nearest_sq_dist_func(target_points, symmetric=False,
+                               target_tree=None):
+    """
+    Make a host mesh fit slave objective returning the squared distance
+    between each fitted point and its closest target point. If symmetric,
+    the squared distances between each target point and its closest fitted
+    point are appended. target_tree is a cKDTree of target_points, built if
+    not given.
+    """
+    if target_tree is None:
+        target_tree = cKDTree(target_points)
+
+    def slave_func(x):
+        d = target_tree.query(x)[0]
+        if symmetric:
+            d = np.hstack([d, cKDTree(x).query(target_points)[0]])
+        return d * d
+
+    def jac(x):
+        # closest points are treated as fixed
+        rows = np.arange(len(x))
+        e = x - target_points[target_tree.query(x)[1]]
+        if symmetric:
+            x_rows = cKDTree(x).query(target_points)[1]
+            rows = np.hstack([rows, x_rows])
+            e = np.vstack([e, x[x_rows] - target_points])
+        return rows, e
+
+    slave_func.jac = jac
+    return slave_func
 
 
 def _hmf_seg(targ_pts, osim_surf_pts, osim_muscle_pts,
-             osim_surf_xi=None, osim_muscle_xi=None, host_mesh=None):
+             osim_surf_xi=None, osim_muscle_xi=None, host_mesh=None,
+             host_x0=None, params=None, osim_surf_basis=None,
+             osim_muscle_basis=None, timings=None, callback=None):
     """
 
     Inputs
@@ -181,9 +1328,37 @@ def _hmf_seg(targ_pts, osim_surf_pts, osim_muscle_pts,
         Array of point coordinates of the target bone surface
     osim_surf_pts : nx3 array
         Array of point coordinates of the opensim bone surface
-        Should be correspondent with targ_ptcld
+        Should be correspondent with targ_ptcld unless the "nearest"
+        objective is used
     osim_muscle_pts : px3 array
         Array of unfitted muscle point coordinates
+    osim_surf_xi : XiPoints [optional]
+        Material coordinates of osim_surf_pts in host_mesh
+    osim_muscle_xi : XiPoints [optional]
+        Material coordinates of osim_muscle_pts in host_mesh
+    host_mesh : GeometricField instance [optional]
+        Host mesh enclosing the reference points. If not given, a host mesh
+        of params["host_elems"] elements is made around them.
+    host_x0 : array [optional]
+        Initial host mesh parameters, e.g. the fitted parameters of a
+        previous run on the same subject. If given, rigid registration and
+        the coarse levels are skipped and the host mesh fit starts from
+        these parameters.
+    params : dict [optional]
+        Fitting parameters to use instead of those in HMF_PARAMS
+    osim_surf_basis : scipy.sparse matrix [optional]
+        Host mesh basis matrix of osim_surf_xi if already calculated
+    osim_muscle_basis : scipy.sparse matrix [optional]
+        Host mesh basis matrix of osim_muscle_xi if already calculated
+    timings : StageTimings [optional]
+        Records the time of registration and host mesh fitting stages.
+        The stats of host mesh fitting stages include the convergence
+        trace of the fit, see _host_mesh_fit_points.
+    callback : function [optional]
+        Called each host mesh fit iteration as callback(iteration, rmse,
+        step_norm) and stops the fit if it returns True, see
+        _host_mesh_fit_points. Iterations are numbered from 0 in each
+        coarse and the final fit.
 
     Returns
     -------
@@ -193,15 +1368,53 @@ def _hmf_seg(targ_pts, osim_surf_pts, osim_muscle_pts,
         RMS fitting error
     source_points_fitting_hmf : nx3 array
         Array of fitted source point coordinates
+    fit_trace : list of dicts
+        Each coarse and the final host mesh fit in the order they were run,
+        with the number of points, objective and Jacobian evaluations
+        (nfev, njev), final slave rmse, the reason the fit was terminated
+        early (terminated, None if it converged) and its convergence trace,
+        see _host_mesh_fit_points.
     """
 
-    host_mesh_pad = 0.25  # host mesh padding around slave points
     host_elem_type = 'quad444'  # quadrilateral cubic host elements
-    host_elems = [1, 1, 1]  # a single element host mesh [x,y,z]
-    maxit = 50
-    sobd = [4, 4, 4]
-    sobw = 1e-5
-    xtol = 1e-6
+    # validates the parameters
+    params = FittingProfile.from_dict(_hmf_params(params)).to_dict()
+    host_mesh_pad = params['host_mesh_pad']  # padding around slave points
+    host_elems = params['host_elems']  # number of host elements [x,y,z]
+    if timings is None:
+        timings = StageTimings()
+    maxit = params['maxit']
+    sobd = params['sobd']
+    sobw = params['sobw']
+    xtol = params['xtol']
+    levels = params['levels']
+    objective = params['objective']
+    analytic_jacobian = params['analytic_jacobian']
+    reg_sample = params['reg_sample']
+    reg_xtol = params['reg_xtol']
+    # early termination criteria of the host mesh fits
+    stop = dict(
+        rmse_target=params['rmse_target'],
+        min_improvement=params['min_improvement'],
+        plateau_window=params['plateau_window'],
+        plateau_tol=params['plateau_tol'],
+        callback=callback,
+    )
+    max_time = params['max_time']
+    deadline = time.perf_counter() + max_time
+
+    def time_left():
+        # a small budget rather than 0, which is no limit
+        if max_time <= 0:
+            return 0.0
+        return max(deadline - time.perf_counter(), 1e-6)
+    if objective == 'correspondence' and len(targ_pts) != len(osim_surf_pts):
+        raise ValueError(
+            'Target has {} points but the reference surface has {}. Use the '
+            '"nearest" objective for non-corresponding points.'.format(
+                len(targ_pts), len(osim_surf_pts)
+            )
+        )
 
     source_points_fitting = osim_surf_pts
     source_points_passive = osim_muscle_pts
@@ -211,45 +1424,85 @@ def _hmf_seg(targ_pts, osim_surf_pts, osim_muscle_pts,
         source_points_passive
     ])
 
-    # =============================================================#
-    # rigidly register source points to target points
-    reg1_T, source_points_fitting_reg1, reg1_errors = af.fitRigid(
-        source_points_fitting,
-        target_points,
-        xtol=1e-6,
-        sample=1000,
-        output_errors=1
-    )
-
-    # add isotropic scaling to rigid registration
-    reg2_T, source_points_fitting_reg2, reg2_errors = af.fitRigidScale(
-        source_points_fitting,
-        target_points,
-        xtol=1e-6,
-        sample=1000,
-        t0=np.hstack([reg1_T, 1.0]),
-        output_errors=1
-    )
-
-    # apply same transforms to the passive slave points
-    source_points_passive_reg2 = transform3D.transformRigidScale3DAboutP(
-        source_points_passive,
-        reg2_T,
-        source_points_fitting.mean(0)
-    )
-    source_points_all = np.vstack([
-        source_points_fitting_reg2,
-        source_points_passive_reg2,
-    ])
+    if host_x0 is None:
+        # =============================================================#
+        if objective == 'nearest':
+            # registration without correspondence
+            with timings.stage('rigid_scale_registration'):
+                reg2_T = _nearest_rigid_scale(
+                    source_points_fitting, target_points, levels,
+                    xtol=reg_xtol, sample=reg_sample,
+                )
+            source_points_fitting_reg2 = transform3D.transformRigidScale3DAboutP(
+                source_points_fitting,
+                reg2_T,
+                source_points_fitting.mean(0)
+            )
+        elif levels:
+            # coarse-to-fine registration on spatially subsampled points
+            with timings.stage('rigid_scale_registration'):
+                reg2_T = _coarse_to_fine_rigid_scale(
+                    source_points_fitting, target_points, levels,
+                    xtol=reg_xtol, sample=reg_sample,
+                )
+            source_points_fitting_reg2 = transform3D.transformRigidScale3DAboutP(
+                source_points_fitting,
+                reg2_T,
+                source_points_fitting.mean(0)
+            )
+        else:
+            # closed-form rigid + scale registration of corresponding points
+            with timings.stage('rigid_scale_registration'):
+                reg2_T = _closed_form_rigid_scale(
+                    source_points_fitting, target_points,
+                    refine=params['reg_refine'], xtol=reg_xtol,
+                    sample=reg_sample,
+                )
+            source_points_fitting_reg2 = transform3D.transformRigidScale3DAboutP(
+                source_points_fitting,
+                reg2_T,
+                source_points_fitting.mean(0)
+            )
 
-    # if host mesh provided, apply the same transforms
-    if host_mesh is not None:
-        host_mesh.transformRigidScaleRotateAboutP(reg2_T, source_points_fitting.mean(0))
+        # apply same transforms to the passive slave points
+        source_points_passive_reg2 = transform3D.transformRigidScale3DAboutP(
+            source_points_passive,
+            reg2_T,
+            source_points_fitting.mean(0)
+        )
+        source_points_all = np.vstack([
+            source_points_fitting_reg2,
+            source_points_passive_reg2,
+        ])
 
-    # =============================================================#
+        # if host mesh provided, apply the same transforms
+        if host_mesh is not None:
+            host_mesh.transformRigidScaleRotateAboutP(reg2_T, source_points_fitting.mean(0))
 
-    def slave_func(x):
-        return ((x - target_points) ** 2.0).sum(1)
+        # =============================================================#
+    else:
+        # warm start from the host mesh parameters of a previous fit. All
+        # embedded points are evaluated from the host mesh so registration
+        # is not needed.
+        if host_mesh is None or osim_surf_xi is None or osim_muscle_xi is None:
+            raise ValueError(
+                'host_x0 requires host_mesh, osim_surf_xi and osim_muscle_xi'
+            )
+        host_mesh.set_field_parameters(
+            np.reshape(host_x0, host_mesh.field_parameters.shape)
+        )
+        source_points_fitting_reg2 = _make_host_mesh_evaluator(
+            host_mesh, osim_surf_xi, osim_surf_basis
+        )(host_mesh.field_parameters).T
+
+    if objective == 'nearest':
+        target_tree = cKDTree(target_points)
+        slave_func = _make_nearest_sq_dist_func(
+            target_points, params['symmetric'], target_tree
+        )
+    else:
+        target_tree = None
+        slave_func = _make_sq_dist_func(target_points)
 
     # make host mesh
     if host_mesh is None:
@@ -260,49 +1513,324 @@ def _hmf_seg(targ_pts, osim_surf_pts, osim_muscle_pts,
             host_elems,
         )
 
-    # calculate the emdedding (xi) coordinates of passive
-    # source points.
-    if osim_muscle_xi is not None:
-        source_points_passive_xi = osim_muscle_xi
-    else:
-        source_points_passive_xi = host_mesh.find_closest_material_points(
-            source_points_passive_reg2,
-            initGD=[50, 50, 50],
-            verbose=True,
-        )[0]
-
-    # make passive source point evaluator function
-    eval_source_points_passive = geometric_field.makeGeometricFieldEvaluatorSparse(
-        host_mesh, [1, 1],
-        mat_points=source_points_passive_xi,
+    solver = params['solver']
+    if solver == 'auto':
+        n_elems = len(host_mesh.ensemble_field_function.mesh.elements)
+        solver = 'sparse' if n_elems > 1 else 'leastsq'
+
+    # calculate the emdedding (xi) coordinates of passive
+    # source points.
+    if osim_muscle_xi is not None:
+        source_points_passive_xi = osim_muscle_xi
+    else:
+        source_points_passive_xi = host_mesh.find_closest_material_points(
+            source_points_passive_reg2,
+            init_gd=[50, 50, 50],
+            verbose=log.isEnabledFor(logging.DEBUG),
+        )[0]
+
+    # make passive source point evaluator function
+    eval_source_points_passive = _make_host_mesh_evaluator(
+        host_mesh, source_points_passive_xi, osim_muscle_basis
+    )
+
+    fit_trace = []
+    # coarse host mesh fits on spatially subsampled surface points. Not
+    # needed when warm starting.
+    if levels and host_x0 is None and osim_surf_xi is not None:
+        surf_xi = _as_xi_points(osim_surf_xi)
+        for n_points in levels:
+            idx = _spatial_subsample(source_points_fitting_reg2, n_points)
+            if objective == 'nearest':
+                level_slave_func = _make_nearest_sq_dist_func(
+                    target_points, params['symmetric'], target_tree
+                )
+            else:
+                level_slave_func = _make_sq_dist_func(target_points[idx])
+            with timings.stage('host_mesh_fit', points=len(idx)) as stats:
+                _host_mesh_fit_points(
+                    host_mesh,
+                    source_points_fitting_reg2[idx],
+                    level_slave_func,
+                    slave_xi=XiPoints(surf_xi.elems[idx], surf_xi.xi[idx]),
+                    slave_basis=(
+                        None if osim_surf_basis is None else osim_surf_basis[idx]
+                    ),
+                    max_it=maxit,
+                    sob_d=sobd,
+                    sob_w=sobw,
+                    xtol=xtol,
+                    analytic_jacobian=analytic_jacobian,
+                    stats=stats,
+                    solver=solver,
+                    max_time=time_left(),
+                    **stop
+                )
+            fit_trace.append(_fit_trace_entry(stats))
+
+    # host mesh fit
+    with timings.stage(
+            'host_mesh_fit', points=len(source_points_fitting_reg2)) as stats:
+        host_x_opt, source_points_fitting_hmf, \
+        slave_xi, rmse_hmf = _host_mesh_fit_points(
+            host_mesh,
+            source_points_fitting_reg2,
+            slave_func,
+            slave_xi=osim_surf_xi,
+            slave_basis=osim_surf_basis,
+            max_it=maxit,
+            sob_d=sobd,
+            sob_w=sobw,
+            xtol=xtol,
+            analytic_jacobian=analytic_jacobian,
+            stats=stats,
+            solver=solver,
+            max_time=time_left(),
+            **stop
+        )
+    fit_trace.append(_fit_trace_entry(stats))
+    # evaluate the new positions of the passive source points
+    source_points_passive_hmf = eval_source_points_passive(host_x_opt).T
+
+    return (source_points_passive_hmf, rmse_hmf, source_points_fitting_hmf,
+            fit_trace)
+
+
+class FitResultCache(object):
+
+    def __init__(self, cache_dir, max_size=None):
+        """
+        On-disk cache of segment host mesh fit results, keyed by a hash of
+        the target points, segment name and fitting parameters. Least
+        recently used entries are evicted once the total size of the cache
+        exceeds max_size.
+
+        inputs
+        ======
+        cache_dir : str
+            Directory to store cached results in. Created if it does not
+            exist.
+        max_size : int [optional]
+            Maximum total size of the cache in bytes. None for no limit.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(segment_name, targ_pts, in_unit, host_x0=None, params=None):
+        """
+        Hash the inputs of _fit_segment into a cache key
+        """
+        targ_pts = np.ascontiguousarray(targ_pts, dtype=float)
+        h = hashlib.sha1()
+        h.update(json.dumps({
+            'version': FIT_CACHE_VERSION,
+            'segment': segment_name,
+            'in_unit': in_unit,
+            'params': _hmf_params(params),
+            'shape': targ_pts.shape,
+        }, sort_keys=True).encode())
+        h.update(targ_pts.tobytes())
+        if host_x0 is not None:
+            h.update(np.ascontiguousarray(host_x0, dtype=float).tobytes())
+        return h.hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def get(self, key):
+        """
+        Returns a dict of the cached arrays of key, or None if key is not in
+        the cache.
+        """
+        filename = self._filename(key)
+        try:
+            with np.load(filename) as f:
+                res = dict((k, f[k]) for k in f.files)
+        except (OSError, ValueError, zipfile.BadZipFile):
+            return None
+        # mark as recently used
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+        return res
+
+    def put(self, key, **arrays):
+        """
+        Store arrays under key then evict least recently used entries if
+        the cache is over its size limit.
+        """
+        filename = self._filename(key)
+        tmp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(tmp_filename, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_filename, filename)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache is within
+        max_size
+        """
+        if self.max_size is None:
+            return
+        entries = []
+        for fn in os.listdir(self.cache_dir):
+            if not fn.endswith('.npz'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, fn))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fn))
+        total = sum(e[1] for e in entries)
+        for _, size, fn in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, fn))
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        """
+        Remove all entries
+        """
+        for fn in os.listdir(self.cache_dir):
+            if fn.endswith('.npz'):
+                os.remove(os.path.join(self.cache_dir, fn))
+
+
+def _fit_segment(segment_name, targ_pts, in_unit='mm', host_x0=None,
+                 cache=None, params=None, timings=None, callback=None):
+    """
+    Host mesh fit the reference surface of a segment to target bone surface
+    points. Independent of the OpenSim model, so it can be run in a worker
+    thread or process.
+
+    Inputs
+    ------
+    segment_name : string
+        Name of the gait2392 segment, see cust_segment_muscle_points
+    targ_pts : nx3 array
+        Point coordinates of the target bone surface
+    in_unit : str [optional]
+        Unit of targ_pts
+    host_x0 : array [optional]
+        Initial host mesh parameters to warm start the fit from, see
+        _hmf_seg. Must be of a host mesh with the same number of elements
+        (params["host_elems"]).
+    cache : FitResultCache instance [optional]
+        If given, results are looked up in and saved to the cache. Fits
+        stopped by callback are not saved.
+    params : dict [optional]
+        Fitting parameters to use instead of those in HMF_PARAMS
+    timings : StageTimings [optional]
+        Records the time of each stage of the fit
+    callback : function [optional]
+        Called each host mesh fit iteration, see _hmf_seg. Not called if
+        the result is in the cache.
+
+    Returns
+    -------
+    cust_muscle_pts : mx3 array
+        Fitted muscle point coordinates
+    rmse : float
+        RMS fitting error
+    cust_surf_pts : nx3 array
+        Fitted reference surface point coordinates
+    host_mesh : GeometricField instance
+        The fitted host mesh. Its field_parameters are the fitted host mesh
+        parameters that can be used as host_x0 for a later fit.
+    host_mesh_0 : GeometricField instance
+        The unfitted reference host mesh
+    fit_trace : list of dicts
+        Convergence of each host mesh fit, see _hmf_seg
+    """
+    if timings is None:
+        timings = StageTimings()
+    host_elems = _hmf_params(params)['host_elems']
+    with timings.stage('data_load'):
+        (osim_surf_pts, osim_muscle_pts,
+         osim_surf_xi, osim_muscle_xi,
+         osim_muscle_labels,
+         host_mesh_0) = _osim_segment_data(segment_name, in_unit, host_elems)
+        surf_basis, muscle_basis = _osim_segment_basis(
+            segment_name, in_unit, host_elems
+        )
+        host_mesh = _copy_host_mesh(host_mesh_0)
+
+    if cache is not None:
+        with timings.stage('cache_lookup') as record:
+            key = cache.make_key(
+                segment_name, targ_pts, in_unit, host_x0, params
+            )
+            cached = cache.get(key)
+            record['hit'] = cached is not None
+        if cached is not None:
+            host_mesh.set_field_parameters(cached['host_x_opt'])
+            return (cached['cust_muscle_pts'], float(cached['rmse']),
+                    cached['cust_surf_pts'], host_mesh, host_mesh_0,
+                    json.loads(str(cached['fit_trace'])))
+
+    cust_muscle_pts, rmse, cust_surf_pts, fit_trace = _hmf_seg(
+        targ_pts, osim_surf_pts, osim_muscle_pts, osim_surf_xi,
+        osim_muscle_xi, host_mesh, host_x0=host_x0, params=params,
+        osim_surf_basis=surf_basis, osim_muscle_basis=muscle_basis,
+        timings=timings, callback=callback
     )
 
-    # host mesh fit
-    host_x_opt, source_points_fitting_hmf, \
-    slave_xi, rmse_hmf = fitting_tools.hostMeshFitPoints(
-        host_mesh,
-        source_points_fitting_reg2,
-        slave_func,
-        slave_xi=osim_surf_xi,
-        max_it=maxit,
-        sob_d=sobd,
-        sob_w=sobw,
-        verbose=True,
-        xtol=xtol
-    )
-    # evaluate the new positions of the passive source points
-    source_points_passive_hmf = eval_source_points_passive(host_x_opt).T
+    stopped = any(f['terminated'] == 'callback' for f in fit_trace)
+    if cache is not None and not stopped:
+        cache.put(
+            key,
+            cust_muscle_pts=cust_muscle_pts,
+            cust_surf_pts=cust_surf_pts,
+            rmse=rmse,
+            host_x_opt=host_mesh.field_parameters,
+            fit_trace=json.dumps(fit_trace),
+        )
+    return (cust_muscle_pts, rmse, cust_surf_pts, host_mesh, host_mesh_0,
+            fit_trace)
+
 
-    return source_points_passive_hmf, rmse_hmf, source_points_fitting_hmf
+def _timed_fit_segment(segment_name, targ_pts, in_unit='mm', host_x0=None,
+                       cache=None, params=None, callback=None):
+    """
+    Run _fit_segment and return its output and a StageTimings of the fit.
+    Used to get fit timings back from worker processes.
+    """
+    timings = StageTimings()
+    seg_fit = _fit_segment(
+        segment_name, targ_pts, in_unit, host_x0, cache, params, timings,
+        callback
+    )
+    return seg_fit, timings
 
 
 def _map_local_coords(segment_name, target_model, global_pts):
-    _target_model = copy.deepcopy(target_model)
+    """
+    Map points to the OpenSim anatomical coordinate system of a segment.
+    For the femur and tibia the ACS is calculated from the landmarks of
+    target_model, which is not modified. Otherwise the ACS of target_model
+    is used.
+    """
     if 'femur' in segment_name:
-        _update_femur_opensim_acs(_target_model)
+        o, x, y, z = _femur_opensim_acs(target_model)
     elif 'tibia' in segment_name:
-        _update_tibiafibula_opensim_acs(_target_model)
-    return _target_model.acs.map_local(global_pts)
+        o, x, y, z = _tibiafibula_opensim_acs(target_model)
+    else:
+        return target_model.acs.map_local(global_pts)
+
+    # same mapping as ACSCartesian.map_local: o, o+x, o+y, o+z map to the
+    # origin and unit axes. The tibia axes are not necessarily orthogonal.
+    axes = np.array([x, y, z], dtype=float).T
+    return np.linalg.solve(
+        axes, (np.asarray(global_pts, dtype=float) - o).T
+    ).T
 
     # x  =_target_model.acs.map_local(global_pts)
     # print(segment_name)
@@ -313,22 +1841,79 @@ def _map_local_coords(segment_name, target_model, global_pts):
     # return x
 
 
-def _update_osim_segment_muscle_points(omodel, labels, coords, in_unit, out_unit):
+def _muscle_path_point_index(omodel):
+    """
+    Map the name of every muscle path point in an opensim model to its
+    OpenSim PathPoint object so that its location can be set without going
+    through the gias3 muscle and path point wrappers. Path points without a
+    settable location (e.g. MovingPathPoints) map to None.
+    """
+    index = {}
+    for muscle in omodel.muscles.values():
+        for name, pp in muscle.path_points.items():
+            p = pp._osimPathPoint
+            if isinstance(p, osim.opensim.simulation.PathPoint):
+                index[name] = p
+            else:
+                index[name] = None
+
+    return index
+
+
+def _update_osim_segment_muscle_points(omodel, labels, coords, in_unit, out_unit,
+                                       path_point_index=None):
     """
-    Modify muscle point coordinates in an opensim model
+    Modify muscle point coordinates in an opensim model. path_point_index
+    is the output of _muscle_path_point_index for omodel, built here if not
+    given.
     """
+    if path_point_index is None:
+        path_point_index = _muscle_path_point_index(omodel)
 
     # convert back to meters
     coords = coords * dim_unit_scaling(in_unit, out_unit)
 
-    for li, l in enumerate(labels):
+    vec3 = osim.opensim.Vec3
+    for l, x in zip(labels, coords.tolist()):
         # skip points whose label contains the keyword
         if 'simmspline' not in l:
-            muscle_name = l.split('-')[0]
-            omodel.muscles[muscle_name].path_points[l].location = coords[li]
+            p = path_point_index[l]
+            if p is not None:
+                p.set_location(vec3(*x))
+
+
+def _spline_point_index(labels):
+    """
+    Index spline point labels of format [muscle]-P[p]-simmspline-[n], where
+    p is the path point number and n is an integer denoting the number of
+    the spline point.
+
+    Inputs
+    ------
+    labels : list of str
+        Point labels. Labels of other points are ignored.
+
+    Returns
+    -------
+    index : dict
+        Maps (muscle name, path point number str) to an integer array of the
+        label indices of its spline points in ascending n.
+    """
+    index = {}
+    for li, l in enumerate(labels):
+        parts = l.rsplit('-', 3)
+        if len(parts) == 4 and parts[2] == 'simmspline':
+            key = (parts[0], parts[1][1:])
+            index.setdefault(key, []).append((int(parts[3]), li))
+
+    return {
+        key: np.array([li for _, li in sorted(points)], dtype=int)
+        for key, points in index.items()
+    }
 
 
-def _update_osim_tibia_muscle_splines(side, omodel, labels, coords, in_unit, out_unit, static):
+def _update_osim_tibia_muscle_splines(side, omodel, labels, coords, in_unit, out_unit, static,
+                                      splines=None, spline_index=None):
     """
     Modify tibia's vastus muscle splines. Spline point labels should have format:
     vas_{med|int|lat}_{l|r}-P[p]-simmspline-[n] where p is the path point number
@@ -336,7 +1921,17 @@ def _update_osim_tibia_muscle_splines(side, omodel, labels, coords, in_unit, out
 
     If static is True, all the y value of each spline will be replaced with the 'location'
     value of each path point.
+
+    splines is a list of (muscle name, path point number) pairs of the
+    MovingPathPoints to modify, defaulting to TIBIA_SPLINE_PATH_POINTS for
+    the side. spline_index is the output of _spline_point_index for labels,
+    built here if not given.
     """
+    if splines is None:
+        splines = [(m.format(side), p) for m, p in TIBIA_SPLINE_PATH_POINTS]
+    if spline_index is None:
+        spline_index = _spline_point_index(labels)
+
     # convert back to meters
     coords = coords * dim_unit_scaling(in_unit, out_unit)
 
@@ -345,20 +1940,11 @@ def _update_osim_tibia_muscle_splines(side, omodel, labels, coords, in_unit, out
     #     omodel.muscles['vas_med_{}'.format(side)].
     #     )
 
-    def _get_coords_by_name(name):
+    def _get_coords_by_name(muscle_name, pathpoint):
         """
         Get spline points of the specified spline
         """
-        inds = []
-        named_labels = []
-        for li, l in enumerate(labels):
-            if name in l:
-                inds.append(li)
-                named_labels.append(l)
-
-        _new_order = np.argsort(named_labels)
-        inds = [inds[i] for i in _new_order]
-        return coords[inds, :]
+        return coords[spline_index[(muscle_name, str(pathpoint))], :]
 
     def _update_muscle(muscle_name, pathpoint):
         """
@@ -383,7 +1969,7 @@ def _update_osim_tibia_muscle_splines(side, omodel, labels, coords, in_unit, out
             sz[1] = _z
         else:
             # get customised spline y values for each coordinate
-            _x, _y, _z = _get_coords_by_name('{}-P{}-simmspline'.format(muscle_name, pathpoint)).T
+            _x, _y, _z = _get_coords_by_name(muscle_name, pathpoint).T
             pp = omodel.muscles[muscle_name].path_points['{}-P{}'.format(muscle_name, pathpoint)]
             # get current spline values and replace spline y values with the new
             # ones
@@ -394,14 +1980,15 @@ def _update_osim_tibia_muscle_splines(side, omodel, labels, coords, in_unit, out
 
         pp.updateSimmSplineParams(x_params=sx, y_params=sy, z_params=sz)
 
-    _update_muscle('vas_med_{}'.format(side), '5')
-    _update_muscle('vas_int_{}'.format(side), '4')
-    _update_muscle('vas_lat_{}'.format(side), '5')
-    _update_muscle('rect_fem_{}'.format(side), '3')
+    for muscle_name, pathpoint in splines:
+        _update_muscle(muscle_name, pathpoint)
 
 
 def cust_segment_muscle_points(segment_name, target_model, omodel,
-                               in_unit='mm', out_unit='m', update_knee_splines=True, static_vas=False):
+                               in_unit='mm', out_unit='m', update_knee_splines=True, static_vas=False,
+                               seg_fit=None, host_x0=None, path_point_index=None,
+                               knee_splines=None, params=None, timings=None,
+                               callback=None):
     """
     Customise Gait2392 muscle point coordinates based on customised bone
     geometries. The reference gait2392 muscle points are embedded in 
@@ -431,10 +2018,34 @@ def cust_segment_muscle_points(segment_name, target_model, omodel,
         If True, uses the same customised path point coordinate for
         all point along the spline of the patella insertion of the
         vastus muscles. updatekneesplines must be True.
+    seg_fit : tuple [optional]
+        Output of _fit_segment for this segment and target_model if the
+        host mesh fit has already been run. If None, the fit is run here.
+    host_x0 : array [optional]
+        Initial host mesh parameters to warm start the fit from, e.g.
+        host_mesh.field_parameters of a previous result. Ignored if seg_fit
+        is given.
+    path_point_index : dict [optional]
+        Output of _muscle_path_point_index for omodel. Built on each call if
+        not given.
+    knee_splines : list [optional]
+        (muscle name, path point number) pairs of the tibia MovingPathPoints
+        to modify if update_knee_splines is True. Defaults to
+        TIBIA_SPLINE_PATH_POINTS.
+    params : dict or FittingProfile [optional]
+        Fitting parameters of the segment, e.g. from
+        segment_fitting_profile, to use instead of those in HMF_PARAMS.
+        Ignored if seg_fit is given.
+    timings : StageTimings [optional]
+        Records the time of each stage
+    callback : function [optional]
+        Called each host mesh fit iteration, see _hmf_seg. Ignored if
+        seg_fit is given.
 
     Returns
     -------
-    None
+    targ_pts, osim_surf_pts, osim_muscle_pts, cust_surf_pts,
+    cust_muscle_pts, host_mesh, host_mesh_0, fit_trace
     """
 
     if segment_name not in VALID_SEGS:
@@ -445,47 +2056,288 @@ def cust_segment_muscle_points(segment_name, target_model, omodel,
         )
     else:
         print('Customising muscle point in {}'.format(segment_name))
+    if timings is None:
+        timings = StageTimings()
 
     # load reference segment data
     targ_pts = target_model.gf.get_all_point_positions()
     (osim_surf_pts, osim_muscle_pts,
      osim_surf_xi, osim_muscle_xi,
      osim_muscle_labels,
-     host_mesh_0) = _osim_segment_data(segment_name, in_unit)
-    host_mesh = copy.deepcopy(host_mesh_0)
+     _) = _osim_segment_data(
+        segment_name, in_unit, _hmf_params(params)['host_elems']
+    )
 
     # host mesh fit reference segment to target model
-    cust_muscle_pts, rmse, cust_surf_pts = _hmf_seg(
-        targ_pts, osim_surf_pts, osim_muscle_pts, osim_surf_xi,
-        osim_muscle_xi, host_mesh
-    )
+    if seg_fit is None:
+        seg_fit = _fit_segment(
+            segment_name, targ_pts, in_unit, host_x0, params=params,
+            timings=timings, callback=callback
+        )
+    (cust_muscle_pts, rmse, cust_surf_pts, host_mesh, host_mesh_0,
+     fit_trace) = seg_fit
 
     # map new muscle positions to segment local CS
-    cust_muscle_pts_local = _map_local_coords(
-        segment_name, target_model, cust_muscle_pts
-    )
+    with timings.stage('local_mapping'):
+        cust_muscle_pts_local = _map_local_coords(
+            segment_name, target_model, cust_muscle_pts
+        )
 
     # update osim file
-    _update_osim_segment_muscle_points(
-        omodel, osim_muscle_labels, cust_muscle_pts_local, in_unit, out_unit
-    )
+    with timings.stage('opensim_update'):
+        _update_osim_segment_muscle_points(
+            omodel, osim_muscle_labels, cust_muscle_pts_local, in_unit,
+            out_unit, path_point_index
+        )
 
-    if update_knee_splines:
-        # for tibia_l and tibia_r, need to define new MovingPathPoints
-        if segment_name == 'tibia_l':
-            _update_osim_tibia_muscle_splines(
-                'l', omodel, osim_muscle_labels, cust_muscle_pts_local,
-                in_unit, out_unit, static_vas
-            )
-        elif segment_name == 'tibia_r':
-            _update_osim_tibia_muscle_splines(
-                'r', omodel, osim_muscle_labels, cust_muscle_pts_local,
-                in_unit, out_unit, static_vas
-            )
+        if update_knee_splines:
+            # for tibia_l and tibia_r, need to define new MovingPathPoints
+            if segment_name == 'tibia_l':
+                _update_osim_tibia_muscle_splines(
+                    'l', omodel, osim_muscle_labels, cust_muscle_pts_local,
+                    in_unit, out_unit, static_vas, knee_splines
+                )
+            elif segment_name == 'tibia_r':
+                _update_osim_tibia_muscle_splines(
+                    'r', omodel, osim_muscle_labels, cust_muscle_pts_local,
+                    in_unit, out_unit, static_vas, knee_splines
+                )
 
     return (targ_pts, osim_surf_pts, osim_muscle_pts, cust_surf_pts,
-            cust_muscle_pts, host_mesh, host_mesh_0
+            cust_muscle_pts, host_mesh, host_mesh_0, fit_trace
+            )
+
+
+def save_host_mesh_params(filename, params):
+    """
+    Save a dict of host mesh parameters keyed by segment name, e.g. from
+    gait2392MuscleCustomiser.host_mesh_params, to a .npz file.
+    """
+    np.savez(filename, **params)
+
+
+def load_host_mesh_params(filename):
+    """
+    Load a dict of host mesh parameters keyed by segment name saved by
+    save_host_mesh_params.
+    """
+    with np.load(filename) as f:
+        return dict((seg, f[seg]) for seg in f.files)
+
+
+def knee_spline_path_points(config, side=None):
+    """
+    (muscle name, path point number) pairs of the tibia MovingPathPoints
+    whose splines are customised with a gait2392MuscleCustomiser config:
+    config['knee_splines'] (TIBIA_SPLINE_PATH_POINTS if not set) formatted
+    with the side, or both sides if side is None. Empty if
+    config['update_knee_splines'] is False.
+    """
+    if not config.get('update_knee_splines'):
+        return []
+    patterns = config.get('knee_splines') or TIBIA_SPLINE_PATH_POINTS
+    sides = ('l', 'r') if side is None else (side,)
+    return [
+        (muscle_pat.format(s), str(pathpoint))
+        for s in sides for muscle_pat, pathpoint in patterns
+    ]
+
+
+def muscle_geometry(omodel, path_point_index=None, splines=()):
+    """
+    Muscle geometry of an opensim model that is changed by customisation:
+    the location of each muscle path point, the SimmSpline parameters of
+    the given MovingPathPoints and the optimal fiber and tendon slack
+    length of each muscle.
+
+    Inputs
+    ------
+    omodel : gias3 osim.Model instance
+    path_point_index : dict [optional]
+        Output of _muscle_path_point_index for omodel
+    splines : list [optional]
+        (muscle name, path point number) pairs of the MovingPathPoints
+        whose splines are customised, e.g. knee_spline_path_points(config).
+        Missing muscles and path points that are not MovingPathPoints are
+        skipped.
+
+    Returns
+    -------
+    geometry : dict
+        JSON-serialisable dict with keys "path_points" ({path point name:
+        [x, y, z]}), "splines" ({path point name: [x params, y params,
+        z params]}, see osim.PathPoint.getSimmSplineParams) and "muscles"
+        ({muscle name: [optimal fiber length, tendon slack length]})
+    """
+    if path_point_index is None:
+        path_point_index = _muscle_path_point_index(omodel)
+
+    path_points = dict(
+        (name, p.get_location().to_numpy().tolist())
+        for name, p in path_point_index.items() if p is not None
+    )
+    spline_params = {}
+    for muscle_name, pathpoint in splines:
+        if muscle_name not in omodel.muscles:
+            continue
+        pp_name = '{}-P{}'.format(muscle_name, pathpoint)
+        pp = omodel.muscles[muscle_name].path_points.get(pp_name)
+        if pp is None or not pp.isMovingPathPoint:
+            continue
+        spline_params[pp_name] = [
+            a.tolist() for a in pp.getSimmSplineParams()
+        ]
+    muscles = {}
+    for name, m in omodel.muscles.items():
+        muscles[name] = [
+            m._osimMuscle.getOptimalFiberLength(),
+            m._osimMuscle.getTendonSlackLength(),
+        ]
+
+    return {
+        'path_points': path_points,
+        'splines': spline_params,
+        'muscles': muscles,
+    }
+
+
+def muscle_geometry_delta(geometry_0, geometry, atol=0.0):
+    """
+    The entries of muscle geometry that differ from a reference geometry,
+    e.g. the geometry of the model before customisation.
+
+    Inputs
+    ------
+    geometry_0 : dict
+        Reference output of muscle_geometry
+    geometry : dict
+        Output of muscle_geometry to compare
+    atol : float [optional]
+        Absolute tolerance below which values are unchanged
+
+    Returns
+    -------
+    delta : dict
+        geometry with only the changed path points, splines and muscles,
+        and a "version" key. Apply it with apply_muscle_geometry_delta.
+    """
+    delta = {'version': MUSCLE_DELTA_VERSION}
+    for key in ('path_points', 'splines', 'muscles'):
+        ref = geometry_0[key]
+        delta[key] = dict(
+            (name, v) for name, v in geometry[key].items()
+            if name not in ref or _geometry_entry_changed(v, ref[name], atol)
+        )
+    return delta
+
+
+def _geometry_entry_changed(v, ref, atol):
+    """
+    Whether a muscle_geometry entry differs from a reference entry. Each
+    item is compared separately as the spline parameters of each axis can
+    have different numbers of knots, e.g. 17, 17 and 2 for the gait2392
+    knee splines.
+    """
+    return len(v) != len(ref) or any(
+        np.shape(a) != np.shape(b) or
+        not np.allclose(a, b, rtol=0.0, atol=atol)
+        for a, b in zip(v, ref)
+    )
+
+
+def apply_muscle_geometry_delta(omodel, delta, path_point_index=None):
+    """
+    Set the muscle geometry of an opensim model, e.g. a template gait2392
+    model, from the output of muscle_geometry_delta or muscle_geometry.
+
+    Inputs
+    ------
+    omodel : gias3 osim.Model instance
+    delta : dict
+        Geometry to set
+    path_point_index : dict [optional]
+        Output of _muscle_path_point_index for omodel
+    """
+    version = delta.get('version', MUSCLE_DELTA_VERSION)
+    if version != MUSCLE_DELTA_VERSION:
+        raise ValueError(
+            'Unsupported muscle geometry delta version {}'.format(version)
+        )
+    if path_point_index is None:
+        path_point_index = _muscle_path_point_index(omodel)
+
+    vec3 = osim.opensim.Vec3
+    for name, x in delta['path_points'].items():
+        path_point_index[name].set_location(vec3(*x))
+    for name, params in delta['splines'].items():
+        muscle_name = name.rsplit('-P', 1)[0]
+        pp = omodel.muscles[muscle_name].path_points[name]
+        sx, sy, sz = [np.array(a) for a in params]
+        pp.updateSimmSplineParams(x_params=sx, y_params=sy, z_params=sz)
+    for name, (ofl, tsl) in delta['muscles'].items():
+        m = omodel.muscles[name]._osimMuscle
+        m.setOptimalFiberLength(ofl)
+        m.setTendonSlackLength(tsl)
+
+
+def write_muscle_geometry_delta(filename, delta):
+    """
+    Write the output of muscle_geometry_delta to a JSON file
+    """
+    with open(filename, 'w') as f:
+        json.dump(delta, f, indent=1)
+
+
+def load_muscle_geometry_delta(filename):
+    """
+    Load a muscle geometry delta written by write_muscle_geometry_delta
+    """
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def osim_output_path(config, subject_id=''):
+    """
+    Path to write a customised model to: config['osim_output_name'] in
+    config['osim_output_dir']. The name can contain {identifier} (the step
+    identifier in config) and {subject} fields. If it is empty, the name is
+    OSIM_FILENAME, or {subject}.osim if subject_id is given. If subject_id
+    is given and the name has no {subject} field, _{subject} is added
+    before its extension so that each subject has its own file.
+    """
+    name = config.get('osim_output_name')
+    if not name:
+        name = '{subject}.osim' if subject_id else OSIM_FILENAME
+    elif subject_id and '{subject}' not in name:
+        root, ext = os.path.splitext(name)
+        name = root + '_{subject}' + ext
+    return os.path.join(
+        str(config['osim_output_dir']),
+        name.format(identifier=config.get('identifier', ''), subject=subject_id)
+    )
+
+
+def muscle_delta_path(osim_path):
+    """
+    Path of the muscle geometry delta written alongside a model path
+    """
+    return os.path.splitext(osim_path)[0] + MUSCLE_DELTA_SUFFIX
+
+
+# single background thread that writes customised models when
+# config['async_write'] is set, created on first use
+_OUTPUT_WRITER = None
+_OUTPUT_WRITER_LOCK = threading.Lock()
+
+
+def _output_writer():
+    global _OUTPUT_WRITER
+    with _OUTPUT_WRITER_LOCK:
+        if _OUTPUT_WRITER is None:
+            _OUTPUT_WRITER = futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='gait2392-writer'
             )
+        return _OUTPUT_WRITER
 
 
 class gait2392MuscleCustomiser(object):
@@ -500,12 +2352,56 @@ class gait2392MuscleCustomiser(object):
             Dictionary of option. (work in progress) Example:
             {
             'osim_output_dir': '/path/to/output/model.osim',
+            'osim_output_name': '{identifier}.osim',
+            'osim_output_format': 'model',
+            'async_write': False,
             'in_unit': 'mm',
             'out_unit': 'm',
             'write_osim_file': True,
             'update_knee_splines': False,
+            'knee_splines': None,
             'static_vas': False,
+            'parallel': 'serial',
+            'parallel_workers': 0,
+            'fit_cache_dir': '',
+            'fit_cache_max_mb': 0,
+            'fitting_profile': 'default',
+            'segment_fitting_profiles': {},
+            'hmf_params': {},
+            'muscle_report': '',
+            'timings_file': '',
+            'profile_file': '',
             }
+            knee_splines lists the [muscle name pattern, path point
+            number] pairs of the tibia MovingPathPoints whose splines are
+            updated if update_knee_splines is True (None for
+            TIBIA_SPLINE_PATH_POINTS), see knee_spline_path_points.
+            parallel is one of VALID_PARALLEL_MODES and sets how the
+            segment host mesh fits are run. The fits hold the GIL for
+            most of their time, so only "processes" runs them faster than
+            "serial"; "threads" gives the same results as the other modes
+            without a speedup. parallel_workers is the
+            maximum number of worker threads or processes (0 or None for
+            the executor default). If fit_cache_dir is set, segment fit
+            results are cached there (see FitResultCache), using at most
+            fit_cache_max_mb megabytes (0 for no limit).
+            fitting_profile is the name of a fitting profile in PRESETS
+            or a dict of FittingProfile parameters.
+            segment_fitting_profiles maps segment names to a preset name
+            replacing fitting_profile or a dict of parameters updating it
+            for that segment. hmf_params overrides entries of the
+            profiles of all segments, see segment_fitting_profile.
+            muscle_report is empty to
+            skip muscle length reporting, "log" to log it or a .csv or
+            .json file path to write it to. timings_file and profile_file
+            are paths to write stage timings and cProfile stats to, see
+            customise. osim_output_name is the file name of the customised
+            model in osim_output_dir (see osim_output_path).
+            osim_output_format is one of VALID_OSIM_OUTPUT_FORMATS and sets
+            whether the whole model, the muscle geometry delta (see
+            muscle_geometry_delta) or both are written. If async_write is
+            True, they are written on a background thread, see
+            wait_for_write.
         ll : LowerLimbAtlas instance
             Model of lower limb bone geometry and pose
         osimmodel : opensim.Model instance
@@ -515,6 +2411,26 @@ class gait2392MuscleCustomiser(object):
         self.config = config
         self.ll = ll
         self.gias_osimmodel = None
+        self.path_point_index = None
+        self._scale_set = None
+        self.muscle_report = None
+        # StageTimings of each segment and of the whole model ("model")
+        # from the last customisation
+        self.timings = {}
+        self.seg_fits = {}
+        # initial host mesh parameters for each segment to warm start fits
+        # from, e.g. the host_mesh_params of a previous run
+        self.host_x0 = {}
+        # called each host mesh fit iteration as
+        # fit_callback(segment_name, iteration, rmse, step_norm), stopping
+        # the fit if it returns True, see _host_mesh_fit_points. Must be
+        # picklable if config['parallel'] is "processes".
+        self.fit_callback = None
+        # muscle_geometry of the model before customisation, for writing
+        # muscle geometry deltas
+        self.muscle_geometry_0 = None
+        # future of the background write when config['async_write'] is set
+        self._write_future = None
         if osimmodel is not None:
             self.set_osim_model(osimmodel)
         self._unit_scaling = dim_unit_scaling(
@@ -523,118 +2439,763 @@ class gait2392MuscleCustomiser(object):
 
     def set_osim_model(self, model):
         self.gias_osimmodel = osim.Model(model=model)
+        self.path_point_index = _muscle_path_point_index(self.gias_osimmodel)
+
+    def load_osim_model(self, filename):
+        self.gias_osimmodel = osim.Model(filename=filename)
+        self.path_point_index = _muscle_path_point_index(self.gias_osimmodel)
 
-    def cust_pelvis(self):
+    def cust_pelvis(self, seg_fit=None):
         self.pelvis_res = cust_segment_muscle_points(
             'pelvis', self.ll.models['pelvis'], self.gias_osimmodel,
             in_unit=self.config['in_unit'],
             out_unit=self.config['out_unit'],
+            seg_fit=seg_fit,
+            path_point_index=self.path_point_index,
+            params=segment_fitting_profile(self.config, 'pelvis').to_dict(),
+            timings=self._timings('pelvis'),
+            callback=self._fit_callback('pelvis'),
         )
 
-    def cust_femur_l(self):
+    def cust_femur_l(self, seg_fit=None):
         self.femur_l_res = cust_segment_muscle_points(
             'femur_l', self.ll.models['femur-l'], self.gias_osimmodel,
             in_unit=self.config['in_unit'],
             out_unit=self.config['out_unit'],
+            seg_fit=seg_fit,
+            path_point_index=self.path_point_index,
+            params=segment_fitting_profile(self.config, 'femur_l').to_dict(),
+            timings=self._timings('femur_l'),
+            callback=self._fit_callback('femur_l'),
         )
 
-    def cust_femur_r(self):
+    def cust_femur_r(self, seg_fit=None):
         self.femur_r_res = cust_segment_muscle_points(
             'femur_r', self.ll.models['femur-r'], self.gias_osimmodel,
             in_unit=self.config['in_unit'],
             out_unit=self.config['out_unit'],
+            seg_fit=seg_fit,
+            path_point_index=self.path_point_index,
+            params=segment_fitting_profile(self.config, 'femur_r').to_dict(),
+            timings=self._timings('femur_r'),
+            callback=self._fit_callback('femur_r'),
         )
 
-    def cust_tibia_l(self):
+    def cust_tibia_l(self, seg_fit=None):
         self.tibia_l_res = cust_segment_muscle_points(
             'tibia_l', self.ll.models['tibiafibula-l'], self.gias_osimmodel,
             in_unit=self.config['in_unit'],
             out_unit=self.config['out_unit'],
             update_knee_splines=self.config['update_knee_splines'],
-            static_vas=self.config['static_vas']
+            static_vas=self.config['static_vas'],
+            seg_fit=seg_fit,
+            path_point_index=self.path_point_index,
+            knee_splines=knee_spline_path_points(self.config, 'l'),
+            params=segment_fitting_profile(self.config, 'tibia_l').to_dict(),
+            timings=self._timings('tibia_l'),
+            callback=self._fit_callback('tibia_l'),
         )
 
-    def cust_tibia_r(self):
+    def cust_tibia_r(self, seg_fit=None):
         self.tibia_r_res = cust_segment_muscle_points(
             'tibia_r', self.ll.models['tibiafibula-r'], self.gias_osimmodel,
             in_unit=self.config['in_unit'],
             out_unit=self.config['out_unit'],
             update_knee_splines=self.config['update_knee_splines'],
-            static_vas=self.config['static_vas']
+            static_vas=self.config['static_vas'],
+            seg_fit=seg_fit,
+            path_point_index=self.path_point_index,
+            knee_splines=knee_spline_path_points(self.config, 'r'),
+            params=segment_fitting_profile(self.config, 'tibia_r').to_dict(),
+            timings=self._timings('tibia_r'),
+            callback=self._fit_callback('tibia_r'),
         )
 
-    def write_cust_osim_model(self):
-        self.gias_osimmodel.save(
-            os.path.join(str(self.config['osim_output_dir']), OSIM_FILENAME)
+    def _fit_callback(self, segment_name):
+        """
+        fit_callback bound to a segment, or None if it is not set
+        """
+        if self.fit_callback is None:
+            return None
+        return functools.partial(self.fit_callback, segment_name)
+
+    def _timings(self, name):
+        """
+        StageTimings of a segment or of the model ("model") from the current
+        customisation
+        """
+        if name not in self.timings:
+            self.timings[name] = StageTimings()
+        return self.timings[name]
+
+    def timings_dict(self):
+        """
+        Stage timings of each segment and the model as JSON-serialisable
+        lists of dicts with the stage name, wall and cpu times in seconds
+        and any stage information
+        """
+        return dict(
+            (name, timings.to_list()) for name, timings in self.timings.items()
         )
 
-    def customise(self):
+    def write_timings(self, filename):
+        """
+        Write timings_dict to a JSON file
+        """
+        with open(filename, 'w') as f:
+            json.dump(self.timings_dict(), f, indent=2)
 
-        init_muscle_ofl = dict([(m.name, m.optimalFiberLength) for m in self.gias_osimmodel.muscles.values()])
-        init_muscle_tsl = dict([(m.name, m.tendonSlackLength) for m in self.gias_osimmodel.muscles.values()])
+    def fit_cache(self):
+        """
+        The FitResultCache set by the config, or None if caching is off
+        """
+        cache_dir = self.config.get('fit_cache_dir')
+        if not cache_dir:
+            return None
+        max_mb = self.config.get('fit_cache_max_mb')
+        return FitResultCache(
+            cache_dir, int(max_mb * 1024 * 1024) if max_mb else None
+        )
 
-        # prescale muscles
-        self.prescale_muscles()
+    def fit_segments(self):
+        """
+        Run the host mesh fits of all segments using the execution mode in
+        config['parallel'].
 
-        prescale_muscle_ofl = dict([(m.name, m.optimalFiberLength) for m in self.gias_osimmodel.muscles.values()])
-        prescale_muscle_tsl = dict([(m.name, m.tendonSlackLength) for m in self.gias_osimmodel.muscles.values()])
+        Returns
+        -------
+        seg_fits : dict
+            Output of _fit_segment for each segment name
+        """
+        mode = self.config.get('parallel', 'serial')
+        if mode not in VALID_PARALLEL_MODES:
+            raise ValueError(
+                'Invalid parallel mode {}. Must be one of {}'.format(
+                    mode, VALID_PARALLEL_MODES
+                )
+            )
+        targ_pts = dict(
+            (seg, self.ll.models[model_name].gf.get_all_point_positions())
+            for seg, model_name in SEGMENT_MODELS
+        )
+        cache = self.fit_cache()
+        hmf_params = dict(
+            (seg, segment_fitting_profile(self.config, seg).to_dict())
+            for seg, _ in SEGMENT_MODELS
+        )
 
-        self.cust_pelvis()
-        self.cust_femur_l()
-        self.cust_tibia_l()
-        self.cust_femur_r()
-        self.cust_tibia_r()
+        if mode == 'serial':
+            results = dict(
+                (seg, _timed_fit_segment(
+                    seg, targ_pts[seg], self.config['in_unit'],
+                    self.host_x0.get(seg), cache, hmf_params[seg],
+                    self._fit_callback(seg)
+                ))
+                for seg, _ in SEGMENT_MODELS
+            )
+        else:
+            if mode == 'threads':
+                executor_class = futures.ThreadPoolExecutor
+            else:
+                executor_class = futures.ProcessPoolExecutor
+
+            with executor_class(max_workers=self.config.get('parallel_workers') or None) as executor:
+                seg_futures = dict(
+                    (seg, executor.submit(
+                        _timed_fit_segment, seg, targ_pts[seg],
+                        self.config['in_unit'], self.host_x0.get(seg), cache,
+                        hmf_params[seg], self._fit_callback(seg)
+                    ))
+                    for seg, _ in SEGMENT_MODELS
+                )
+                results = dict(
+                    (seg, f.result()) for seg, f in seg_futures.items()
+                )
+
+        for seg, (_, timings) in results.items():
+            self._timings(seg).stages.extend(timings.stages)
+        return dict((seg, seg_fit) for seg, (seg_fit, _) in results.items())
+
+    def host_mesh_params(self):
+        """
+        Fitted host mesh parameters of each segment from the last
+        customisation. Can be set as host_x0 to warm start a later run.
+        """
+        return dict(
+            (seg, seg_fit[3].field_parameters)
+            for seg, seg_fit in self.seg_fits.items()
+        )
 
-        # post-scale muscles
-        self.postscale_muscles()
+    def fit_traces(self):
+        """
+        Convergence of the host mesh fits of each segment from the last
+        customisation, see _hmf_seg
+        """
+        return dict(
+            (seg, seg_fit[5]) for seg, seg_fit in self.seg_fits.items()
+        )
 
-        postscale_muscle_ofl = dict([(m.name, m.optimalFiberLength) for m in self.gias_osimmodel.muscles.values()])
-        postscale_muscle_tsl = dict([(m.name, m.tendonSlackLength) for m in self.gias_osimmodel.muscles.values()])
+    def write_cust_osim_model(self, filename=None):
+        """
+        Write the customised model to filename. Defaults to
+        osim_output_path(config).
+        """
+        if filename is None:
+            filename = osim_output_path(self.config)
+        self.gias_osimmodel.save(filename)
 
-        for mn in sorted(self.gias_osimmodel.muscles.keys()):
-            print('{} OFL: {:8.6f} -> {:8.6f} -> {:8.6f}'.format(
-                mn,
-                init_muscle_ofl[mn],
-                prescale_muscle_ofl[mn],
-                postscale_muscle_ofl[mn]
+    def muscle_delta(self):
+        """
+        Changes to the muscle geometry of the model since the start of the
+        last customisation, see muscle_geometry_delta
+        """
+        return muscle_geometry_delta(
+            self.muscle_geometry_0,
+            muscle_geometry(
+                self.gias_osimmodel, self.path_point_index,
+                knee_spline_path_points(self.config)
             )
+        )
+
+    def write_muscle_delta(self, filename=None):
+        """
+        Write muscle_delta to a JSON file. Defaults to the
+        muscle_delta_path of osim_output_path(config).
+        """
+        if filename is None:
+            filename = muscle_delta_path(osim_output_path(self.config))
+        write_muscle_geometry_delta(filename, self.muscle_delta())
+
+    def write_outputs(self, filename=None):
+        """
+        Write the model and/or muscle geometry delta as set by
+        config['osim_output_format']. filename is the model path, defaults
+        to osim_output_path(config). The delta is written to its
+        muscle_delta_path.
+
+        Returns
+        -------
+        model_path : str or None
+            Path of the written model, None if not written
+        delta_path : str or None
+            Path of the written muscle geometry delta, None if not written
+        """
+        fmt = self._output_format()
+        if filename is None:
+            filename = osim_output_path(self.config)
+        model_path = None
+        delta_path = None
+        if fmt in ('model', 'both'):
+            self.write_cust_osim_model(filename)
+            model_path = filename
+        if fmt in ('delta', 'both'):
+            delta_path = muscle_delta_path(filename)
+            self.write_muscle_delta(delta_path)
+        return model_path, delta_path
+
+    def wait_for_write(self):
+        """
+        Wait for a background write started by customise to finish.
+        Returns the output of write_outputs, or None if there was no
+        background write. Errors of the write are raised here.
+        """
+        future, self._write_future = self._write_future, None
+        if future is None:
+            return None
+        return future.result()
+
+    def _output_format(self):
+        fmt = self.config.get('osim_output_format', 'model')
+        if fmt not in VALID_OSIM_OUTPUT_FORMATS:
+            raise ValueError(
+                'Invalid osim output format {}. Must be one of {}'.format(
+                    fmt, VALID_OSIM_OUTPUT_FORMATS
+                )
             )
-        for mn in sorted(self.gias_osimmodel.muscles.keys()):
-            print('{} TSL: {:8.6f} -> {:8.6f} -> {:8.6f}'.format(
-                mn,
-                init_muscle_tsl[mn],
-                prescale_muscle_tsl[mn],
-                postscale_muscle_tsl[mn]
+        return fmt
+
+    def customise(self):
+        """
+        Customise the muscle points of the model. If config['muscle_report']
+        is set, optimal fiber and tendon slack lengths before and after
+        scaling are collected in self.muscle_report and written to it, see
+        MuscleLengthReport.write.
+
+        If config['write_osim_file'] is True, the outputs are written with
+        write_outputs, on a background thread if config['async_write'] is
+        set. Call wait_for_write before using or changing the model after
+        an asynchronous write.
+
+        The time of each stage is recorded in self.timings and written to
+        config['timings_file'] as JSON if set. If config['profile_file'] is
+        set, the customisation is run under cProfile and the stats are
+        dumped there. Fits run in worker processes are not profiled.
+        """
+        self.timings = {}
+        profile_file = self.config.get('profile_file')
+        profiler = cProfile.Profile() if profile_file else None
+        if profiler is not None:
+            profiler.enable()
+        try:
+            self._customise()
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(profile_file)
+
+        timings_file = self.config.get('timings_file')
+        if timings_file:
+            self.write_timings(timings_file)
+
+    def _customise(self):
+        # the model must not be changed while it is being written
+        self.wait_for_write()
+        model_timings = self._timings('model')
+        if self._output_format() in ('delta', 'both'):
+            self.muscle_geometry_0 = muscle_geometry(
+                self.gias_osimmodel, self.path_point_index,
+                knee_spline_path_points(self.config)
             )
+        report_sink = self.config.get('muscle_report', MUSCLE_REPORT_OFF)
+        if report_sink:
+            _muscle_report_format(report_sink)
+            self.muscle_report = MuscleLengthReport(
+                sorted(self.gias_osimmodel.muscles.keys())
             )
+            self.muscle_report.record('init', self.gias_osimmodel)
+        else:
+            self.muscle_report = None
+
+        # prescale muscles
+        with model_timings.stage('prescale'):
+            self.prescale_muscles()
+        if self.muscle_report is not None:
+            self.muscle_report.record('prescale', self.gias_osimmodel)
+
+        # fit segments, then update the opensim model in a fixed order
+        with model_timings.stage(
+                'fit_segments', parallel=self.config.get('parallel', 'serial')):
+            self.seg_fits = self.fit_segments()
+        self.cust_pelvis(self.seg_fits['pelvis'])
+        self.cust_femur_l(self.seg_fits['femur_l'])
+        self.cust_tibia_l(self.seg_fits['tibia_l'])
+        self.cust_femur_r(self.seg_fits['femur_r'])
+        self.cust_tibia_r(self.seg_fits['tibia_r'])
+
+        # post-scale muscles
+        with model_timings.stage('postscale'):
+            self.postscale_muscles()
+        if self.muscle_report is not None:
+            self.muscle_report.record('postscale', self.gias_osimmodel)
+            self.muscle_report.write(report_sink)
 
         if self.config['write_osim_file']:
-            self.write_cust_osim_model()
+            async_write = self.config.get('async_write', False)
+            with model_timings.stage('model_write', async_write=async_write):
+                if async_write:
+                    self._write_future = _output_writer().submit(
+                        self.write_outputs
+                    )
+                else:
+                    self.write_outputs()
+
+    def _scale_state(self, rebuild):
+        """
+        Make a default state of the opensim model for muscle scaling. The
+        model's system is only built (initSystem) if rebuild is True or it
+        has not been built yet. Otherwise the state is made from the existing
+        system, which must be up to date with the model.
+        """
+        model = self.gias_osimmodel._model
+        if rebuild or not model.hasSystem():
+            return model.initSystem()
+        return model.initializeState()
+
+    def _dummy_scale_set(self):
+        """
+        ScaleSet of a single dummy scale factor shared by all muscles when
+        pre- and post-scaling
+        """
+        if self._scale_set is None:
+            self._scale_set = osim.opensim.ScaleSet()
+            self._scale_set.cloneAndAppend(
+                osim.Scale([1, 1, 1], 'dummy_scale', 'dummy_body')._osimScale
+            )
+        return self._scale_set
 
     def prescale_muscles(self):
         """
         Apply prescaling and scaling to muscles before bodies and joints are
-        customised
+        customised. The model's existing system is reused if it has already
+        been built, e.g. by a previous step.
         """
-        state_0 = self.gias_osimmodel._model.initSystem()
-
-        # create dummy scale factor
-        scale_factors = [
-            osim.Scale([1, 1, 1], 'dummy_scale', 'dummy_body')
-        ]
+        state_0 = self._scale_state(rebuild=False)
+        scale_set = self._dummy_scale_set()
         for m in self.gias_osimmodel.muscles.values():
-            m.preScale(state_0, *scale_factors)
+            m._osimMuscle.preScale(state_0, scale_set)
             # m.scale(state_0, *scale_factors)
 
     def postscale_muscles(self):
         """
         Postscale muscles after bodies and joints are customised to update
-        optimal fiber lengths and tendon slack lengths
+        optimal fiber lengths and tendon slack lengths. The model's system is
+        rebuilt since muscle path points have been moved.
         """
-        state_1 = self.gias_osimmodel._model.initSystem()
-        # create dummy scale factor
-        scale_factors = [
-            osim.Scale([1, 1, 1], 'dummy_scale', 'dummy_body')
-        ]
+        state_1 = self._scale_state(rebuild=True)
+        scale_set = self._dummy_scale_set()
         for m in self.gias_osimmodel.muscles.values():
-            m.postScale(state_1, *scale_factors)
+            m._osimMuscle.postScale(state_1, scale_set)
+
+
+
+def _muscle_report_format(sink):
+    """
+    Output format of a muscle_report config value: "log", "csv" or "json"
+    """
+    if sink == MUSCLE_REPORT_LOG:
+        return 'log'
+    ext = os.path.splitext(sink)[1].lower()
+    if ext in ('.csv', '.json'):
+        return ext[1:]
+    raise ValueError(
+        'Invalid muscle report {}. Must be "{}" or a .csv or .json '
+        'file path'.format(sink, MUSCLE_REPORT_LOG)
+    )
+
+
+class MuscleLengthReport(object):
+    STAGES = ('init', 'prescale', 'postscale')
+
+    def __init__(self, muscles):
+        """
+        Optimal fiber lengths and tendon slack lengths of muscles at each
+        stage of customisation.
+
+        inputs
+        ======
+        muscles : list of str
+            Muscle names. Rows of ofl and tsl are in this order.
+        """
+        self.muscles = list(muscles)
+        self.ofl = np.full((len(self.muscles), len(self.STAGES)), np.nan)
+        self.tsl = np.full((len(self.muscles), len(self.STAGES)), np.nan)
+
+    def record(self, stage, gias_osimmodel):
+        """
+        Record the current muscle lengths of a model as the given stage
+        """
+        si = self.STAGES.index(stage)
+        for mi, name in enumerate(self.muscles):
+            m = gias_osimmodel.muscles[name]._osimMuscle
+            self.ofl[mi, si] = m.getOptimalFiberLength()
+            self.tsl[mi, si] = m.getTendonSlackLength()
+
+    def to_dict(self):
+        return {
+            'stages': list(self.STAGES),
+            'muscles': self.muscles,
+            'ofl': self.ofl.tolist(),
+            'tsl': self.tsl.tolist(),
+        }
+
+    def log(self, logger=log, level=logging.INFO):
+        for quantity, values in (('OFL', self.ofl), ('TSL', self.tsl)):
+            for name, v in zip(self.muscles, values):
+                logger.log(
+                    level, '{} {}: {:8.6f} -> {:8.6f} -> {:8.6f}'.format(
+                        name, quantity, *v
+                    )
+                )
+
+    def write_csv(self, filename):
+        with open(filename, 'w') as f:
+            f.write(','.join(
+                ['muscle'] +
+                ['ofl_{}'.format(s) for s in self.STAGES] +
+                ['tsl_{}'.format(s) for s in self.STAGES]
+            ) + '\n')
+            for name, ofl, tsl in zip(self.muscles, self.ofl, self.tsl):
+                f.write(','.join(
+                    [name] + ['{:.9g}'.format(v) for v in np.hstack([ofl, tsl])]
+                ) + '\n')
+
+    def write_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def write(self, sink):
+        """
+        Output the report to sink: MUSCLE_REPORT_LOG to log it, or a .csv
+        or .json file path
+        """
+        fmt = _muscle_report_format(sink)
+        if fmt == 'log':
+            self.log()
+        elif fmt == 'csv':
+            self.write_csv(sink)
+        else:
+            self.write_json(sink)
+
+
+def _subject_record(subject_id, error=None):
+    """
+    An empty customise_cohort record of a subject
+    """
+    return {
+        'subject': subject_id,
+        'output': None,
+        'delta': None,
+        'rmse': {},
+        'host_x_opt': {},
+        'fit_trace': {},
+        'timings': {},
+        'time': None,
+        'error': error,
+    }
+
+
+def _customise_subject(subject_id, ll, osimmodel, config, output_path,
+                       host_x0=None, async_write=False):
+    """
+    Customise one subject for customise_cohort. Errors are caught and
+    recorded so that one failed subject does not stop the others. If
+    async_write is True, the outputs are written on the background writer
+    thread and record["output"] is the future of the write until
+    _finish_subject_write is called.
+    """
+    record = _subject_record(subject_id)
+    t0 = time.time()
+    try:
+        subject_config = dict(config, write_osim_file=False, parallel='serial')
+        # one report, timings and profile file per subject next to its model
+        for key, suffix in (('muscle_report', '_muscles'),
+                            ('timings_file', '_timings'),
+                            ('profile_file', '_profile')):
+            sink = config.get(key)
+            if sink and sink != MUSCLE_REPORT_LOG:
+                subject_config[key] = '{}{}{}'.format(
+                    os.path.splitext(output_path)[0], suffix,
+                    os.path.splitext(sink)[1]
+                )
+        if isinstance(ll, str):
+            with open(ll, 'rb') as f:
+                ll = pickle.load(f)
+        cust = gait2392MuscleCustomiser(subject_config, ll=ll)
+        if isinstance(osimmodel, str):
+            cust.load_osim_model(osimmodel)
+        else:
+            cust.set_osim_model(osimmodel)
+        if host_x0 is not None:
+            cust.host_x0 = host_x0
+        cust.customise()
+        record['rmse'] = dict(
+            (seg, float(seg_fit[1])) for seg, seg_fit in cust.seg_fits.items()
+        )
+        record['host_x_opt'] = cust.host_mesh_params()
+        record['fit_trace'] = cust.fit_traces()
+        record['timings'] = cust.timings_dict()
+        if config.get('write_osim_file', True):
+            if async_write:
+                record['output'] = _output_writer().submit(
+                    cust.write_outputs, output_path
+                )
+            else:
+                record['output'], record['delta'] = cust.write_outputs(
+                    output_path
+                )
+    except Exception:
+        record['error'] = traceback.format_exc()
+    record['time'] = time.time() - t0
+    return record
+
+
+def _finish_subject_write(record):
+    """
+    Wait for the asynchronous write of a _customise_subject record and set
+    its output paths, or its error if the write failed
+    """
+    future = record['output']
+    if not isinstance(future, futures.Future):
+        return record
+    record['output'] = None
+    try:
+        record['output'], record['delta'] = future.result()
+    except Exception:
+        record['error'] = traceback.format_exc()
+    return record
+
+
+def _check_output_paths(subject_paths, output_subjects=None):
+    """
+    Raise a ValueError if two subjects of (subject_id, output_path) pairs
+    have the same output path. output_subjects maps the output paths of
+    previously checked subjects to their ids and is updated.
+    """
+    if output_subjects is None:
+        output_subjects = {}
+    for subject_id, output_path in subject_paths:
+        if output_path in output_subjects:
+            raise ValueError(
+                'Subjects {} and {} would both be written to {}. Use a '
+                '{{subject}} field in osim_output_name and unique subject '
+                'ids.'.format(
+                    output_subjects[output_path], subject_id, output_path
+                )
+            )
+        output_subjects[output_path] = subject_id
+
+
+def check_cohort_output_paths(subject_ids, config, output_dir=None):
+    """
+    Raise a ValueError if two subjects of a customise_cohort run would be
+    written to the same output path
+
+    Inputs
+    ------
+    subject_ids : iterable
+        Ids of the subjects, in order.
+    config : dict
+        gait2392MuscleCustomiser options.
+    output_dir : str [optional]
+        As for customise_cohort. Defaults to config['osim_output_dir'].
+    """
+    if output_dir is None:
+        output_dir = str(config['osim_output_dir'])
+    output_config = dict(config, osim_output_dir=output_dir)
+    _check_output_paths(
+        (subject_id, osim_output_path(output_config, str(subject_id)))
+        for subject_id in subject_ids
+    )
+
+
+def customise_cohort(subjects, config, workers=None, output_dir=None):
+    """
+    Customise the gait2392 muscle points of many subjects. Subjects are
+    streamed through a process pool, each worker keeping its own cache of
+    the reference segment data.
+
+    Inputs
+    ------
+    subjects : iterable
+        (subject_id, ll, osimmodel) tuples, where ll is a LowerLimbAtlas
+        instance or the path of a pickled one, loaded by the worker, and
+        osimmodel is the path of the .osim file to customise.
+        osimmodel can also be an opensim.Model instance if workers is 0.
+        An optional fourth item is a dict of initial host mesh parameters
+        per segment to warm start the fits from, e.g. the "host_x_opt" of
+        a previous record.
+    config : dict
+        gait2392MuscleCustomiser options. config['parallel'] is ignored,
+        segments of a subject are fitted serially within a worker.
+    workers : int [optional]
+        Number of worker processes. None for the executor default, 0 to
+        customise all subjects in the calling process.
+    output_dir : str [optional]
+        Directory to write the customised models to, named by
+        osim_output_path, {subject_id}.osim by default. If subjects is a
+        sequence, subjects with the same output path raise a ValueError
+        before any subject is customised. Otherwise a subject with the
+        output path of an earlier subject is not customised and the clash
+        is recorded as its error. Defaults to
+        config['osim_output_dir']. config['osim_output_format'] sets
+        whether models and/or muscle geometry deltas are written. If
+        config['async_write'] is set and workers is 0, each subject's
+        outputs are written on a background thread while the next subject
+        is customised. Worker processes always write synchronously.
+
+    Returns
+    -------
+    records : list of dicts
+        One record per subject in input order with keys "subject",
+        "output" (path of the written model), "delta" (path of the written
+        muscle geometry delta), "rmse" (dict of host mesh fit
+        RMSE per segment), "host_x_opt" (dict of fitted host mesh parameters
+        per segment), "fit_trace" (convergence of the host mesh fits per
+        segment, see gait2392MuscleCustomiser.fit_traces), "timings"
+        (gait2392MuscleCustomiser.timings_dict),
+        "time" (seconds) and "error" (traceback string if the subject
+        failed, else None).
+    """
+    if output_dir is None:
+        output_dir = str(config['osim_output_dir'])
+    output_config = dict(config, osim_output_dir=output_dir)
+    if isinstance(subjects, Sequence):
+        check_cohort_output_paths(
+            [s[0] for s in subjects], config, output_dir
+        )
+    # subject of each output path, to also check subjects that are read
+    # lazily
+    output_subjects = {}
+
+    def _args(subject):
+        subject_id, ll, osimmodel = subject[:3]
+        host_x0 = subject[3] if len(subject) > 3 else None
+        output_path = osim_output_path(output_config, str(subject_id))
+        return subject_id, ll, osimmodel, config, output_path, host_x0
+
+    def _clash_record(args):
+        # the error record of a subject with the output path of an earlier
+        # subject, None if its output path is unique
+        try:
+            _check_output_paths([(args[0], args[4])], output_subjects)
+        except ValueError:
+            return _subject_record(args[0], traceback.format_exc())
+        return None
+
+    if workers == 0:
+        async_write = config.get('async_write', False)
+        records = []
+        for s in subjects:
+            args = _args(s)
+            record = _clash_record(args)
+            if record is None:
+                record = _customise_subject(*args, async_write=async_write)
+            records.append(record)
+        return [_finish_subject_write(r) for r in records]
+
+    records = []
+    with futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_preload_config_reference_data,
+            initargs=(config,),
+    ) as executor:
+        # keep a bounded number of subjects in flight so that the subjects
+        # iterable can be a generator that loads each subject lazily
+        max_pending = 2 * (workers or os.cpu_count() or 1)
+        pending = []
+        for si, subject in enumerate(subjects):
+            args = _args(subject)
+            record = _clash_record(args)
+            if record is not None:
+                records.append((si, record))
+                continue
+            pending.append((
+                si, subject[0], executor.submit(_customise_subject, *args)
+            ))
+            if len(pending) >= max_pending:
+                records.append(_cohort_result(*pending.pop(0)))
+        for p in pending:
+            records.append(_cohort_result(*p))
+
+    return [r for _, r in sorted(records, key=lambda x: x[0])]
+
+
+def _cohort_result(index, subject_id, future):
+    """
+    Get the record of a customise_cohort job. Failures outside
+    _customise_subject (e.g. inputs that cannot be sent to a worker) are
+    recorded in the same way.
+    """
+    try:
+        record = future.result()
+    except Exception:
+        record = _subject_record(subject_id, traceback.format_exc())
+    return index, record
+
+
+if os.environ.get(PRELOAD_ENV_VAR):
+    preload_reference_data(out_unit=os.environ[PRELOAD_ENV_VAR])
+
+if __name__ == '__main__':
+    for _filename in build_reference_archives():
+        print('Wrote {}'.format(_filename))
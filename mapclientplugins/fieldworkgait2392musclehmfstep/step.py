@@ -7,7 +7,7 @@ from PySide6 import QtGui
 
 from mapclient.mountpoints.workflowstep import WorkflowStepMountPoint
 from mapclientplugins.fieldworkgait2392musclehmfstep.configuredialog import ConfigureDialog
-from mapclientplugins.fieldworkgait2392musclehmfstep.gait2392musclecusthmf import gait2392MuscleCustomiser
+from mapclientplugins.fieldworkgait2392musclehmfstep.constants import DEFAULT_CONFIG
 
 
 class FieldworkGait2392MuscleHMFStep(WorkflowStepMountPoint):
@@ -50,16 +50,18 @@ class FieldworkGait2392MuscleHMFStep(WorkflowStepMountPoint):
         self._portData1 = None  # http://physiomeproject.org/workflow/1.0/rdf-schema#osimmodel
         self._portData2 = None  # http://physiomeproject.org/workflow/1.0/rdf-schema#osimmodel
         # Config:
-        self._config = {}
+        self._config = dict(DEFAULT_CONFIG)
         self._config['identifier'] = ''
-        self._config['osim_output_dir'] = './gait2392_simbody_custom.osim'
-        self._config['in_unit'] = 'mm'
-        self._config['out_unit'] = 'm'
-        self._config['write_osim_file'] = True
-        self._config['update_knee_splines'] = False
-        self._config['static_vas'] = False
 
-        self._g2392_muscle_hmf = gait2392MuscleCustomiser(self._config)
+        # created on first use so that gias3 and OpenSim are only imported
+        # when the step is run
+        self._g2392_muscle_hmf = None
+
+    def _customiser(self):
+        if self._g2392_muscle_hmf is None:
+            from mapclientplugins.fieldworkgait2392musclehmfstep.gait2392musclecusthmf import gait2392MuscleCustomiser
+            self._g2392_muscle_hmf = gait2392MuscleCustomiser(self._config)
+        return self._g2392_muscle_hmf
 
     def execute(self):
         '''
@@ -68,8 +70,9 @@ class FieldworkGait2392MuscleHMFStep(WorkflowStepMountPoint):
         may be connected up to a button in a widget for example.
         '''
         # Put your execute step code here before calling the '_doneExecution' method.
-        self._g2392_muscle_hmf.config = self._config
-        self._g2392_muscle_hmf.customise()
+        customiser = self._customiser()
+        customiser.config = self._config
+        customiser.customise()
         self._doneExecution()
 
     def setPortData(self, index, dataIn):
@@ -79,9 +82,9 @@ class FieldworkGait2392MuscleHMFStep(WorkflowStepMountPoint):
         uses port for this step then the index can be ignored.
         '''
         if index == 0:
-            self._g2392_muscle_hmf.ll = dataIn  # http://physiomeproject.org/workflow/1.0/rdf-schema#gias-lowerlimb
+            self._customiser().ll = dataIn  # http://physiomeproject.org/workflow/1.0/rdf-schema#gias-lowerlimb
         elif index == 1:
-            self._g2392_muscle_hmf.set_osim_model(
+            self._customiser().set_osim_model(
                 dataIn)  # http://physiomeproject.org/workflow/1.0/rdf-schema#osimmodel
 
     def getPortData(self, index):
@@ -90,7 +93,10 @@ class FieldworkGait2392MuscleHMFStep(WorkflowStepMountPoint):
         The index is the index of the port in the port list.  If there is only one
         provides port for this step then the index can be ignored.
         '''
-        return self._g2392_muscle_hmf.gias_osimmodel._model  # http://physiomeproject.org/workflow/1.0/rdf-schema#osimmodel
+        customiser = self._customiser()
+        # the model may still be being written in the background
+        customiser.wait_for_write()
+        return customiser.gias_osimmodel._model  # http://physiomeproject.org/workflow/1.0/rdf-schema#osimmodel
 
     def configure(self):
         '''
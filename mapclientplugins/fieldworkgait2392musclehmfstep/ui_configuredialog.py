@@ -18,13 +18,13 @@ from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor,
 from PySide6.QtWidgets import (QAbstractButton, QApplication, QCheckBox, QComboBox,
     QDialog, QDialogButtonBox, QFormLayout, QGridLayout,
     QGroupBox, QHBoxLayout, QLabel, QLineEdit,
-    QPushButton, QSizePolicy, QWidget)
+    QPushButton, QSizePolicy, QSpinBox, QWidget)
 
 class Ui_ConfigureDialog(object):
     def setupUi(self, ConfigureDialog):
         if not ConfigureDialog.objectName():
             ConfigureDialog.setObjectName(u"ConfigureDialog")
-        ConfigureDialog.resize(550, 303)
+        ConfigureDialog.resize(550, 580)
         self.gridLayout = QGridLayout(ConfigureDialog)
         self.gridLayout.setObjectName(u"gridLayout")
         self.configGroupBox = QGroupBox(ConfigureDialog)
@@ -112,6 +112,132 @@ class Ui_ConfigureDialog(object):
 
         self.formLayout.setWidget(4, QFormLayout.FieldRole, self.checkBox_update_knee_splines)
 
+        self.label_parallel = QLabel(self.configGroupBox)
+        self.label_parallel.setObjectName(u"label_parallel")
+
+        self.formLayout.setWidget(7, QFormLayout.LabelRole, self.label_parallel)
+
+        self.comboBox_parallel = QComboBox(self.configGroupBox)
+        self.comboBox_parallel.setObjectName(u"comboBox_parallel")
+
+        self.formLayout.setWidget(7, QFormLayout.FieldRole, self.comboBox_parallel)
+
+        self.label_parallel_workers = QLabel(self.configGroupBox)
+        self.label_parallel_workers.setObjectName(u"label_parallel_workers")
+
+        self.formLayout.setWidget(8, QFormLayout.LabelRole, self.label_parallel_workers)
+
+        self.spinBox_parallel_workers = QSpinBox(self.configGroupBox)
+        self.spinBox_parallel_workers.setObjectName(u"spinBox_parallel_workers")
+        self.spinBox_parallel_workers.setMaximum(256)
+
+        self.formLayout.setWidget(8, QFormLayout.FieldRole, self.spinBox_parallel_workers)
+
+        self.label_fitting_profile = QLabel(self.configGroupBox)
+        self.label_fitting_profile.setObjectName(u"label_fitting_profile")
+
+        self.formLayout.setWidget(9, QFormLayout.LabelRole, self.label_fitting_profile)
+
+        self.comboBox_fitting_profile = QComboBox(self.configGroupBox)
+        self.comboBox_fitting_profile.setObjectName(u"comboBox_fitting_profile")
+
+        self.formLayout.setWidget(9, QFormLayout.FieldRole, self.comboBox_fitting_profile)
+
+        self.label_maxit = QLabel(self.configGroupBox)
+        self.label_maxit.setObjectName(u"label_maxit")
+
+        self.formLayout.setWidget(10, QFormLayout.LabelRole, self.label_maxit)
+
+        self.spinBox_maxit = QSpinBox(self.configGroupBox)
+        self.spinBox_maxit.setObjectName(u"spinBox_maxit")
+        self.spinBox_maxit.setMinimum(1)
+        self.spinBox_maxit.setMaximum(10000)
+
+        self.formLayout.setWidget(10, QFormLayout.FieldRole, self.spinBox_maxit)
+
+        self.label_xtol = QLabel(self.configGroupBox)
+        self.label_xtol.setObjectName(u"label_xtol")
+
+        self.formLayout.setWidget(11, QFormLayout.LabelRole, self.label_xtol)
+
+        self.lineEdit_xtol = QLineEdit(self.configGroupBox)
+        self.lineEdit_xtol.setObjectName(u"lineEdit_xtol")
+
+        self.formLayout.setWidget(11, QFormLayout.FieldRole, self.lineEdit_xtol)
+
+        self.label_sobw = QLabel(self.configGroupBox)
+        self.label_sobw.setObjectName(u"label_sobw")
+
+        self.formLayout.setWidget(12, QFormLayout.LabelRole, self.label_sobw)
+
+        self.lineEdit_sobw = QLineEdit(self.configGroupBox)
+        self.lineEdit_sobw.setObjectName(u"lineEdit_sobw")
+
+        self.formLayout.setWidget(12, QFormLayout.FieldRole, self.lineEdit_sobw)
+
+        self.label_host_elems = QLabel(self.configGroupBox)
+        self.label_host_elems.setObjectName(u"label_host_elems")
+
+        self.formLayout.setWidget(13, QFormLayout.LabelRole, self.label_host_elems)
+
+        self.horizontalLayout_host_elems = QHBoxLayout()
+        self.horizontalLayout_host_elems.setObjectName(u"horizontalLayout_host_elems")
+        self.spinBox_host_elems_x = QSpinBox(self.configGroupBox)
+        self.spinBox_host_elems_x.setObjectName(u"spinBox_host_elems_x")
+        self.spinBox_host_elems_x.setMinimum(1)
+        self.spinBox_host_elems_x.setMaximum(8)
+
+        self.horizontalLayout_host_elems.addWidget(self.spinBox_host_elems_x)
+
+        self.spinBox_host_elems_y = QSpinBox(self.configGroupBox)
+        self.spinBox_host_elems_y.setObjectName(u"spinBox_host_elems_y")
+        self.spinBox_host_elems_y.setMinimum(1)
+        self.spinBox_host_elems_y.setMaximum(8)
+
+        self.horizontalLayout_host_elems.addWidget(self.spinBox_host_elems_y)
+
+        self.spinBox_host_elems_z = QSpinBox(self.configGroupBox)
+        self.spinBox_host_elems_z.setObjectName(u"spinBox_host_elems_z")
+        self.spinBox_host_elems_z.setMinimum(1)
+        self.spinBox_host_elems_z.setMaximum(8)
+
+        self.horizontalLayout_host_elems.addWidget(self.spinBox_host_elems_z)
+
+
+        self.formLayout.setLayout(13, QFormLayout.FieldRole, self.horizontalLayout_host_elems)
+
+        self.label_reg_sample = QLabel(self.configGroupBox)
+        self.label_reg_sample.setObjectName(u"label_reg_sample")
+
+        self.formLayout.setWidget(14, QFormLayout.LabelRole, self.label_reg_sample)
+
+        self.spinBox_reg_sample = QSpinBox(self.configGroupBox)
+        self.spinBox_reg_sample.setObjectName(u"spinBox_reg_sample")
+        self.spinBox_reg_sample.setMinimum(10)
+        self.spinBox_reg_sample.setMaximum(100000)
+
+        self.formLayout.setWidget(14, QFormLayout.FieldRole, self.spinBox_reg_sample)
+
+        self.label_rmse_target = QLabel(self.configGroupBox)
+        self.label_rmse_target.setObjectName(u"label_rmse_target")
+
+        self.formLayout.setWidget(15, QFormLayout.LabelRole, self.label_rmse_target)
+
+        self.lineEdit_rmse_target = QLineEdit(self.configGroupBox)
+        self.lineEdit_rmse_target.setObjectName(u"lineEdit_rmse_target")
+
+        self.formLayout.setWidget(15, QFormLayout.FieldRole, self.lineEdit_rmse_target)
+
+        self.label_min_improvement = QLabel(self.configGroupBox)
+        self.label_min_improvement.setObjectName(u"label_min_improvement")
+
+        self.formLayout.setWidget(16, QFormLayout.LabelRole, self.label_min_improvement)
+
+        self.lineEdit_min_improvement = QLineEdit(self.configGroupBox)
+        self.lineEdit_min_improvement.setObjectName(u"lineEdit_min_improvement")
+
+        self.formLayout.setWidget(16, QFormLayout.FieldRole, self.lineEdit_min_improvement)
+
 
         self.gridLayout.addWidget(self.configGroupBox, 0, 0, 1, 1)
 
@@ -128,7 +254,19 @@ class Ui_ConfigureDialog(object):
         QWidget.setTabOrder(self.checkBox_write_osim_file, self.checkBox_static_vas)
         QWidget.setTabOrder(self.checkBox_static_vas, self.lineEdit_osim_output_dir)
         QWidget.setTabOrder(self.lineEdit_osim_output_dir, self.pushButton_osim_output_dir)
-        QWidget.setTabOrder(self.pushButton_osim_output_dir, self.buttonBox)
+        QWidget.setTabOrder(self.pushButton_osim_output_dir, self.comboBox_parallel)
+        QWidget.setTabOrder(self.comboBox_parallel, self.spinBox_parallel_workers)
+        QWidget.setTabOrder(self.spinBox_parallel_workers, self.comboBox_fitting_profile)
+        QWidget.setTabOrder(self.comboBox_fitting_profile, self.spinBox_maxit)
+        QWidget.setTabOrder(self.spinBox_maxit, self.lineEdit_xtol)
+        QWidget.setTabOrder(self.lineEdit_xtol, self.lineEdit_sobw)
+        QWidget.setTabOrder(self.lineEdit_sobw, self.spinBox_host_elems_x)
+        QWidget.setTabOrder(self.spinBox_host_elems_x, self.spinBox_host_elems_y)
+        QWidget.setTabOrder(self.spinBox_host_elems_y, self.spinBox_host_elems_z)
+        QWidget.setTabOrder(self.spinBox_host_elems_z, self.spinBox_reg_sample)
+        QWidget.setTabOrder(self.spinBox_reg_sample, self.lineEdit_rmse_target)
+        QWidget.setTabOrder(self.lineEdit_rmse_target, self.lineEdit_min_improvement)
+        QWidget.setTabOrder(self.lineEdit_min_improvement, self.buttonBox)
 
         self.retranslateUi(ConfigureDialog)
         self.buttonBox.accepted.connect(ConfigureDialog.accept)
@@ -151,5 +289,16 @@ class Ui_ConfigureDialog(object):
         self.pushButton_osim_output_dir.setText(QCoreApplication.translate("ConfigureDialog", u"...", None))
         self.label_2.setText(QCoreApplication.translate("ConfigureDialog", u"Update Knee Splines:", None))
         self.checkBox_update_knee_splines.setText("")
+        self.label_parallel.setText(QCoreApplication.translate("ConfigureDialog", u"Parallel fitting:", None))
+        self.label_parallel_workers.setText(QCoreApplication.translate("ConfigureDialog", u"Parallel workers:", None))
+        self.spinBox_parallel_workers.setSpecialValueText(QCoreApplication.translate("ConfigureDialog", u"auto", None))
+        self.label_fitting_profile.setText(QCoreApplication.translate("ConfigureDialog", u"Fitting profile:", None))
+        self.label_maxit.setText(QCoreApplication.translate("ConfigureDialog", u"Max. fit iterations:", None))
+        self.label_xtol.setText(QCoreApplication.translate("ConfigureDialog", u"Fit tolerance:", None))
+        self.label_sobw.setText(QCoreApplication.translate("ConfigureDialog", u"Smoothing weight:", None))
+        self.label_host_elems.setText(QCoreApplication.translate("ConfigureDialog", u"Host mesh elements:", None))
+        self.label_reg_sample.setText(QCoreApplication.translate("ConfigureDialog", u"Registration points:", None))
+        self.label_rmse_target.setText(QCoreApplication.translate("ConfigureDialog", u"Target RMSE:", None))
+        self.label_min_improvement.setText(QCoreApplication.translate("ConfigureDialog", u"Min. improvement:", None))
     # retranslateUi
 
@@ -38,4 +38,9 @@ setup(name=u'mapclientplugins.fieldworkgait2392musclehmfstep',
     package_data=package_data,
     zip_safe=False,
     install_requires=requires,
+    entry_points={
+        'console_scripts': [
+            'gait2392-muscle-hmf = mapclientplugins.fieldworkgait2392musclehmfstep.cli:main',
+        ],
+    },
     )
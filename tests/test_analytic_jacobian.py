@@ -0,0 +1,112 @@
+"""
+The analytic Jacobians of the host mesh fit objectives agree with finite
+differences
+"""
+import contextlib
+import io
+import unittest
+
+import numpy as np
+from gias3.fieldwork.field import geometric_field_fitter as GFF
+
+from mapclientplugins.fieldworkgait2392musclehmfstep import gait2392musclecusthmf as hmf
+
+# sobolev weights of _host_mesh_fit_points
+SOB_W = 1e-5 * np.array([1.0] * 7 + [2.0, 2.0, 3.0])
+
+
+def _fd_jacobian(func, x, h=1e-6):
+    """
+    Central difference Jacobian of func with respect to the flattened x
+    """
+    x = np.array(x, dtype=float)
+    flat = x.ravel()
+    cols = []
+    for i in range(flat.size):
+        step = np.zeros_like(flat)
+        step[i] = h
+        cols.append(
+            (func((flat + step).reshape(x.shape)) -
+             func((flat - step).reshape(x.shape))) / (2.0 * h)
+        )
+    return np.array(cols).T
+
+
+def _slave_jacobian(slave_func, x):
+    """
+    Jacobian of slave_func with respect to the flattened (n, 3) points x
+    from its jac attribute, as assembled by _host_mesh_fit_points
+    """
+    rows, e = slave_func.jac(x)
+    J = np.zeros((len(rows), x.size))
+    for d in range(3):
+        J[np.arange(len(rows)), rows * 3 + d] = 2.0 * e[:, d]
+    return J
+
+
+class AnalyticJacobianTest(unittest.TestCase):
+
+    def test_slave_funcs(self):
+        rng = np.random.default_rng(0)
+        target = rng.standard_normal((60, 3))
+        x = target[:40] + 0.05 * rng.standard_normal((40, 3))
+        funcs = {
+            'correspondence': hmf._make_sq_dist_func(target[:40]),
+            'nearest': hmf._make_nearest_sq_dist_func(target),
+            'symmetric': hmf._make_nearest_sq_dist_func(target, True),
+        }
+        for name, slave_func in funcs.items():
+            np.testing.assert_allclose(
+                _slave_jacobian(slave_func, x),
+                _fd_jacobian(slave_func, x),
+                rtol=1e-5, atol=1e-7, err_msg=name
+            )
+
+    def test_sobolev_penalty(self):
+        host_mesh = hmf._osim_segment_data('pelvis', 'mm')[5]
+        rng = np.random.default_rng(1)
+        P = host_mesh.field_parameters + rng.standard_normal(
+            host_mesh.field_parameters.shape
+        )
+        penalty, jacobian = hmf._make_sobolev_penalty(
+            host_mesh, [4, 4, 4], SOB_W
+        )
+        gias3_penalty = GFF.makeSobelovPenalty3D(host_mesh, [4, 4, 4], SOB_W)
+        np.testing.assert_allclose(penalty(P), gias3_penalty(P), rtol=1e-10)
+        np.testing.assert_allclose(
+            jacobian(P).toarray(), _fd_jacobian(penalty, P, h=1e-3),
+            rtol=1e-5, atol=1e-9
+        )
+
+    def test_fit(self):
+        surf_pts = hmf._osim_segment_data('femur_l', 'mm')[0]
+        # an affine transform and smooth displacement
+        centre = surf_pts.mean(0)
+        size = np.ptp(surf_pts, axis=0).max()
+        x = (surf_pts - centre) / size
+        x = x + 0.01 * np.sin(2.0 * np.pi * x[:, [1, 2, 0]])
+        rng = np.random.default_rng(2)
+        affine = np.eye(3) + 0.03 * rng.standard_normal((3, 3))
+        targ_pts = (x @ affine.T) * size + centre + [1.0, -2.0, 0.5]
+        seg_fits = {}
+        for analytic_jacobian in (True, False):
+            with contextlib.redirect_stdout(io.StringIO()):
+                seg_fits[analytic_jacobian] = hmf._fit_segment(
+                    'femur_l', targ_pts, params={
+                        'analytic_jacobian': analytic_jacobian, 'xtol': 1e-4,
+                    }
+                )
+        analytic, fd = seg_fits[True], seg_fits[False]
+        # from the same registered start, which has a much larger error
+        self.assertLess(fd[1], 0.5 * analytic[5][-1]['trace'][0]['rmse'])
+        # the fits stop at slightly different points within xtol
+        self.assertAlmostEqual(analytic[1], fd[1], delta=1e-2 * fd[1])
+        muscle_diff = np.sqrt(((analytic[0] - fd[0]) ** 2).sum(1))
+        self.assertLess(muscle_diff.max(), 0.1)
+        # only the analytic Jacobian is counted and traced
+        self.assertGreater(analytic[5][-1]['njev'], 0)
+        self.assertEqual(fd[5][-1]['njev'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""
+Argument handling of the command line interface
+"""
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from mapclientplugins.fieldworkgait2392musclehmfstep import cli
+from mapclientplugins.fieldworkgait2392musclehmfstep import gait2392musclecusthmf as hmf
+
+
+class CliTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.output_dir = os.path.join(self.tmp_dir, 'out')
+        self.calls = []
+        patcher = mock.patch.object(
+            hmf, 'customise_cohort', self._customise_cohort
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _customise_cohort(self, subjects, config, workers=None,
+                          output_dir=None):
+        self.calls.append((subjects, config, workers, output_dir))
+        return [
+            dict(hmf._subject_record(s[0]), output=s[0] + '.osim', time=1.0)
+            for s in subjects
+        ]
+
+    def _main(self, *argv):
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            return cli.main(['-o', self.output_dir] + list(argv))
+
+    def _usage_error(self, *argv):
+        with self.assertRaises(SystemExit) as cm:
+            self._main(*argv)
+        self.assertEqual(cm.exception.code, 2)
+
+    def test_no_subjects(self):
+        self._usage_error()
+        self.assertEqual(self.calls, [])
+
+    def test_subjects_and_manifest(self):
+        config_file = os.path.join(self.tmp_dir, 'config.json')
+        with open(config_file, 'w') as f:
+            json.dump({'osim_output_name': '{subject}_cust.osim'}, f)
+        manifest = os.path.join(self.tmp_dir, 'manifest.json')
+        with open(manifest, 'w') as f:
+            json.dump([{'id': 2, 'll': 'b.pkl', 'osim': 'b.osim'}], f)
+
+        status = self._main(
+            '-c', config_file, '-w', '0', '-s', 's1', 'a.pkl', 'a.osim',
+            '-m', manifest
+        )
+        self.assertEqual(status, 0)
+        subjects, config, workers, output_dir = self.calls[0]
+        # manifest paths are relative to the manifest
+        self.assertEqual(subjects, [
+            ('s1', 'a.pkl', 'a.osim'),
+            ('2', os.path.join(self.tmp_dir, 'b.pkl'),
+             os.path.join(self.tmp_dir, 'b.osim')),
+        ])
+        self.assertEqual(config['osim_output_name'], '{subject}_cust.osim')
+        # missing options take their default values
+        self.assertEqual(config['in_unit'], 'mm')
+        self.assertEqual(workers, 0)
+        self.assertEqual(output_dir, self.output_dir)
+        with open(os.path.join(self.output_dir, 'records.json')) as f:
+            records = json.load(f)
+        self.assertEqual([r['subject'] for r in records], ['s1', '2'])
+
+    def test_duplicate_output_paths(self):
+        # checked before the output directory is made or any subject is
+        # customised
+        self._usage_error(
+            '-s', 's1', 'a.pkl', 'a.osim', '-s', 's1', 'b.pkl', 'b.osim'
+        )
+        self.assertEqual(self.calls, [])
+        self.assertFalse(os.path.exists(self.output_dir))
+
+    def test_fitting_error_is_not_a_usage_error(self):
+        with mock.patch.object(
+                hmf, 'customise_cohort', side_effect=ValueError('bad fit')):
+            with self.assertRaisesRegex(ValueError, 'bad fit'):
+                self._main('-s', 's1', 'a.pkl', 'a.osim')
+
+    def test_failed_subject_exit_status(self):
+        def customise_cohort(subjects, config, **kwargs):
+            return [hmf._subject_record(s[0], 'Traceback') for s in subjects]
+
+        with mock.patch.object(hmf, 'customise_cohort', customise_cohort):
+            self.assertEqual(self._main('-s', 's1', 'a.pkl', 'a.osim'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+The closed-form rigid + scale registration recovers a known similarity
+transform
+"""
+import unittest
+
+import numpy as np
+from gias3.common import transform3D
+
+from mapclientplugins.fieldworkgait2392musclehmfstep import gait2392musclecusthmf as hmf
+
+
+def _similarity(source, t):
+    """
+    source transformed by rigid + scale parameters t about its mean
+    """
+    return transform3D.transformRigidScale3DAboutP(source, t, source.mean(0))
+
+
+class ClosedFormRegistrationTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # anisotropic so that the rotation is well determined
+        self.source = rng.standard_normal((500, 3)) * [60.0, 30.0, 10.0]
+
+    def test_recovers_transform(self):
+        for t_true in ([12.0, -4.0, 30.0, 0.3, -0.5, 1.2, 1.15],
+                       [0.0, 0.0, 0.0, -2.0, 0.2, -3.0, 0.8],
+                       [-5.0, 2.0, 1.0, 0.1, np.pi / 2 - 1e-3, 0.4, 1.0]):
+            target = _similarity(self.source, t_true)
+            t = hmf._similarity_rigid_scale(self.source, target)
+            self.assertEqual(len(t), 7)
+            self.assertAlmostEqual(t[6], t_true[6], places=9)
+            np.testing.assert_allclose(t[:3], t_true[:3], atol=1e-8)
+            # angles may differ by an equivalent set, the points may not
+            np.testing.assert_allclose(
+                _similarity(self.source, t), target, rtol=0, atol=1e-8
+            )
+            t_refined = hmf._closed_form_rigid_scale(
+                self.source, target, refine=True, sample=100
+            )
+            np.testing.assert_allclose(
+                _similarity(self.source, t_refined), target, rtol=0, atol=1e-5
+            )
+
+    def test_noisy_points(self):
+        t_true = [3.0, 1.0, -2.0, -0.4, 0.25, 2.5, 0.9]
+        rng = np.random.default_rng(1)
+        target = _similarity(self.source, t_true) + \
+            0.5 * rng.standard_normal(self.source.shape)
+        t = hmf._similarity_rigid_scale(self.source, target)
+        self.assertAlmostEqual(t[6], t_true[6], delta=1e-2)
+        errors = np.sqrt(
+            ((_similarity(self.source, t) -
+              _similarity(self.source, t_true)) ** 2).sum(1)
+        )
+        self.assertLess(errors.max(), 0.5)
+
+    def test_no_reflection(self):
+        # the best fit to a mirrored cloud is a rotation, not a reflection
+        target = self.source * [1.0, 1.0, -1.0]
+        t = hmf._similarity_rigid_scale(self.source, target)
+        R = transform3D.transformRigid3D(np.eye(3), np.hstack([0, 0, 0, t[3:6]]))
+        self.assertGreater(np.linalg.det(R), 0.0)
+        self.assertGreater(t[6], 0.0)
+
+    def test_rotation_angles(self):
+        for angles in ([0.3, -0.5, 1.2], [2.5, 1.0, -2.9], [0.0, 0.0, 0.0]):
+            R = transform3D.transformRigid3D(
+                np.eye(3), np.hstack([0, 0, 0, angles])
+            ).T
+            np.testing.assert_allclose(hmf._rotation_angles(R), angles,
+                                       atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+customise_cohort records a failed subject and carries on with the others
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from mapclientplugins.fieldworkgait2392musclehmfstep import gait2392musclecusthmf as hmf
+from mapclientplugins.fieldworkgait2392musclehmfstep.constants import DEFAULT_CONFIG
+
+# lower limb models, passed through to the customiser
+LL = object()
+FAILING_LL = object()
+
+
+class _Customiser(object):
+    """
+    Stand-in for gait2392MuscleCustomiser that fails to customise
+    FAILING_LL and writes an empty model otherwise
+    """
+
+    def __init__(self, config, ll=None, osimmodel=None):
+        self.ll = ll
+        self.host_x0 = {}
+        self.seg_fits = {}
+
+    def load_osim_model(self, filename):
+        pass
+
+    def customise(self):
+        if self.ll is FAILING_LL:
+            raise RuntimeError('fit failed')
+        self.seg_fits = {'pelvis': (None, 0.5)}
+
+    def host_mesh_params(self):
+        return {}
+
+    def fit_traces(self):
+        return {}
+
+    def timings_dict(self):
+        return {}
+
+    def write_outputs(self, filename=None):
+        with open(filename, 'w'):
+            pass
+        return filename, None
+
+
+class CustomiseCohortTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+        patcher = mock.patch.object(
+            hmf, 'gait2392MuscleCustomiser', _Customiser
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _customise(self, subjects):
+        return hmf.customise_cohort(
+            subjects, dict(DEFAULT_CONFIG), workers=0,
+            output_dir=self.output_dir
+        )
+
+    def test_failed_subject(self):
+        records = self._customise([
+            ('s1', LL, 's1.osim'),
+            ('s2', FAILING_LL, 's2.osim'),
+            ('s3', LL, 's3.osim'),
+        ])
+        self.assertEqual([r['subject'] for r in records], ['s1', 's2', 's3'])
+        self.assertIsNone(records[0]['error'])
+        self.assertIn('fit failed', records[1]['error'])
+        self.assertIsNone(records[1]['output'])
+        self.assertIsNone(records[2]['error'])
+        self.assertEqual(records[2]['rmse'], {'pelvis': 0.5})
+        self.assertEqual(
+            sorted(os.listdir(self.output_dir)), ['s1.osim', 's3.osim']
+        )
+
+    def test_duplicate_output_path(self):
+        subjects = [('s1', LL, 'a.osim'), ('s1', LL, 'b.osim')]
+        # a sequence is checked before any subject is customised
+        with self.assertRaises(ValueError):
+            self._customise(subjects)
+        self.assertEqual(os.listdir(self.output_dir), [])
+
+        # for subjects read lazily, the clash is recorded as the later
+        # subject's error and the other subjects are customised
+        records = self._customise(
+            s for s in subjects + [('s2', LL, 'c.osim')]
+        )
+        self.assertEqual([r['subject'] for r in records], ['s1', 's1', 's2'])
+        self.assertIsNone(records[0]['error'])
+        self.assertIn('would both be written to', records[1]['error'])
+        self.assertIsNone(records[2]['error'])
+        self.assertEqual(
+            sorted(os.listdir(self.output_dir)), ['s1.osim', 's2.osim']
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+"""
+Host mesh fit progress is logged at debug level instead of printed
+"""
+import contextlib
+import io
+import unittest
+
+from mapclientplugins.fieldworkgait2392musclehmfstep import gait2392musclecusthmf as hmf
+
+SEGMENT = 'femur_l'
+PARAMS = {'xtol': 1e-4, 'levels': [300], 'maxit': 5}
+
+
+class FitLoggingTest(unittest.TestCase):
+
+    def _fit(self):
+        targ_pts = hmf._osim_segment_data(SEGMENT, 'mm')[0] * 1.02
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            hmf._fit_segment(SEGMENT, targ_pts, params=PARAMS)
+        return out.getvalue()
+
+    def test_no_output(self):
+        self.assertEqual(self._fit(), '')
+
+    def test_debug_log(self):
+        with self.assertLogs(hmf.log, 'DEBUG') as cm:
+            self.assertEqual(self._fit(), '')
+        # the coarse level and the final fit
+        final = [m for m in cm.output if 'final slave rms' in m]
+        self.assertEqual(len(final), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+FitResultCache keys and least recently used eviction
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from mapclientplugins.fieldworkgait2392musclehmfstep import gait2392musclecusthmf as hmf
+
+
+class FitResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+    def test_key(self):
+        targ_pts = np.arange(30, dtype=float).reshape((10, 3))
+        key = hmf.FitResultCache.make_key('pelvis', targ_pts, 'mm')
+        self.assertEqual(
+            key, hmf.FitResultCache.make_key('pelvis', targ_pts.copy(), 'mm')
+        )
+        # parameters equal to the defaults give the same key
+        self.assertEqual(key, hmf.FitResultCache.make_key(
+            'pelvis', targ_pts, 'mm', params={'maxit': hmf.HMF_PARAMS['maxit']}
+        ))
+
+        moved = targ_pts.copy()
+        moved[3, 1] += 1e-9
+        host_x0 = np.zeros((3, 64, 1))
+        changed = [
+            hmf.FitResultCache.make_key('femur_l', targ_pts, 'mm'),
+            hmf.FitResultCache.make_key('pelvis', moved, 'mm'),
+            hmf.FitResultCache.make_key('pelvis', targ_pts.reshape((3, 10)), 'mm'),
+            hmf.FitResultCache.make_key('pelvis', targ_pts, 'm'),
+            hmf.FitResultCache.make_key('pelvis', targ_pts, 'mm', host_x0),
+            hmf.FitResultCache.make_key(
+                'pelvis', targ_pts, 'mm', params={'sobw': 1e-4}
+            ),
+            hmf.FitResultCache.make_key(
+                'pelvis', targ_pts, 'mm',
+                params=hmf.FittingProfile(host_elems=[2, 2, 2])
+            ),
+        ]
+        with mock.patch.object(
+                hmf, 'FIT_CACHE_VERSION', hmf.FIT_CACHE_VERSION + 1):
+            changed.append(hmf.FitResultCache.make_key('pelvis', targ_pts, 'mm'))
+        self.assertEqual(len(set(changed + [key])), len(changed) + 1)
+
+    def test_get_put(self):
+        cache = hmf.FitResultCache(os.path.join(self.cache_dir, 'fits'))
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', x=np.arange(3), rmse=0.5)
+        res = cache.get('a')
+        np.testing.assert_array_equal(res['x'], np.arange(3))
+        self.assertEqual(float(res['rmse']), 0.5)
+
+        # unreadable entries are misses
+        with open(os.path.join(cache.cache_dir, 'b.npz'), 'wb') as f:
+            f.write(b'not an archive')
+        self.assertIsNone(cache.get('b'))
+
+        cache.clear()
+        self.assertIsNone(cache.get('a'))
+
+    def _entries(self, cache):
+        return sorted(
+            os.path.splitext(fn)[0] for fn in os.listdir(cache.cache_dir)
+        )
+
+    def _set_mtime(self, cache, key, mtime):
+        os.utime(os.path.join(cache.cache_dir, key + '.npz'), (mtime, mtime))
+
+    def test_lru_eviction(self):
+        cache = hmf.FitResultCache(self.cache_dir)
+        x = np.zeros(1000)
+        for i, key in enumerate('abc'):
+            cache.put(key, x=x)
+            self._set_mtime(cache, key, 1000 + i)
+        entry_size = os.path.getsize(os.path.join(self.cache_dir, 'a.npz'))
+        self.assertEqual(self._entries(cache), ['a', 'b', 'c'])
+
+        # getting "a" makes "b" the least recently used
+        cache.get('a')
+        cache.max_size = 3 * entry_size
+        cache.put('d', x=x)
+        self.assertEqual(self._entries(cache), ['a', 'c', 'd'])
+
+        self._set_mtime(cache, 'a', 1000)
+        cache.max_size = 2 * entry_size
+        cache.evict()
+        self.assertEqual(self._entries(cache), ['c', 'd'])
+
+        # no limit
+        cache.max_size = None
+        for key in 'efg':
+            cache.put(key, x=x)
+        self.assertEqual(len(self._entries(cache)), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Early termination criteria of the host mesh fits and the convergence trace
+returned by _fit_segment
+"""
+import contextlib
+import io
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from mapclientplugins.fieldworkgait2392musclehmfstep import gait2392musclecusthmf as hmf
+
+SEGMENT = 'femur_l'
+# a tolerance the fit converges to within maxit
+PARAMS = {'xtol': 1e-4}
+
+
+def _warped_target(points):
+    """
+    The points under a fixed affine transform and smooth displacement
+    """
+    centre = points.mean(0)
+    size = np.ptp(points, axis=0).max()
+    x = (points - centre) / size
+    disp = 0.01 * np.sin(2.0 * np.pi * x[:, [1, 2, 0]])
+    affine = np.array([[1.05, 0.02, 0.0],
+                       [-0.02, 0.97, 0.03],
+                       [0.0, -0.03, 1.02]])
+    return ((x + disp) @ affine.T) * size + centre + [2.0, -1.0, 3.0]
+
+
+class FitTerminationTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        surf_pts = hmf._osim_segment_data(SEGMENT, 'mm')[0]
+        cls.targ_pts = _warped_target(surf_pts)
+        cls.converged = cls._fit()
+
+    @classmethod
+    def _fit(cls, callback=None, cache=None, **params):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return hmf._fit_segment(
+                SEGMENT, cls.targ_pts, params=dict(PARAMS, **params),
+                cache=cache, callback=callback
+            )
+
+    def _final_fit(self, seg_fit, terminated):
+        fit_trace = seg_fit[5]
+        self.assertEqual(len(fit_trace), 1)
+        self.assertEqual(fit_trace[0]['terminated'], terminated)
+        self.assertEqual(fit_trace[0]['rmse'], seg_fit[1])
+        return fit_trace[0]
+
+    def test_converged(self):
+        fit = self._final_fit(self.converged, None)
+        self.assertEqual(fit['points'], len(self.targ_pts))
+        trace = fit['trace']
+        self.assertEqual(
+            [t['iteration'] for t in trace], list(range(len(trace)))
+        )
+        self.assertGreater(trace[0]['rmse'], trace[-1]['rmse'])
+        self.assertEqual(trace[0]['step_norm'], 0.0)
+
+    def test_maxit(self):
+        fit = self._final_fit(self._fit(maxit=2), 'maxit')
+        # the initial parameters and two iterations
+        self.assertEqual(len(fit['trace']), 3)
+
+    def test_rmse_target(self):
+        initial_rmse = self.converged[5][0]['trace'][0]['rmse']
+        rmse_target = 0.5 * (initial_rmse + self.converged[1])
+        seg_fit = self._fit(rmse_target=rmse_target)
+        self._final_fit(seg_fit, 'rmse_target')
+        self.assertLessEqual(seg_fit[1], rmse_target)
+        self.assertGreater(seg_fit[1], self.converged[1])
+
+    def test_min_improvement(self):
+        fit = self._final_fit(self._fit(min_improvement=0.5), 'min_improvement')
+        self.assertLess(len(fit['trace']), len(self.converged[5][0]['trace']))
+
+    def test_plateau(self):
+        fit = self._final_fit(
+            self._fit(plateau_window=1, plateau_tol=0.5), 'plateau'
+        )
+        self.assertLess(len(fit['trace']), len(self.converged[5][0]['trace']))
+
+    def test_max_time(self):
+        self._final_fit(self._fit(max_time=1e-6), 'max_time')
+
+    def test_callback(self):
+        calls = []
+
+        def callback(iteration, rmse, step_norm):
+            calls.append((iteration, rmse, step_norm))
+            return iteration == 1
+
+        fit = self._final_fit(self._fit(callback), 'callback')
+        self.assertEqual([c[0] for c in calls], [0, 1])
+        self.assertEqual(
+            calls, [(t['iteration'], t['rmse'], t['step_norm'])
+                    for t in fit['trace']]
+        )
+
+    def test_cached_trace(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        cache = hmf.FitResultCache(cache_dir)
+
+        # fits stopped by a callback are not cached
+        self._fit(lambda *args: True, cache=cache)
+        self.assertEqual(self._fit(cache=cache, maxit=2)[5][0]['terminated'],
+                         'maxit')
+        key = cache.make_key(
+            SEGMENT, self.targ_pts, 'mm', params=dict(PARAMS, maxit=2)
+        )
+        self.assertIsNotNone(cache.get(key))
+        key = cache.make_key(SEGMENT, self.targ_pts, 'mm', params=PARAMS)
+        self.assertIsNone(cache.get(key))
+
+        seg_fit = self._fit(cache=cache)
+        cached = self._fit(lambda *args: True, cache=cache)
+        self.assertEqual(cached[5], seg_fit[5])
+        self.assertEqual(cached[1], seg_fit[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
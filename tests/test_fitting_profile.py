@@ -0,0 +1,78 @@
+"""
+Fitting profiles from presets, dicts and the segment overrides of a config
+"""
+import unittest
+
+from mapclientplugins.fieldworkgait2392musclehmfstep.fittingprofile import (
+    PRESETS, FittingProfile, fitting_profile, segment_fitting_profile,
+)
+
+
+class FittingProfileTest(unittest.TestCase):
+
+    def test_fitting_profile(self):
+        self.assertEqual(fitting_profile(), PRESETS['default'])
+        self.assertEqual(fitting_profile('fast'), PRESETS['fast'])
+        # a copy that can be changed without changing the preset
+        profile = fitting_profile('accurate')
+        self.assertIsNot(profile, PRESETS['accurate'])
+        profile.levels.append(1000)
+        self.assertEqual(PRESETS['accurate'].levels, [500])
+
+        # dicts update the default preset
+        profile = fitting_profile({'maxit': 20})
+        self.assertEqual(profile, PRESETS['default'].updated({'maxit': 20}))
+        self.assertEqual(profile.sobw, PRESETS['default'].sobw)
+
+        profile = FittingProfile(maxit=3)
+        self.assertIs(fitting_profile(profile), profile)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            fitting_profile('slow')
+        with self.assertRaises(ValueError):
+            fitting_profile({'max_it': 20})
+        with self.assertRaises(ValueError):
+            fitting_profile({'objective': 'closest'})
+        with self.assertRaises(ValueError):
+            fitting_profile({'host_elems': [2, 2]})
+
+    def test_segment_fitting_profile(self):
+        config = {
+            'fitting_profile': 'fast',
+            'segment_fitting_profiles': {
+                'pelvis': 'accurate',
+                'femur_l': {'maxit': 20},
+            },
+        }
+        self.assertEqual(
+            segment_fitting_profile(config, 'pelvis'), PRESETS['accurate']
+        )
+        # dicts update the profile of the config
+        self.assertEqual(
+            segment_fitting_profile(config, 'femur_l'),
+            PRESETS['fast'].updated({'maxit': 20})
+        )
+        self.assertEqual(
+            segment_fitting_profile(config, 'tibia_r'), PRESETS['fast']
+        )
+
+        # hmf_params override the profiles of all segments
+        config['hmf_params'] = {'maxit': 7, 'sobw': 1e-4}
+        for seg in ('pelvis', 'femur_l', 'tibia_r'):
+            profile = segment_fitting_profile(config, seg)
+            self.assertEqual(profile.maxit, 7)
+            self.assertEqual(profile.sobw, 1e-4)
+        self.assertEqual(
+            segment_fitting_profile(config, 'pelvis').host_elems,
+            PRESETS['accurate'].host_elems
+        )
+
+    def test_default_config(self):
+        self.assertEqual(segment_fitting_profile({}, 'pelvis'), fitting_profile())
+        config = {'fitting_profile': {'maxit': 5}, 'segment_fitting_profiles': None}
+        self.assertEqual(segment_fitting_profile(config, 'pelvis').maxit, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+The command line interface and fitting module are imported without the MAP
+Client step or Qt, and the step is registered when the MAP Client loads the
+plugin
+"""
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import unittest
+
+REPO_DIR = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+)
+PACKAGE = 'mapclientplugins.fieldworkgait2392musclehmfstep'
+
+
+def _run(code):
+    """
+    Run code in a new interpreter and return what it prints as JSON
+    """
+    path = [REPO_DIR] + [p for p in [os.environ.get('PYTHONPATH')] if p]
+    env = dict(
+        os.environ, PYTHONPATH=os.pathsep.join(path),
+        QT_QPA_PLATFORM='offscreen'
+    )
+    out = subprocess.run(
+        [sys.executable, '-c', textwrap.dedent(code)], env=env, cwd=REPO_DIR,
+        check=True, stdout=subprocess.PIPE,
+    ).stdout
+    return json.loads(out.decode().splitlines()[-1])
+
+
+def _has_module(name):
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ImportError:
+        return False
+
+
+class HeadlessImportTest(unittest.TestCase):
+
+    def test_cli_does_not_import_qt(self):
+        modules = _run('''
+            import json, sys
+            import {0}.cli
+            import {0}.gait2392musclecusthmf
+            print(json.dumps(sorted(sys.modules)))
+        '''.format(PACKAGE))
+        self.assertIn(PACKAGE + '.cli', modules)
+        gui = [
+            m for m in modules
+            if m.split('.')[0] in ('PySide6', 'mapclient') or
+            m in (PACKAGE + '.step', PACKAGE + '.resources_rc',
+                  PACKAGE + '.configuredialog')
+        ]
+        self.assertEqual(gui, [])
+
+    @unittest.skipUnless(
+        _has_module('mapclient') and _has_module('PySide6'),
+        'requires the MAP Client'
+    )
+    def test_step_registered_when_loaded_by_mapclient(self):
+        # the package imported before the MAP Client loads its plugins
+        plugins = _run('''
+            import json
+            import {0} as plugin
+            from importlib import import_module
+            from mapclient.mountpoints.workflowstep import WorkflowStepMountPoint
+            before = [p.__name__ for p in WorkflowStepMountPoint.plugins]
+            # as read by the MAP Client plugin manager
+            module = import_module('{0}')
+            module.__stepname__
+            after = [p.__name__ for p in WorkflowStepMountPoint.plugins]
+            print(json.dumps([before, after]))
+        '''.format(PACKAGE))
+        self.assertEqual(plugins[0], [])
+        self.assertEqual(plugins[1], ['FieldworkGait2392MuscleHMFStep'])
+
+
+if __name__ == '__main__':
+    unittest.main()
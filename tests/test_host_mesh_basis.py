@@ -0,0 +1,104 @@
+"""
+Precomputed host mesh basis matrices and refined host meshes evaluate the
+same embedded points as gias3
+"""
+import unittest
+
+import numpy as np
+from gias3.fieldwork.field import geometric_field
+
+from mapclientplugins.fieldworkgait2392musclehmfstep import gait2392musclecusthmf as hmf
+
+
+def _gias3_points(host_mesh, xi_points, params):
+    """
+    Points at xi_points in host_mesh with params evaluated by gias3
+    """
+    mat_points = [[int(e), xi] for e, xi in zip(xi_points.elems, xi_points.xi)]
+    evaluator = geometric_field.makeGeometricFieldEvaluatorSparse(
+        host_mesh, None, mat_points=mat_points
+    )
+    return evaluator(params).T
+
+
+def _perturbed(params, seed=0):
+    """
+    Host mesh parameters with a random smooth-ish perturbation
+    """
+    rng = np.random.default_rng(seed)
+    scale = np.ptp(params[:, :, 0], axis=1).max()
+    return params + 0.02 * scale * rng.standard_normal(params.shape)
+
+
+class HostMeshBasisTest(unittest.TestCase):
+
+    def test_basis_matches_gias3(self):
+        for name in sorted(hmf.VALID_SEGS):
+            for host_elems in (None, [2, 2, 2]):
+                (_, _, surf_xi, muscle_xi, _,
+                 host_mesh) = hmf._osim_segment_data(name, 'mm', host_elems)
+                surf_basis, muscle_basis = hmf._osim_segment_basis(
+                    name, 'mm', host_elems
+                )
+                params = _perturbed(host_mesh.field_parameters)
+                for xi_points, basis in ((surf_xi, surf_basis),
+                                         (muscle_xi, muscle_basis)):
+                    points = hmf._make_host_mesh_evaluator(
+                        host_mesh, xi_points, basis
+                    )(params).T
+                    np.testing.assert_allclose(
+                        points, _gias3_points(host_mesh, xi_points, params),
+                        rtol=0, atol=1e-9
+                    )
+
+    def test_as_xi_points(self):
+        xi_points = hmf._osim_segment_data('pelvis', 'mm')[2]
+        mat_points = [[e, xi] for e, xi in zip(xi_points.elems, xi_points.xi)]
+        for mp in (mat_points, np.column_stack([xi_points.elems, xi_points.xi])):
+            converted = hmf._as_xi_points(mp)
+            np.testing.assert_array_equal(converted.elems, xi_points.elems)
+            np.testing.assert_array_equal(converted.xi, xi_points.xi)
+
+    def test_refined_mesh_keeps_embedded_points(self):
+        for name in ('pelvis', 'tibia_l'):
+            (surf_pts, muscle_pts, surf_xi, muscle_xi, _,
+             host_mesh) = hmf._osim_segment_data(name, 'mm')
+            for host_elems in ([2, 2, 2], [1, 2, 3]):
+                (_, _, ref_surf_xi, ref_muscle_xi, _,
+                 refined) = hmf._osim_segment_data(name, 'mm', host_elems)
+                self.assertEqual(
+                    len(refined.ensemble_field_function.mesh.elements),
+                    np.prod(host_elems)
+                )
+                for xi_points, ref_xi_points in ((surf_xi, ref_surf_xi),
+                                                 (muscle_xi, ref_muscle_xi)):
+                    self.assertTrue(np.all(ref_xi_points.xi >= -1e-9))
+                    self.assertTrue(np.all(ref_xi_points.xi <= 1 + 1e-9))
+                    np.testing.assert_allclose(
+                        _gias3_points(
+                            refined, ref_xi_points, refined.field_parameters
+                        ),
+                        _gias3_points(
+                            host_mesh, xi_points, host_mesh.field_parameters
+                        ),
+                        rtol=0, atol=1e-6
+                    )
+
+            # also for a deformed host mesh
+            deformed = hmf._copy_host_mesh(host_mesh)
+            deformed.set_field_parameters(
+                _perturbed(host_mesh.field_parameters)
+            )
+            refined = hmf._refine_host_mesh(deformed, [2, 2, 2])
+            np.testing.assert_allclose(
+                _gias3_points(
+                    refined, hmf._refine_xi(muscle_xi, [2, 2, 2]),
+                    refined.field_parameters
+                ),
+                _gias3_points(deformed, muscle_xi, deformed.field_parameters),
+                rtol=0, atol=1e-6
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+"""
+Round trip of a knee spline entry through muscle_geometry_delta and
+apply_muscle_geometry_delta.
+"""
+import json
+import os
+import unittest
+
+import numpy as np
+
+from mapclientplugins.fieldworkgait2392musclehmfstep import gait2392musclecusthmf as hmf
+
+SPLINE_PATH_POINT = 'vas_int_r-P4'
+
+
+def _knee_spline_params():
+    """
+    SimmSpline parameters of a gait2392 knee MovingPathPoint: 17 knots for
+    x and y and 2 for z, with the spline points of the bundled tibia_r data
+    """
+    prefix = SPLINE_PATH_POINT + '-simmspline-'
+    with open(os.path.join(hmf.DATA_DIR, 'tibia_r.muscles.txt'), 'r') as f:
+        coords = np.array([
+            [float(v) for v in line.split()[1:4]]
+            for line in f if line.startswith(prefix)
+        ])
+    knots = np.linspace(-2.0944, 0.1745, len(coords))
+    return [
+        np.array([knots, coords[:, 0]]),
+        np.array([knots, coords[:, 1]]),
+        np.array([knots[[0, -1]], coords[:2, 2]]),
+    ]
+
+
+def _geometry(spline_params):
+    return {
+        'path_points': {},
+        'splines': {SPLINE_PATH_POINT: [a.tolist() for a in spline_params]},
+        'muscles': {},
+    }
+
+
+class _PathPoint(object):
+
+    def __init__(self, params=None):
+        self.isMovingPathPoint = params is not None
+        if params is not None:
+            self.params = [np.array(a) for a in params]
+
+    def getSimmSplineParams(self):
+        if not self.isMovingPathPoint:
+            raise TypeError('not a MovingPathPoint')
+        return [a.copy() for a in self.params]
+
+    def updateSimmSplineParams(self, x_params=None, y_params=None,
+                               z_params=None):
+        self.params = [np.array(a) for a in (x_params, y_params, z_params)]
+
+
+class _OsimMuscle(object):
+
+    def getOptimalFiberLength(self):
+        return 0.087
+
+    def getTendonSlackLength(self):
+        return 0.136
+
+
+class _Muscle(object):
+
+    def __init__(self, path_points):
+        self.path_points = path_points
+        self._osimMuscle = _OsimMuscle()
+
+
+class _Model(object):
+
+    def __init__(self, spline_params):
+        self.path_point = _PathPoint(spline_params)
+        self.muscles = {
+            'vas_int_r': _Muscle({
+                'vas_int_r-P1': _PathPoint(),
+                SPLINE_PATH_POINT: self.path_point,
+            }),
+        }
+
+
+class MuscleGeometryDeltaTest(unittest.TestCase):
+
+    def test_knee_spline_round_trip(self):
+        params_0 = _knee_spline_params()
+        self.assertEqual(
+            [a.shape for a in params_0], [(2, 17), (2, 17), (2, 2)]
+        )
+        params = [a.copy() for a in params_0]
+        params[0][1] += 0.001
+        params[1][1] -= 0.002
+
+        geometry_0 = _geometry(params_0)
+        delta = hmf.muscle_geometry_delta(geometry_0, _geometry(params))
+        self.assertEqual(list(delta['splines']), [SPLINE_PATH_POINT])
+        self.assertEqual(
+            hmf.muscle_geometry_delta(geometry_0, geometry_0)['splines'], {}
+        )
+
+        # as written and loaded by write/load_muscle_geometry_delta
+        delta = json.loads(json.dumps(delta))
+        model = _Model(params_0)
+        hmf.apply_muscle_geometry_delta(model, delta, path_point_index={})
+        for a, b in zip(model.path_point.params, params):
+            np.testing.assert_allclose(a, b, rtol=0.0, atol=1e-12)
+
+        applied = _geometry(model.path_point.getSimmSplineParams())
+        self.assertEqual(
+            hmf.muscle_geometry_delta(_geometry(params), applied)['splines'],
+            {}
+        )
+
+    def test_spline_selection(self):
+        model = _Model(_knee_spline_params())
+        splines = [
+            ('vas_int_r', '4'), ('vas_int_r', '1'), ('vas_int_r', '9'),
+            ('vas_int_l', '4'),
+        ]
+        geometry = hmf.muscle_geometry(model, {}, splines)
+        self.assertEqual(list(geometry['splines']), [SPLINE_PATH_POINT])
+        self.assertEqual(hmf.muscle_geometry(model, {})['splines'], {})
+
+        config = {'update_knee_splines': False}
+        self.assertEqual(hmf.knee_spline_path_points(config), [])
+        config = {'update_knee_splines': True, 'knee_splines': None}
+        self.assertEqual(
+            len(hmf.knee_spline_path_points(config)),
+            2 * len(hmf.TIBIA_SPLINE_PATH_POINTS)
+        )
+        config['knee_splines'] = [['vas_int_{}', 4]]
+        self.assertEqual(
+            hmf.knee_spline_path_points(config, 'r'), [('vas_int_r', '4')]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+The segment host mesh fits give the same results in each parallel mode
+"""
+import contextlib
+import io
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+from mapclientplugins.fieldworkgait2392musclehmfstep import gait2392musclecusthmf as hmf
+from mapclientplugins.fieldworkgait2392musclehmfstep.constants import DEFAULT_CONFIG, VALID_PARALLEL_MODES
+
+
+def _lower_limb():
+    """
+    Stand-in LowerLimbAtlas with the reference bone surfaces under a
+    different affine transform per segment
+    """
+    models = {}
+    for si, (seg, model_name) in enumerate(hmf.SEGMENT_MODELS):
+        points = hmf._osim_segment_data(seg, 'mm')[0]
+        affine = np.eye(3) + 0.02 * np.array([[1, si, 0],
+                                              [0, -1, 1],
+                                              [-si, 0, 2]])
+        targ_pts = points @ affine.T + [si, -1.0, 2.0]
+        models[model_name] = SimpleNamespace(gf=SimpleNamespace(
+            get_all_point_positions=lambda p=targ_pts: p
+        ))
+    return SimpleNamespace(models=models)
+
+
+class ParallelFittingTest(unittest.TestCase):
+
+    def test_modes_give_same_results(self):
+        ll = _lower_limb()
+        seg_fits = {}
+        for mode in VALID_PARALLEL_MODES:
+            config = dict(
+                DEFAULT_CONFIG, parallel=mode, parallel_workers=2,
+                fitting_profile='fast'
+            )
+            cust = hmf.gait2392MuscleCustomiser(config, ll=ll)
+            with contextlib.redirect_stdout(io.StringIO()):
+                seg_fits[mode] = cust.fit_segments()
+
+        serial = seg_fits['serial']
+        self.assertEqual(
+            sorted(serial), sorted(seg for seg, _ in hmf.SEGMENT_MODELS)
+        )
+        for mode in VALID_PARALLEL_MODES[1:]:
+            for seg, seg_fit in seg_fits[mode].items():
+                expected = serial[seg]
+                np.testing.assert_array_equal(seg_fit[0], expected[0])
+                self.assertEqual(seg_fit[1], expected[1])
+                np.testing.assert_array_equal(seg_fit[2], expected[2])
+                np.testing.assert_array_equal(
+                    seg_fit[3].field_parameters,
+                    expected[3].field_parameters
+                )
+                self.assertEqual(
+                    [f['nfev'] for f in seg_fit[5]],
+                    [f['nfev'] for f in expected[5]]
+                )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Binary reference data archives hold the same data as the text files
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from mapclientplugins.fieldworkgait2392musclehmfstep import gait2392musclecusthmf as hmf
+
+
+class ReferenceArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        # build archives in a copy of the data so that the package data is
+        # not changed
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.data_dir = os.path.join(tmp_dir, 'fieldwork_geometry')
+        shutil.copytree(hmf.DATA_DIR, self.data_dir)
+        patcher = mock.patch.object(hmf, 'DATA_DIR', self.data_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        hmf.clear_reference_cache()
+        self.addCleanup(hmf.clear_reference_cache)
+
+    def test_archive_matches_text(self):
+        for name in sorted(hmf.VALID_SEGS):
+            text = hmf._read_segment_text(name)
+            hmf.build_reference_archive(name)
+            self.assertTrue(hmf._segment_archive_is_current(name))
+            archive = hmf._read_segment_archive(name)
+
+            self.assertEqual(sorted(archive), sorted(text))
+            for key in ('surf_pts', 'surf_xi', 'muscle_pts', 'muscle_xi'):
+                self.assertIsInstance(archive[key], np.memmap)
+                np.testing.assert_array_equal(archive[key], text[key])
+            self.assertEqual(
+                list(archive['muscle_labels']), list(text['muscle_labels'])
+            )
+            self.assertEqual(archive['host_mesh'].name, text['host_mesh'].name)
+            np.testing.assert_array_equal(
+                archive['host_mesh'].get_field_parameters(),
+                text['host_mesh'].get_field_parameters()
+            )
+
+    def test_loaded_segment_data(self):
+        name = 'tibia_l'
+        text_data = hmf._load_osim_segment_data(name, 'm')
+        hmf.build_reference_archive(name)
+        archive_data = hmf._load_osim_segment_data(name, 'm')
+        self._assert_segment_data_equal(archive_data, text_data)
+
+        # a text file newer than the archive is read instead of it
+        surf_file = hmf._segment_text_files(name)['surf_pts']
+        archive_mtime = os.path.getmtime(hmf._segment_archive_file(name))
+        os.utime(surf_file, (archive_mtime + 10, archive_mtime + 10))
+        self.assertFalse(hmf._segment_archive_is_current(name))
+        with mock.patch.object(hmf, '_read_segment_archive') as read_archive:
+            stale_data = hmf._load_osim_segment_data(name, 'm')
+        read_archive.assert_not_called()
+        self._assert_segment_data_equal(stale_data, text_data)
+
+    def _assert_segment_data_equal(self, data, expected):
+        np.testing.assert_array_equal(data[0], expected[0])
+        np.testing.assert_array_equal(data[1], expected[1])
+        for xi, expected_xi in ((data[2], expected[2]), (data[3], expected[3])):
+            np.testing.assert_array_equal(xi.elems, expected_xi.elems)
+            np.testing.assert_array_equal(xi.xi, expected_xi.xi)
+        self.assertEqual(data[4], expected[4])
+        np.testing.assert_array_equal(
+            data[5].get_field_parameters(), expected[5].get_field_parameters()
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
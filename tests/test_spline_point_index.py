@@ -0,0 +1,51 @@
+"""
+Indexing of the knee spline points in the reference muscle point labels
+"""
+import unittest
+
+import numpy as np
+
+from mapclientplugins.fieldworkgait2392musclehmfstep import gait2392musclecusthmf as hmf
+
+
+class SplinePointIndexTest(unittest.TestCase):
+
+    def test_order(self):
+        labels = [
+            'vas_med_l-P5-simmspline-10',
+            'vas_med_l-P1',
+            'vas_med_l-P5-simmspline-2',
+            'rect_fem_l-P3-simmspline-01',
+            'vas_med_l-P5-simmspline-01',
+            'vas-x_l-P2-simmspline-3',
+            'vas_med_l-P4-simmspline-1',
+            'vas-x_l-P2-simmspline-1',
+        ]
+        index = hmf._spline_point_index(labels)
+        self.assertEqual(sorted(index), [
+            ('rect_fem_l', '3'), ('vas-x_l', '2'), ('vas_med_l', '4'),
+            ('vas_med_l', '5'),
+        ])
+        # ascending spline point numbers, not label order or string order
+        np.testing.assert_array_equal(index[('vas_med_l', '5')], [4, 2, 0])
+        np.testing.assert_array_equal(index[('vas-x_l', '2')], [7, 5])
+        np.testing.assert_array_equal(index[('vas_med_l', '4')], [6])
+        self.assertEqual(index[('rect_fem_l', '3')].dtype.kind, 'i')
+        self.assertEqual(hmf._spline_point_index(['a-P1', 'b']), {})
+
+    def test_reference_labels(self):
+        for side in ('l', 'r'):
+            labels = hmf._osim_segment_data('tibia_' + side, 'mm')[4]
+            index = hmf._spline_point_index(labels)
+            splines = hmf.knee_spline_path_points(
+                {'update_knee_splines': True}, side
+            )
+            self.assertEqual(len(splines), len(hmf.TIBIA_SPLINE_PATH_POINTS))
+            for muscle, point in splines:
+                spline = index[(muscle, str(point))]
+                numbers = [int(labels[i].rsplit('-', 1)[1]) for i in spline]
+                self.assertEqual(numbers, list(range(1, len(spline) + 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
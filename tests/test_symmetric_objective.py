@@ -0,0 +1,50 @@
+"""
+The symmetric "nearest" objective in the coarse and final host mesh fits and
+the RMSE it reports
+"""
+import contextlib
+import io
+import unittest
+from unittest import mock
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from mapclientplugins.fieldworkgait2392musclehmfstep import gait2392musclecusthmf as hmf
+
+SEGMENT = 'femur_l'
+PARAMS = {
+    'objective': 'nearest', 'symmetric': True, 'levels': [300],
+    'xtol': 1e-4,
+}
+
+
+class SymmetricObjectiveTest(unittest.TestCase):
+
+    def test_symmetric_fit(self):
+        surf_pts = hmf._osim_segment_data(SEGMENT, 'mm')[0]
+        # a target with other points than the reference surface
+        rng = np.random.default_rng(0)
+        targ_pts = surf_pts[rng.permutation(len(surf_pts))[::2]] * 1.05
+
+        make_func = hmf._make_nearest_sq_dist_func
+        with mock.patch.object(
+                hmf, '_make_nearest_sq_dist_func', wraps=make_func) as m, \
+                contextlib.redirect_stdout(io.StringIO()):
+            seg_fit = hmf._fit_segment(SEGMENT, targ_pts, params=PARAMS)
+
+        # the coarse level and the final fit
+        self.assertEqual(m.call_count, 2)
+        for args, kwargs in m.call_args_list:
+            self.assertTrue(args[1])
+        self.assertEqual(len(seg_fit[5]), 2)
+
+        # the reported RMSE is of the fitted to target distances only
+        cust_surf_pts = seg_fit[2]
+        d = cKDTree(targ_pts).query(cust_surf_pts)[0]
+        self.assertAlmostEqual(seg_fit[1], np.sqrt((d ** 2).mean()))
+        self.assertEqual(seg_fit[5][-1]['rmse'], seg_fit[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+"""
+Warm starting a segment fit from the host mesh parameters of a previous fit
+"""
+import contextlib
+import io
+import unittest
+
+import numpy as np
+
+from mapclientplugins.fieldworkgait2392musclehmfstep import gait2392musclecusthmf as hmf
+
+SEGMENT = 'femur_l'
+# a tolerance the fit converges to within maxit, and a coarse level
+PARAMS = {'xtol': 1e-4, 'levels': [300]}
+
+
+def _warped_target(points):
+    """
+    The points under a fixed affine transform and smooth displacement
+    """
+    centre = points.mean(0)
+    size = np.ptp(points, axis=0).max()
+    x = (points - centre) / size
+    disp = 0.01 * np.sin(2.0 * np.pi * x[:, [1, 2, 0]])
+    affine = np.array([[1.05, 0.02, 0.0],
+                       [-0.02, 0.97, 0.03],
+                       [0.0, -0.03, 1.02]])
+    return ((x + disp) @ affine.T) * size + centre + [2.0, -1.0, 3.0]
+
+
+def _fit(targ_pts, host_x0=None):
+    timings = hmf.StageTimings()
+    with contextlib.redirect_stdout(io.StringIO()):
+        seg_fit = hmf._fit_segment(
+            SEGMENT, targ_pts, host_x0=host_x0, params=PARAMS,
+            timings=timings
+        )
+    return seg_fit, timings.to_list()
+
+
+class WarmStartTest(unittest.TestCase):
+
+    def test_warm_start_from_previous_fit(self):
+        surf_pts = hmf._osim_segment_data(SEGMENT, 'mm')[0]
+        targ_pts = _warped_target(surf_pts)
+
+        cold, cold_stages = _fit(targ_pts)
+        host_x_opt = cold[3].field_parameters
+        warm, warm_stages = _fit(targ_pts, host_x_opt)
+
+        cold_fits = [r for r in cold_stages if r['stage'] == 'host_mesh_fit']
+        warm_fits = [r for r in warm_stages if r['stage'] == 'host_mesh_fit']
+        self.assertEqual(len(cold_fits), 1 + len(PARAMS['levels']))
+        # no registration or coarse levels
+        self.assertEqual(len(warm_fits), 1)
+        self.assertNotIn(
+            'rigid_scale_registration', [r['stage'] for r in warm_stages]
+        )
+        cold_nfev = sum(r['nfev'] for r in cold_fits)
+        self.assertLessEqual(warm_fits[0]['nfev'] * 3, cold_nfev)
+        self.assertLessEqual(warm[1], cold[1] * 1.01)
+
+
+if __name__ == '__main__':
+    unittest.main()